@@ -0,0 +1,192 @@
+"""Concurrency limits per cost class, so expensive routes can't starve cheap ones.
+
+Each worker serves every route from the same few SQLite threads
+(TWEETOR_DB_THREADS). A flood of 1000-flit feed pages (leaderboard.js),
+sitemaps or server-rendered pages would otherwise take all of them, and
+/api/handle or a presence heartbeat would queue behind it. Expensive
+endpoints are put in a cost class (ENDPOINTS, classify()) that runs at
+most `limit` requests at once per worker. Up to `queue` more wait their
+turn, for at most `wait` seconds. Everything else is admitted straight
+away.
+
+A request that can't be served in time is shed with 503 and a
+Retry-After header rather than left to time out. That happens when the
+queue is full, when the wait runs out, or when the wait the queue
+predicts (from the class's recent service times) is already longer than
+`wait`. So shedding is fast: a request that would have waited too long
+isn't made to wait first.
+
+An admitted request in a class has a deadline, `deadline` seconds after
+it arrived. helpers.get_db() gives its connections a progress handler
+that interrupts any statement still running past it. The request then
+ends with the same 503, and the SQLite thread goes back to serving
+others. PostgreSQL queries run to completion.
+
+    TWEETOR_ADMISSION=0           turn all of this off
+    TWEETOR_BULK_CONCURRENCY      bulk requests at once per worker (default 1)
+    TWEETOR_RENDER_CONCURRENCY    render requests at once per worker (default 2)
+
+0 for a class's concurrency admits that class without limit.
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from flask import g, has_request_context, render_template, request
+
+import metrics
+
+enabled = os.getenv("TWEETOR_ADMISSION", "1") != "0"
+
+# Feed pages longer than this are bulk reads
+BULK_FEED_LIMIT = 100
+
+# Statements between progress handler calls, each one a clock read
+PROGRESS_STEPS = 1000
+
+
+class Shed(Exception):
+    def __init__(self, retry_after):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+
+class CostClass:
+    def __init__(self, name, limit, queue, wait, deadline):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.wait = wait
+        self.deadline = deadline
+        self.active = 0
+        self.waiting = 0
+        self.shed = 0
+        # Moving average of how long an admitted request takes
+        self.service = 0.0
+        self.condition = threading.Condition()
+
+    def expected_wait(self):
+        """How long a request joining the queue now should wait for a slot."""
+        return (self.waiting + 1) * self.service / self.limit
+
+    def admit(self):
+        """Take a slot, waiting for one if need be, or raise Shed."""
+        if not self.limit:
+            return
+        with self.condition:
+            if self.active < self.limit:
+                self.active += 1
+                return
+            expected = self.expected_wait()
+            if self.waiting >= self.queue or expected > self.wait:
+                self.shed += 1
+                raise Shed(max(1, math.ceil(expected)))
+            self.waiting += 1
+            try:
+                admitted = self.condition.wait_for(lambda: self.active < self.limit, self.wait)
+            finally:
+                self.waiting -= 1
+            if not admitted:
+                self.shed += 1
+                raise Shed(max(1, math.ceil(self.expected_wait())))
+            self.active += 1
+
+    def release(self, elapsed):
+        if not self.limit:
+            return
+        with self.condition:
+            self.active -= 1
+            self.service = elapsed if not self.service else 0.8 * self.service + 0.2 * elapsed
+            self.condition.notify()
+
+
+CLASSES = {
+    # Whole-table reads: long feed pages and the sitemap
+    "bulk": CostClass("bulk", int(os.getenv("TWEETOR_BULK_CONCURRENCY", "1")), queue=8, wait=2.0, deadline=10.0),
+    # Pages rendered on the server, and the feed's own pages
+    "render": CostClass("render", int(os.getenv("TWEETOR_RENDER_CONCURRENCY", "2")), queue=32, wait=1.0, deadline=5.0),
+}
+
+# Endpoint -> cost class; endpoints not listed are admitted straight away
+ENDPOINTS = {
+    "sitemap": "bulk",
+    "get_flits": "render",
+    "singleflit": "render",
+    "user_profile": "render",
+    "profanity": "render",
+    "reported_flits": "render",
+    "notifications_page": "render",
+    "hashtag_flits": "render",
+}
+
+
+def classify():
+    """The current request's CostClass, or None."""
+    name = ENDPOINTS.get(request.endpoint)
+    if request.endpoint == "get_flits" and request.args.get("limit", "").isdigit():
+        if int(request.args["limit"]) > BULK_FEED_LIMIT:
+            name = "bulk"
+    return CLASSES.get(name)
+
+
+def deadline():
+    """When the current request's queries should give up, or None."""
+    if has_request_context():
+        return g.get("admission_deadline")
+    return None
+
+
+def interrupt_after(db, at):
+    """Have SQLite interrupt db's statements once time.monotonic() passes at."""
+    db.set_progress_handler(lambda: time.monotonic() > at, PROGRESS_STEPS)
+
+
+def admit():
+    cost = classify()
+    if cost is None:
+        return
+    arrived = time.monotonic()
+    cost.admit()
+    g.admission = (cost, arrived)
+    g.admission_deadline = arrived + cost.deadline
+
+
+def release(exc):
+    admitted = g.pop("admission", None)
+    if admitted is not None:
+        cost, arrived = admitted
+        cost.release(time.monotonic() - arrived)
+
+
+def shed(e):
+    response = render_template("error.html", error="Tweetor is busy, please try again."), 503
+    return (*response, {"Retry-After": str(e.retry_after)})
+
+
+def interrupted(e):
+    # The progress handler stopping a statement at the request's deadline
+    at = deadline()
+    if at is None or str(e) != "interrupted" or time.monotonic() <= at:
+        raise e
+    cost, _ = g.admission
+    cost.shed += 1
+    return shed(Shed(max(1, math.ceil(cost.expected_wait()))))
+
+
+def init_app(app):
+    if not enabled:
+        return
+    # Ahead of the other hooks, so a shed request costs as little as possible
+    app.before_request_funcs.setdefault(None, []).insert(0, admit)
+    app.teardown_request(release)
+    app.register_error_handler(Shed, shed)
+    app.register_error_handler(sqlite3.OperationalError, interrupted)
+    for name in CLASSES:
+        metrics.collect(f"tweetor_admission_{name}_active", f"{name} requests being served.", "gauge",
+                        lambda name=name: CLASSES[name].active)
+        metrics.collect(f"tweetor_admission_{name}_waiting", f"{name} requests waiting for a slot.", "gauge",
+                        lambda name=name: CLASSES[name].waiting)
+        metrics.collect(f"tweetor_admission_{name}_shed_total", f"{name} requests answered 503.", "counter",
+                        lambda name=name: CLASSES[name].shed)
@@ -6,7 +6,8 @@ import requests
 import datetime
 import time
 import os
-from functools import wraps
+import threading
+from functools import lru_cache, wraps
 from dotenv import load_dotenv
 from flask import (
     Flask,
@@ -21,17 +22,33 @@ from flask import (
     
 )
 from flask_cors import CORS
-from flask_session import Session
 from flask_sitemapper import Sitemapper
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from geventwebsocket.exceptions import WebSocketError
+from limits import parse as parse_limit
+import admission
+import assets
+import columnar
+import deletions
 import helpers
-from mixpanel import Mixpanel
+import dm_channel
+import fragments
+import hashtags
+import metrics
+import moderation
+import notifications
+import query_log
+import scheduler
+import storage
+import threads
+from sqlite_session import SQLiteSessionInterface
+from write_queue import WriteQueueFull
 from werkzeug.wrappers.response import Response
 import logging
 import io
-from PIL import Image, ImageDraw, ImageFont
 import re
+from urllib.parse import urlparse
 from flask_wtf.csrf import CSRFProtect
 import json
 load_dotenv()
@@ -39,32 +56,90 @@ SIGHT_ENGINE_SECRET = os.getenv("SIGHT_ENGINE_SECRET")
 MIXPANEL_SECRET = os.getenv("MIXPANEL_SECRET")
 TENOR_SECRET = os.getenv("TENOR_SECRET")
 
-mp = Mixpanel(MIXPANEL_SECRET)
+# Made by track() on first use, see there
+mp = None
 
+# Everything here is cheap: extensions are bound to app in create_app(), and
+# whatever reads the data or opens a connection waits for first use
 app = Flask(__name__)
-app.secret_key = "pigeonmast3r"
-cors = CORS(app)
-csrf = CSRFProtect(app)
+cors = CORS()
+csrf = CSRFProtect()
+sitemapper = Sitemapper()
+limiter = Limiter(get_remote_address)
+DATABASE = "tweetor.db"
 
-app.config["CORS_HEADERS"] = "Content-Type"
+staff_accounts = ["ItsMe", "Dude_Pog"]
 
-sitemapper = Sitemapper()
-sitemapper.init_app(app)
+# Handle -> when it last polled /api/render_online, in ns, until
+# sweep_presence() drops it
+online_users = {}
+ONLINE_SECONDS = 13
 
-# Rate limiting
-limiter = Limiter(get_remote_address, app=app)
 
-# Set up the session object
-app.config["SESSION_PERMANENT"] = False
-app.config["SESSION_TYPE"] = "filesystem"
-Session(app)
-DATABASE = "tweetor.db"
+def create_app() -> Flask:
+    """Bind app to its extensions, session store and write queue, once.
 
-staff_accounts = ["ItsMe", "Dude_Pog"]
+    server.py calls this in each worker; importing this module calls it too,
+    so `app` is ready for the test client and `flask run`. Later calls return
+    the same app.
+    """
+    # Some modules still use tweetor.db directly, see storage.py
+    storage.require_sqlite()
+    if "limiter" in app.extensions:
+        return app
+    app.secret_key = "pigeonmast3r"
+    cors.init_app(app)
+    csrf.init_app(app)
+
+    app.config["CORS_HEADERS"] = "Content-Type"
+
+    # Concurrency limits and 503s for expensive endpoints, see admission.py
+    admission.init_app(app)
+    # Per-endpoint timings for /metrics, off unless TWEETOR_METRICS_SAMPLE is
+    # set; initialised after admission so queueing counts in its timings
+    metrics.init_app(app)
+    # Compiled templates are kept on disk, see fragments.py
+    fragments.init_app(app)
+    # Hashed, precompressed static files when built, see assets.py
+    assets.init_app(app)
+
+    sitemapper.init_app(app)
+
+    # Rate limiting
+    limiter.init_app(app)
+
+    # Set up the session object
+    app.config["SESSION_PERMANENT"] = False
+    app.session_interface = SQLiteSessionInterface()
+    # sessions.db is shared, so one worker expires its rows, see scheduler.py
+    scheduler.job(60, leader_only=True, name="expire_sessions")(app.session_interface.expire)
+    scheduler.job(300, leader_only=True, name="checkpoint_sessions")(app.session_interface.checkpoint)
+
+    # Optional group commit for flit and DM inserts, see write_queue.py
+    if os.getenv("TWEETOR_WRITE_QUEUE"):
+        helpers.use_write_queue(
+            max_batch=int(os.getenv("TWEETOR_WRITE_BATCH", "64")),
+            max_delay=int(os.getenv("TWEETOR_WRITE_DELAY_MS", "5")) / 1000,
+        )
+    return app
 
-print(time.time_ns())
 
-online_users = {}
+def track(distinct_id, event, properties):
+    global mp
+    if mp is None:
+        # mixpanel pulls in httpx and rich, a tenth of a second of import
+        # that most requests never need
+        from mixpanel import Consumer, Mixpanel
+
+        mp = Mixpanel(MIXPANEL_SECRET, consumer=metrics.TimedConsumer(Consumer()))
+    mp.track(distinct_id, event, properties)
+
+
+@lru_cache(maxsize=None)
+def profane_words() -> frozenset:
+    # Manual profanity list, read on the first submit_flit
+    with open("profane_words.json") as f:
+        return frozenset(word.lower() for word in json.load(f))
 
 
 @app.before_request
@@ -92,28 +167,38 @@ def block_ips():
 @sitemapper.include()
 @app.route("/")
 def home() -> str:
-    # Get a connection to the database
-    db = helpers.get_db()
+    # The feed itself is fetched page by page from /api/get_flits by
+    # flitRenderer.js, the page is only the shell
+    return render_template("home.html", loggedIn="handle" in session)
 
+@app.errorhandler(WriteQueueFull)
+def write_queue_full(e) -> tuple[str, int]:
+    return render_template("error.html", error="Tweetor is busy, please try again."), 503
 
-    # Create a cursor to interact with the database
-    cursor = db.cursor()
-    # Check if the user is logged in and is an admin
-    if "username" in session and session["handle"] == "admin":
-        # If admin, retrieve all flits regardless of content
-        cursor.execute("SELECT * FROM flits ORDER BY timestamp DESC")
-    else:
-        # If not admin, retrieve only non-profane flits
-        cursor.execute(
-            "SELECT * FROM flits WHERE profane_flit = 'no' ORDER BY timestamp DESC"
-        )
 
-    # Fetch the results of the SQL query
-    flits = cursor.fetchall()
+@app.route("/healthz")
+def healthz() -> str:
+    # Used by the load balancer and server.py deployments, touches the database
+    # so a worker with a broken or locked database is taken out of rotation
+    storage.ping()
+    return "ok"
 
+@app.route("/metrics")
+def metrics_endpoint() -> Response | tuple[str, int]:
+    if not metrics.authorized():
+        return render_template("error.html", error="You don't have permission to access this page."), 403
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
-    # Render the home template
-    return render_template("home.html", flits=flits, loggedIn="handle" in session)
+
+@app.route("/admin/queries")
+def query_report() -> str | Response:
+    if session.get("handle") != "admin":
+        return render_template(
+            "error.html", error="You don't have permission to access this page."
+        )
+    if not query_log.enabled:
+        return Response("Query profiling is off, set TWEETOR_SLOW_QUERY_MS to enable it.\n", mimetype="text/plain")
+    return Response(query_log.report(), mimetype="text/plain")
 
 ## APIs
 @app.route("/api/handle")
@@ -126,10 +211,7 @@ def flitAPI():
         flit_id = int(request.args.get("flit_id"))
     except ValueError:
         return jsonify("Flit ID is invalid")
-    db = helpers.get_db()
-    c = db.cursor()
-    c.execute('SELECT * FROM flits WHERE id=?', (flit_id,))
-    flit = c.fetchone()
+    flit = storage.flit(flit_id)
 
     if flit is None:
         return "profane"
@@ -144,11 +226,6 @@ def flitAPI():
 
 @app.route("/api/get_flits")
 def get_flits() -> Response | str:
-    skip = request.args.get("skip")
-    limit = request.args.get("limit")
-    db = helpers.get_db()
-    cursor = db.cursor()
-
     try:
         limit = int(request.args.get("limit"))
         skip = int(request.args.get("skip"))
@@ -158,23 +235,72 @@ def get_flits() -> Response | str:
 
     current_user_handle = helpers.get_user_handle()
     if "username" in session:
-        blocked_handles = helpers.get_blocked_users(current_user_handle)
-        app.logger.info(f'Blocked handles: {blocked_handles}')
+        blocked_handles = storage.blocked_handles(current_user_handle)
+        app.logger.debug("Blocked handles: %s", blocked_handles)
+
+    flits = storage.feed_page(current_user_handle, limit, skip)
+    return feed_response(flits)
+
+
+def feed_response(flits) -> Response:
+    """flits as JSON, one object each or in columns with ?format=columnar."""
+    if request.args.get("format") == "columnar":
+        return jsonify(columnar.encode(flits))
+    return jsonify([dict(flit) for flit in flits])
+
+
+@app.route("/api/hashtag/<tag>")
+def hashtag_flits(tag) -> Response:
+    try:
+        limit = min(int(request.args.get("limit", 10)), 100)
+        before = int(request.args["before"]) if "before" in request.args else None
+    except ValueError:
+        limit = 10
+        before = None
+
+    db = helpers.get_db()
+    flits = hashtags.timeline(db, tag, helpers.get_user_handle(), before, limit)
+    db.close()
+    return feed_response(flits)
+
+
+@app.route("/api/trending")
+def trending() -> Response:
+    try:
+        limit = min(int(request.args.get("limit", 10)), hashtags.TOP)
+    except ValueError:
+        limit = 10
+    return jsonify([{"tag": tag, "count": count} for tag, count in hashtags.trending(limit)])
+
+
+@app.route("/api/notifications")
+def api_notifications() -> Response | tuple[Response, int]:
+    if "handle" not in session:
+        return jsonify({"error": "Not logged in"}), 401
+    try:
+        since_id = int(request.args.get("since_id", 0))
+    except ValueError:
+        since_id = 0
 
-    cursor.execute("""
-        SELECT f.id, f.content, f.timestamp, f.userHandle, f.username, f.hashtag, f.is_reflit, f.original_flit_id, f.meme_link
-        FROM flits AS f
-        LEFT JOIN blocks AS b ON f.userHandle = b.blocked_handle AND b.blocker_handle = ?
-        WHERE f.profane_flit = 'no' AND (b.blocked_handle IS NULL)
-        ORDER BY f.id DESC 
-        LIMIT ? OFFSET ?
-    """, (current_user_handle, limit, skip))
+    db = helpers.get_db()
+    unread, items, last_read_id = notifications.inbox(db, session["handle"], since_id)
+    db.close()
+    return jsonify({"unread": unread, "last_read_id": last_read_id, "notifications": items})
 
-    # Fetch the results and convert them to dictionaries
-    flits = cursor.fetchall()
-    flits_list = [dict(flit) for flit in flits]
 
-    return jsonify(flits_list)
+@app.route("/notifications")
+def notifications_page() -> str | Response:
+    if "handle" not in session:
+        return redirect(url_for("login"))
+
+    db = helpers.get_db()
+    unread, items, _ = notifications.inbox(db, session["handle"])
+    db.close()
+    if items:
+        notifications.mark_read(session["handle"], items[0]["id"])
+    return render_template(
+        "notifications.html", notifications=items, unread=unread, loggedIn=True
+    )
 
 
 @app.route("/api/get_captcha")
@@ -187,6 +313,9 @@ def get_captcha():
     session['correct_captcha'] = correct_captcha
     session.modified = True  # Mark the session as modified
     
+    # Only the captcha needs Pillow, so it is imported here rather than at boot
+    from PIL import Image, ImageDraw, ImageFont
+
     captcha_img = Image.new('RGB', (200, 50), color=(73, 109, 137))
     d = ImageDraw.Draw(captcha_img)
     fnt = ImageFont.truetype('/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf', 15)
@@ -197,33 +326,37 @@ def get_captcha():
     buf.seek(0)
     
     # Log the correct_captcha for debugging purposes
-    app.logger.info(f'Setting correct_captcha in session: {correct_captcha}')
+    app.logger.debug("Setting correct_captcha in session: %s", correct_captcha)
     
     return send_file(buf, mimetype='image/png')
 
 
 @app.route("/api/render_online")
 def render_online() -> Response:
-    current_ns_time = time.time_ns()
-    handles_to_remove = []
-    for handle in online_users.keys():
-        if online_users[handle] < current_ns_time - 1000000000 * 13:
-            handles_to_remove.append(handle)
-    for handle in handles_to_remove:
-        online_users.pop(handle)
     if "handle" in session:
         online_users[session["handle"]] = time.time_ns()
     return jsonify(online_users)
 
+
+@scheduler.job(2)
+def sweep_presence():
+    # Users who stopped polling are offline
+    cutoff = time.time_ns() - ONLINE_SECONDS * 1_000_000_000
+    for handle, seen in list(online_users.items()):
+        if seen < cutoff:
+            online_users.pop(handle, None)
+
+
 @app.route("/api/get_gif", methods=["POST"])
 def get_gif() -> str:
     if request.json is not None:
-        return requests.get(f"https://tenor.googleapis.com/v2/search", {
-            "key": TENOR_SECRET,
-            "q": request.json['q'],
-            "limit": 8,
-            "client_key": session["handle"]
-        }).json()
+        with metrics.timed_http("tenor"):
+            return requests.get(f"https://tenor.googleapis.com/v2/search", {
+                "key": TENOR_SECRET,
+                "q": request.json['q'],
+                "limit": 8,
+                "client_key": session["handle"]
+            }).json()
     return "no json was provided"
 
 #Helper function for logging ips, becuase muh telematry
@@ -235,11 +368,8 @@ logger = logging.getLogger(__name__)
 @app.route("/submit_flit", methods=["POST"])
 @limiter.limit("4/minute")
 def submit_flit() -> str | Response:
-    # Get a connection to the database
-
-    db = helpers.get_db()
     user_agent = request.headers.get('User-Agent')
-    app.logger.info(f'User Agent: {user_agent}')
+    app.logger.debug("User Agent: %s", user_agent)
     common_browsers = [
         'Mozilla', 
         'Chrome',
@@ -259,8 +389,6 @@ def submit_flit() -> str | Response:
     if not user_agent or not any(browser in user_agent for browser in common_browsers):
         return "Unauthorized", 401
 
-    # Create a cursor to interact with the database
-    cursor = db.cursor()
     #muh telematry
     client_ip = helpers.get_client_ip()
 
@@ -285,19 +413,8 @@ def submit_flit() -> str | Response:
     if content.lower() == "urmom" or content.lower() == "ur mom":
         return render_template("error.html", error='"ur mom" was too large for the servers to handle.')
 
-    cursor.execute("SELECT * FROM flits ORDER BY timestamp DESC LIMIT 1")
-    latest_flit = cursor.fetchone()
-
-    if latest_flit and latest_flit["content"] == request.form["content"] and latest_flit["userHandle"] == session["handle"]:
-        return redirect("/")
-
-
+    sightengine_result = is_profanity(content)
 
-    #profane word list    
-    with open('profane_words.json') as f:
-        profane_words_list = json.load(f)
-        sightengine_result = is_profanity(content)
-    
     # Check if SightEngine flagged content as profane
     if (
             isinstance(sightengine_result, dict)
@@ -305,81 +422,48 @@ def submit_flit() -> str | Response:
             and len(sightengine_result.get("profanity", {}).get("matches", [])) > 0
     ):
         return render_template("error.html", error="Do you really think that's appropriate?")
-    
+
     # If SightEngine did not flag content as profane, perform manual check
-    profane_flit = "no"
-    content_words = content.lower().strip().split()
-    
-    for word in profane_words_list:
-        if word.lower() in content_words:
-            profane_flit = "yes"
-            return render_template("error.html", error="Do you really think that's appropriate?")
-    
-        # Check if the original_flit_id field is present in the form data
-    if request.form.get("original_flit_id") is None and request.form["original_flit_id"] is None:
-        # Insert the new flit into the database
-# Insert the new flit into the database including the IP address
-        cursor.execute(
-            "INSERT INTO flits (username, content, userHandle, hashtag, profane_flit, meme_link, is_reflit, original_flit_id, ip) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-            (
-                session["username"],
-                content,
-                session["handle"],
-                "",
-                profane_flit,
-                meme_url,
-                0,
-                -1,
-                client_ip,  
-            ),
-        )
-        db.commit()
-        db.close()
+    if profane_words().intersection(content.lower().strip().split()):
+        return render_template("error.html", error="Do you really think that's appropriate?")
 
+    original_flit_id = request.form.get("original_flit_id") or None
+    reply_to = request.form.get("reply_to") or None
+    flit_id = storage.insert_flit(
+        session["username"], session["handle"], content, meme_url, original_flit_id, client_ip, reply_to
+    )
+    # Same content as the user's previous flit, most likely a double submit
+    if flit_id is None:
+        return redirect("/")
+    # Replies are posted from the thread, so go back to it
+    if reply_to is not None:
+        return redirect(url_for("singleflit", flit_id=reply_to))
+
+    if original_flit_id is None:
         # Note: you must supply the user_id who performed the event as the first parameter.
-        mp.track(session['handle'], 'Posted',  {
-            'Flit Id': cursor.lastrowid
+        track(session['handle'], 'Posted',  {
+            'Flit Id': flit_id
+        })
+    else:
+        track(session['handle'], 'ReFlit',  {
+            'Original Flit Id': original_flit_id
         })
 
-        return redirect(url_for("home"))
-
-    # Check for reflit
-    is_reflit = False
-    original_flit_id = request.form.get("original_flit_id")  # Get original_flit_id from form data
-    if original_flit_id is not None:
-        # Look for the original flit in the database
-        cursor.execute("SELECT id FROM flits WHERE id = ?", (original_flit_id,))
-        original_flit = cursor.fetchone()
-
-        if original_flit:  # If the original flit exists
-            is_reflit = True
-
-    # Insert the reflit or empty flit into the database
-    cursor.execute(
-        "INSERT INTO flits (username, content, userHandle, hashtag, profane_flit, meme_link, is_reflit, original_flit_id, ip ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-        (
-            session["username"],
-            content,
-            session["handle"],
-            "",
-            profane_flit,
-            meme_url,
-            int(is_reflit),
-            original_flit_id,
-            client_ip,
-        ),
-    )
+    return redirect(url_for("home"))
 
-    mp.track(session['handle'], 'ReFlit',  {
-        'Original Flit Id': original_flit_id
-    })
 
-    db.commit()
-    db.close()
-    return redirect(url_for("home"))
+# Captcha -> when it was used to sign up, until forget_captchas() drops it
+used_captchas = {}
+CAPTCHA_SECONDS = 600
+
 
+@scheduler.job(60)
+def forget_captchas():
+    cutoff = time.time() - CAPTCHA_SECONDS
+    for captcha, used in list(used_captchas.items()):
+        if used < cutoff:
+            used_captchas.pop(captcha, None)
 
-used_captchas = []
 
 @app.route('/settings', methods=['GET', 'POST'])
 def settings():
@@ -392,15 +476,6 @@ def settings():
 # Gets users to show if they are online
 @app.route('/users', methods=['GET', 'POST'])
 def users():
-    print(online_users)
-    current_ns_time = time.time_ns()
-    handles_to_remove = []
-    for handle in online_users.keys():
-        if online_users[handle] < current_ns_time - 1000000000 * 10:
-            handles_to_remove.append(handle)
-    for handle in handles_to_remove:
-        online_users.pop(handle)
-    print(online_users)
     return render_template('users.html',
         online=online_users,
         loggedIn=("handle" in session)
@@ -423,7 +498,7 @@ def signup():
         user_captcha_input = request.form["input"]
         correct_captcha = session.get('correct_captcha', '')
         
-        app.logger.info(f'Correct CAPTCHA: {correct_captcha}')
+        app.logger.debug("Correct CAPTCHA: %s", correct_captcha)
 
         # Check if the user-provided captcha input matches the correct captcha
         if user_captcha_input != correct_captcha:
@@ -446,32 +521,28 @@ def signup():
             return render_template(
             "error.html", error="Your username is too long"
             )
-        # Get a connection to the database
-        db = helpers.get_db()
-
-        # Create a cursor to interact with the database
-        cursor = db.cursor()
+        # A deleted account's flits are still being cleaned up under its handle
+        if storage.being_deleted(handle):
+            return render_template(
+            "error.html", error="That username was just deleted, please try again later."
+            )
 
         # Check if the username already exists in the database
-        cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
+        same_name = storage.users_named(username)
 
         # If the username is taken, modify the handle to make it unique
-        if len(cursor.fetchall()) != 0:
-            handle = f"{username}{len(cursor.fetchall())}"
+        if len(same_name) != 0:
+            handle = f"{username}{len(same_name)}"
 
         # Hash the password before storing it in the database
         hashed_password = hashlib.sha256(password.encode()).hexdigest()
 
         # Insert the new user data into the database
-        cursor.execute(
-            "INSERT INTO users (username, password, handle, turbo) VALUES (?, ?, ?, ?)",
-            (username, hashed_password, handle, 0),
-        )
-        db.commit()
-        db.close()
+        storage.create_user(username, handle, hashed_password)
+        used_captchas[correct_captcha] = time.time()
 
         # Note: you must supply the user_id who performed the event as the first parameter.
-        mp.track(handle, 'Signed Up',  {
+        track(handle, 'Signed Up',  {
         'Signup Type': 'Referral'
         })
 
@@ -500,27 +571,20 @@ def login() -> str | Response:
         handle = request.form["handle"]
         password = request.form["password"]
 
-        # Get a connection to the database
-        db = helpers.get_db()
-
-        # Create a cursor to interact with the database
-        cursor = db.cursor()
-
         # Query the database for the user with the provided handle
-        cursor.execute("SELECT * FROM users WHERE handle = ?", (handle,))
-        users = cursor.fetchall()
+        user = storage.user(handle)
 
-        # If there is no or more than one matching user, redirect to the login page
-        if len(users) != 1:
+        # If there is no matching user, redirect to the login page
+        if user is None:
             return redirect("/login")
 
         # Hash the provided password to check against the stored hashed password
         hashed_password = hashlib.sha256(password.encode()).hexdigest()
 
         # If the password matches the stored hashed password, set session data for the user
-        if users[0]["password"] == hashed_password:
+        if user["password"] == hashed_password:
             session["handle"] = handle
-            session["username"] = users[0]["username"]
+            session["username"] = user["username"]
         else:
             # If the password doesn't match, redirect to the login page
             return redirect("/login")
@@ -542,20 +606,13 @@ def change_password():
         current_password = request.form['current_password']
         new_password = request.form['new_password']
 
-        db = helpers.get_db()
-        cursor = db.cursor()
-        cursor.execute("SELECT password FROM users WHERE handle = ?", (session["handle"],))
-        user = cursor.fetchone()
+        user = storage.user(session["handle"])
 
         hashed_password = hashlib.sha256(current_password.encode()).hexdigest()
 
         if user['password'] == hashed_password:
             new_hashed_password = hashlib.sha256(new_password.encode()).hexdigest()
-            cursor.execute(
-                "UPDATE users SET password = ? WHERE handle = ?",
-                (new_hashed_password, session["handle"]),
-            )
-            db.commit()
+            storage.set_password(session["handle"], new_hashed_password)
             return redirect('/')
         else:
             return 'Current password is incorrect'
@@ -570,32 +627,32 @@ def leaderboard():
     )
 
 
-@sitemapper.include(url_variables={"flit_id": helpers.get_all_flit_ids()})
 @app.route("/flits/<flit_id>")
 def singleflit(flit_id: str) -> str | Response:
-    # Get a connection to the database
-    conn = helpers.get_db()
-
-    # Create a cursor to interact with the database
-    c = conn.cursor()
-
-    # Retrieve the specified flit's information from the database
-    c.execute("SELECT * FROM flits WHERE id=?", (flit_id,))
-    flit = c.fetchone()
+    # Retrieve the specified flit's information, archived or not
+    flit = storage.flit(flit_id)
 
     if flit:
-        original_flit = None
-        if flit["is_reflit"] == 1:
-            # Retrieve the original flit's information if this flit is a reflit
-            c.execute("SELECT * FROM flits WHERE id = ?", (flit["original_flit_id"],))
-            original_flit = c.fetchone()
-
-        # Render the template with the flit's information
+        # Its thread: the flits above it and a page of the replies below
+        ancestors, replies, after = storage.thread(flit, request.args.get("after"))
+        ancestors = [ancestor for ancestor in ancestors if not ancestor["hidden"]]
+        depths = {reply["id"]: depth for depth, reply in replies}
+        replies = [
+            (depths[reply["id"]], reply, html)
+            for reply, html in fragments.rendered([reply for _, reply in replies if not reply["hidden"]])
+        ]
+        # Render the template with the flit's information, and the
+        # original's if this flit is a reflit
         return render_template(
             "flit.html",
             flit=flit,
+            flit_html=fragments.render_flits([flit]),
+            ancestors=ancestors,
+            ancestors_html=fragments.render_flits(ancestors),
+            replies=replies,
+            after=after,
+            continues=threads.continues,
             loggedIn=("handle" in session),
-            original_flit=original_flit,
         )
 
     # If the flit doesn't exist, redirect to the home page
@@ -614,39 +671,37 @@ def logout() -> Response:
 
 
 
-@sitemapper.include(url_variables={"username": helpers.get_all_user_handles()})
-@app.route("/user/<path:username>")
-def user_profile(username: str) -> str | Response:
-    # Get a connection to the database
-    conn = helpers.get_db()
+PROFILE_PAGE_SIZE = 50
 
-    # Create a cursor to interact with the database
-    cursor = conn.cursor()
 
+@app.route("/user/<path:username>")
+def user_profile(username: str) -> str | Response:
     # Query the database for the user profile with the specified username
-    cursor.execute("SELECT * FROM users WHERE handle = ?", (username,))
-    user = cursor.fetchone()
+    user = storage.user(username)
 
     # If the user doesn't exist, redirect to the home page
     if not user:
         return redirect("/")
 
-    # Query the database for the user's non-reflit flits, ordered by timestamp
-    cursor.execute(
-        "SELECT * FROM flits WHERE userHandle = ? ORDER BY timestamp DESC",
-        (username,),
-    )
-    flits = cursor.fetchall()
-
+    try:
+        page = max(1, int(request.args.get("page", 1)))
+    except ValueError:
+        page = 1
 
+    # One page of the user's flits, newest first, continuing into the archive
+    hot_count, flit_count, first_tweet_time = storage.user_flit_stats(username)
+    flits = storage.user_flits(
+        username, PROFILE_PAGE_SIZE, (page - 1) * PROFILE_PAGE_SIZE, hot_count
+    )
 
     # Calculate the user's activeness based on their tweet frequency
-    latest_tweet_time = datetime.datetime.now()
-    first_tweet_time = flits[-1]["timestamp"]
-    first_tweet_time = datetime.datetime.strptime(first_tweet_time, "%Y-%m-%d %H:%M:%S")
-    diff = latest_tweet_time - first_tweet_time
-    weeks = diff.total_seconds() / 3600 / 24 / 7
-    activeness = round(0 if weeks == 0 else len(flits) / weeks * 1000)
+    activeness = 0
+    if first_tweet_time:
+        latest_tweet_time = datetime.datetime.now()
+        first_tweet_time = datetime.datetime.strptime(first_tweet_time, "%Y-%m-%d %H:%M:%S")
+        diff = latest_tweet_time - first_tweet_time
+        weeks = diff.total_seconds() / 3600 / 24 / 7
+        activeness = round(0 if weeks == 0 else flit_count / weeks * 1000)
 
     # Initialize a list for user badges
     badges = []
@@ -664,35 +719,55 @@ def user_profile(username: str) -> str | Response:
         badges=badges,
         user=user,
         loggedIn=("handle" in session),
-        flits=flits,
+        flits=fragments.render_flits(flits),
         activeness=activeness,
+        page=page,
+        has_next_page=page * PROFILE_PAGE_SIZE < flit_count,
     )
 
 @app.route("/profanity")
 def profanity() -> str | Response:
-    if "username" in session and session["handle"] != "admin":
+    if session.get("handle") != "admin":
         return render_template(
             "error.html", error="You are not authorized to view this page."
         )
 
-    db = helpers.get_db()
-    cursor = db.cursor()
-    cursor.execute(
-        "SELECT * FROM flits WHERE profane_flit = 'yes' ORDER BY timestamp DESC"
-    )
-    profane_flit = cursor.fetchall()
-    cursor.execute(
-        """
-        SELECT * FROM direct_messages WHERE profane_dm = "yes"
-    """
-    )
-    profane_dm = cursor.fetchall()
+    profane_flit, next_flits = moderation.profane_flit_queue(request.args.get("flits_after"))
+    profane_dm, next_dms = moderation.profane_dm_queue(request.args.get("dms_after"))
 
     return render_template(
-        "profanity.html", profane_flit=profane_flit, profane_dm=profane_dm
+        "profanity.html",
+        profane_flit=profane_flit,
+        profane_dm=profane_dm,
+        next_flits=next_flits,
+        next_dms=next_dms,
     )
 
 
+@app.route("/profanity", methods=["POST"])
+def moderate_profanity() -> str | Response:
+    if session.get("handle") != "admin":
+        return render_template(
+            "error.html", error="You are not authorized to perform this action."
+        )
+
+    action = request.form.get("action")
+    flit_ids = moderation.parse_ids(request.form.getlist("flit_id"))
+    dm_ids = moderation.parse_ids(request.form.getlist("dm_id"))
+    if flit_ids:
+        if action == "approve":
+            moderation.dismiss_reports(flit_ids)
+        elif action == "delete":
+            moderation.delete_flits(flit_ids)
+    if dm_ids:
+        if action == "approve":
+            moderation.approve_dms(dm_ids)
+        elif action == "delete":
+            moderation.delete_dms(dm_ids)
+
+    return redirect(url_for("profanity"))
+
+
 def is_profanity(text):
     api_user = "570595698"
     api_secret = SIGHT_ENGINE_SECRET
@@ -707,51 +782,48 @@ def is_profanity(text):
         "categories": "drug,medical,extremism,weapon",
     }
 
-    response = requests.post(api_url, data=data)
+    with metrics.timed_http("sightengine"):
+        response = requests.post(api_url, data=data)
     
-    # Parse the JSON response
-    result = response.json()
+        # Parse the JSON response
+        result = response.json()
     
     # Check if the 'status' key exists and its value is 'failure'
     if 'status' in result and result['status'] == 'failure':
         app.logger.info("API call failed due to usage limit or another error.")
         return "failure"  # Explicitly set result to "failure"
     
-    app.logger.info(result)
-    app.logger.info(response)
+    app.logger.debug("SightEngine result: %s", result)
     
     return result
 
 
 @app.route("/delete_flit", methods=["GET"])
 def delete_flit() -> str | Response:
-    if "username" in session and session["handle"] != "admin":
+    if session.get("handle") != "admin":
         return render_template(
             "error.html", error="You are not authorized to perform this action."
         )
 
-    flit_id = request.args.get("flit_id")
-    db = helpers.get_db()
-    cursor = db.cursor()
-    cursor.execute("DELETE FROM flits WHERE id = ?", (flit_id,))
-    cursor.execute("DELETE FROM reported_flits WHERE flit_id=?", (flit_id,))
-    db.commit()
+    flit_ids = moderation.parse_ids(request.args.getlist("flit_id"))
+    if flit_ids:
+        moderation.delete_flits(flit_ids)
 
     return redirect(url_for("reported_flits"))
 
 
 @app.route("/delete_user", methods=["POST"])
 def delete_user() -> str | Response:
-    if "username" in session and session["handle"] != "admin":
+    if session.get("handle") != "admin":
         return render_template(
             "error.html", error="You are not authorized to perform this action."
         )
 
     user_handle = request.form["user_handle"]
-    db = helpers.get_db()
-    cursor = db.cursor()
-    cursor.execute("DELETE FROM users WHERE handle = ?", (user_handle,))
-    db.commit()
+    # Hides the account now; its flits, DMs and blocks go in the background
+    deletions.delete_user(user_handle)
+    app.session_interface.delete_handle(user_handle)
+    online_users.pop(user_handle, None)
 
     return redirect(url_for("home"))
 
@@ -763,30 +835,40 @@ def report_flit() -> Response:
     reporter_handle = session["handle"]
     reason = request.form["reason"]
 
-    db = helpers.get_db()
-    cursor = db.cursor()
-    cursor.execute(
-        "INSERT INTO reported_flits (flit_id, reporter_handle, reason) VALUES (?, ?, ?)",
-        (flit_id, reporter_handle, reason),
-    )
-    db.commit()
+    storage.report_flit(flit_id, reporter_handle, reason)
 
     return redirect(url_for("home"))
 
 
 @app.route("/reported_flits")
 def reported_flits() -> str:
-    if "username" in session and session["handle"] != "admin":
+    if session.get("handle") != "admin":
         return render_template(
             "error.html", error="You don't have permission to access this page."
         )
 
-    db = helpers.get_db()
-    cursor = db.cursor()
-    cursor.execute("SELECT * FROM reported_flits")
-    reports = cursor.fetchall()
+    reports, next_cursor = moderation.report_queue(request.args.get("after"))
+
+    return render_template(
+        "reported_flits.html", reports=reports, next_cursor=next_cursor, loggedIn="handle" in session
+    )
+
+
+@app.route("/reported_flits", methods=["POST"])
+def moderate_reports() -> str | Response:
+    if session.get("handle") != "admin":
+        return render_template(
+            "error.html", error="You are not authorized to perform this action."
+        )
+
+    flit_ids = moderation.parse_ids(request.form.getlist("flit_id"))
+    if flit_ids:
+        if request.form.get("action") == "approve":
+            moderation.dismiss_reports(flit_ids)
+        elif request.form.get("action") == "delete":
+            moderation.delete_flits(flit_ids)
 
-    return render_template("reported_flits.html", reports=reports,  loggedIn="handle" in session )
+    return redirect(url_for("reported_flits"))
 
 @app.route("/dm/<path:receiver_handle>")
 def direct_messages(receiver_handle):
@@ -794,22 +876,9 @@ def direct_messages(receiver_handle):
         return render_template("error.html", error="You are not logged in.")
 
     sender_handle = session["handle"]
-    blocked_handles = helpers.get_blocked_users(sender_handle)  # Retrieve the list of blocked users
-
-    db = helpers.get_db()
-    cursor = db.cursor()
-
-    cursor.execute(
-        """
-        SELECT * FROM direct_messages
-        WHERE (sender_handle = ? AND receiver_handle = ?)
-        OR (sender_handle = ? AND receiver_handle = ?) AND profane_dm = 'no'
-        ORDER BY timestamp DESC
-    """,
-        (sender_handle, receiver_handle, receiver_handle, sender_handle),
-    )
+    blocked_handles = storage.blocked_handles(sender_handle)  # Retrieve the list of blocked users
 
-    messages = cursor.fetchall()
+    messages = storage.conversation(sender_handle, receiver_handle)
 
     return render_template(
         "direct_messages.html",
@@ -822,39 +891,47 @@ def direct_messages(receiver_handle):
 
 
 
-@app.route("/submit_dm/<path:receiver_handle>", methods=["POST"])
-@limiter.limit("5/minute")
-def submit_dm(receiver_handle) -> str | Response:
-    if "username" not in session:
-        return render_template("error.html", error="You are not logged in.")
-
-    sender_handle = session["handle"]
-    content = request.form["content"]
+def save_dm(sender_handle, receiver_handle, content):
+    """Check and store a DM, shared by the form post and the WebSocket.
 
+    Returns (message, error). Profane messages are stored but flagged, like
+    before, and dm_channel.publish() won't push them.
+    """
     if len(content) > 1000:
-        return render_template("error.html", error="Too many characters in DM")
+        return None, "Too many characters in DM"
 
     sightengine_result = is_profanity(content)
     profane_dm = "no"
 
     if (
-        sightengine_result["status"] == "success"
-        and len(sightengine_result["profanity"]["matches"]) > 0
+        isinstance(sightengine_result, dict)
+        and sightengine_result.get("status") == "success"
+        and len(sightengine_result.get("profanity", {}).get("matches", [])) > 0
     ):
         profane_dm = "yes"
 
-    db = helpers.get_db()
-    cursor = db.cursor()
-
-    cursor.execute(
-        """
-        INSERT INTO direct_messages (sender_handle, receiver_handle, content, profane_dm)
-        VALUES (?, ?, ?, ?)
-    """,
-        (sender_handle, receiver_handle, content, profane_dm),
-    )
+    row = storage.insert_dm(sender_handle, receiver_handle, content, profane_dm)
+
+    return {
+        "id": row["id"],
+        "sender_handle": sender_handle,
+        "receiver_handle": receiver_handle,
+        "content": content,
+        "timestamp": row["timestamp"],
+        "profane_dm": profane_dm,
+    }, None
+
 
-    db.commit()
+@app.route("/submit_dm/<path:receiver_handle>", methods=["POST"])
+@limiter.limit("5/minute")
+def submit_dm(receiver_handle) -> str | Response:
+    if "username" not in session:
+        return render_template("error.html", error="You are not logged in.")
+
+    message, error = save_dm(session["handle"], receiver_handle, request.form["content"])
+    if error:
+        return render_template("error.html", error=error)
+    dm_channel.publish(message)
 
     return redirect(
         url_for(
@@ -864,6 +941,68 @@ def submit_dm(receiver_handle) -> str | Response:
         )
     )
 
+
+# Same budget as submit_dm, counted per sender across all their sockets
+dm_socket_limit = parse_limit("5/minute")
+
+
+@app.route("/ws/dm/<path:receiver_handle>", websocket=True)
+def dm_socket(receiver_handle):
+    ws = request.environ.get("wsgi.websocket")
+    if ws is None:
+        return "Expected a WebSocket connection (run server.py)", 400
+
+    # Browsers don't apply CORS or CSRF to WebSockets, so check the origin
+    origin = request.headers.get("Origin")
+    if origin and urlparse(origin).netloc != request.host:
+        ws.close()
+        return ""
+    if "username" not in session:
+        ws.close()
+        return ""
+
+    sender_handle = session["handle"]
+    subscriber = dm_channel.Subscriber(
+        ws, sender_handle, receiver_handle, storage.blocked_handles(sender_handle)
+    )
+    poller = dm_channel.subscribe(subscriber)
+    try:
+        while True:
+            raw = ws.receive()
+            if raw is None:
+                break
+            try:
+                frame = json.loads(raw)
+            except ValueError:
+                continue
+            if not isinstance(frame, dict):
+                continue
+
+            if frame.get("type") == "resume":
+                last_id = dm_channel.last_id_of(frame)
+                if last_id is None:
+                    subscriber.send({"type": "error", "error": "last_id must be a whole number."})
+                    continue
+                subscriber.resume(last_id)
+            elif frame.get("type") == "send":
+                client_id = frame.get("client_id")
+                if not limiter.limiter.hit(dm_socket_limit, "dm_socket", sender_handle):
+                    subscriber.send({"type": "error", "client_id": client_id, "error": "Slow down."})
+                    continue
+                message, error = save_dm(sender_handle, receiver_handle, str(frame.get("content", "")))
+                if error:
+                    subscriber.send({"type": "error", "client_id": client_id, "error": error})
+                    continue
+                subscriber.send({"type": "ack", "client_id": client_id, "id": message["id"]})
+                dm_channel.publish(message)
+    except WebSocketError:
+        pass
+    finally:
+        dm_channel.unsubscribe(subscriber)
+        poller.kill(block=False)
+
+    return ""
+
 # Muting and unmuting
 
 muted = []
@@ -882,8 +1021,20 @@ def unmute(handle) -> str:
         return "Completed"
     return "you are not admin"
 
+sitemap_lock = threading.Lock()
+sitemap_filled = False
+
+
 @app.route("/sitemap.xml")
 def sitemap():
+  # Every flit and profile is listed on the first request for the sitemap,
+  # not at import, where reading them made boot time grow with the data
+  global sitemap_filled
+  with sitemap_lock:
+    if not sitemap_filled:
+      sitemapper.add_endpoint("singleflit", url_variables={"flit_id": storage.all_flit_ids()})
+      sitemapper.add_endpoint("user_profile", url_variables={"username": storage.all_user_handles()})
+      sitemap_filled = True
   return sitemapper.generate()
 @app.route('/block_unblock', methods=['GET', 'POST'])
 def block_unblock():
@@ -892,24 +1043,11 @@ def block_unblock():
         action = request.form['action']
         user_handle = request.form['user_handle']
         
-        # Connect to the database
-        conn = helpers.get_db()
-        cursor = conn.cursor()
-        
         if action == 'block':
-            # Attempt to insert or update the block based on existence
-            cursor.execute("""
-                INSERT INTO blocks (blocker_handle, blocked_handle) VALUES (?, ?)
-                ON CONFLICT(blocker_handle, blocked_handle) DO UPDATE SET blocker_handle = excluded.blocker_handle
-            """, (session['handle'], user_handle))
+            # Blocking someone already blocked changes nothing
+            storage.block(session['handle'], user_handle)
         elif action == 'unblock':
-            # Delete the block based on existence
-            cursor.execute("""
-                DELETE FROM blocks WHERE blocker_handle = ? AND blocked_handle = ?
-            """, (session['handle'], user_handle))
-        
-        conn.commit()
-        conn.close()
+            storage.unblock(session['handle'], user_handle)
         
         return redirect(url_for('view_blocks'))  # Redirect to the view_blocks page or wherever you want
         
@@ -921,26 +1059,23 @@ def block_unblock():
 
 @app.route('/view_blocks')
 def view_blocks():
-    # Connect to the database
-    conn = helpers.get_db()
-    cursor = conn.cursor()
-    
     # Get the current user's handle
     current_user_handle = session['handle']
     
     # Fetch all blocks where the blocker_handle matches the current user's handle
-    cursor.execute("""
-        SELECT blocked_handle FROM blocks WHERE blocker_handle = ?
-    """, (current_user_handle,))
-    
-    blocks = cursor.fetchall()
-    
-    conn.close()
+    blocks = storage.blocked_handles(current_user_handle)
     
     # Render the blocks view
-    return render_template('view_blocks.html', blocks=[block[0] for block in blocks],  loggedIn="handle" in session )
+    return render_template('view_blocks.html', blocks=blocks,  loggedIn="handle" in session )
 
 
 
+create_app()
+
 if __name__ == "__main__":
+    # Development server only, use server.py in production
+    import database_setup
+
+    database_setup.setup()
+    scheduler.start()
     app.run(debug=False)
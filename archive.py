@@ -0,0 +1,190 @@
+"""Move old flits out of tweetor.db into tweetor_archive.db.
+
+Almost every read (home feed, leaderboard, sitemap, the first pages of a
+profile) wants recent flits, so flits older than a cutoff are moved to an
+archive database with the same flits schema. The hot table and its indexes
+stay small enough to live in the page cache. Rows are moved in batches:
+each batch is copied into the archive and committed there, then deleted
+from the hot table in a second short transaction. A crash between the two
+leaves a row in both places, never in neither, and the next run's
+INSERT OR IGNORE skips it.
+
+Archived flits drop out of the home feed and their hashtag timelines
+(their flit_hashtags rows are deleted with them). find_flit() and user_flits()
+fall through to the archive, so /flits/<id>, /api/flit and profile pages
+still show them. The archive is attached to a connection only when a
+lookup misses the hot table.
+
+Run it next to the app, e.g. from cron or a systemd timer:
+
+    python archive.py --days 90             # until nothing is left to move
+    python archive.py --days 90 --vacuum    # then shrink tweetor.db
+
+Or set TWEETOR_ARCHIVE_DAYS and the app does it itself: the scheduler's
+leader moves up to JOB_LIMIT flits an hour (see scheduler.py).
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import time
+
+import hashtags
+import helpers
+import scheduler
+
+ARCHIVE_DATABASE = "tweetor_archive.db"
+BATCH = 500
+# Flits the hourly job moves at most, so it finishes well within the lease
+JOB_LIMIT = 50_000
+
+logger = logging.getLogger("tweetor.archive")
+
+
+def attach(db):
+    """Attach the archive to db as "archive", returning False if there is none."""
+    if not os.path.exists(ARCHIVE_DATABASE):
+        return False
+    if not any(row[1] == "archive" for row in db.execute("PRAGMA database_list").fetchall()):
+        db.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_DATABASE,))
+    return True
+
+
+def find_flit(db, flit_id, columns):
+    """The flit, hot or archived, as columns (storage.FLIT_COLUMNS, over f)."""
+    cursor = db.cursor()
+    cursor.execute(f"SELECT {columns} FROM flits AS f WHERE f.id = ?", (flit_id,))
+    flit = cursor.fetchone()
+    if flit is None and attach(db):
+        cursor.execute(f"SELECT {columns} FROM archive.flits AS f WHERE f.id = ?", (flit_id,))
+        flit = cursor.fetchone()
+    if flit is not None:
+        # Hidden while its author is being deleted
+        cursor.execute(f"SELECT 1 WHERE ? IN {helpers.DELETED_HANDLES}", (flit["userHandle"],))
+        if cursor.fetchone():
+            return None
+    return flit
+
+
+def user_flit_stats(db, handle):
+    """(hot flits, all flits, oldest timestamp) for handle."""
+    cursor = db.cursor()
+    cursor.execute("SELECT count(*), min(timestamp) FROM flits WHERE userHandle = ?", (handle,))
+    hot, oldest = cursor.fetchone()
+    total = hot
+    if attach(db):
+        cursor.execute("SELECT count(*), min(timestamp) FROM archive.flits WHERE userHandle = ?", (handle,))
+        archived, archived_oldest = cursor.fetchone()
+        total += archived
+        oldest = archived_oldest or oldest
+    return hot, total, oldest
+
+
+def user_flits(db, handle, limit, offset, hot, columns):
+    """A page of handle's flits, newest first, continuing into the archive.
+
+    Everything archived is older than everything hot, so the archive's rows
+    simply follow the hot table's; hot is the hot row count from
+    user_flit_stats(). columns as for find_flit().
+    """
+    cursor = db.cursor()
+    cursor.execute(
+        f"SELECT {columns} FROM flits AS f WHERE f.userHandle = ? ORDER BY f.timestamp DESC LIMIT ? OFFSET ?",
+        (handle, limit, offset),
+    )
+    flits = cursor.fetchall()
+    if len(flits) < limit and attach(db):
+        cursor.execute(
+            f"SELECT {columns} FROM archive.flits AS f WHERE f.userHandle = ? ORDER BY f.timestamp DESC LIMIT ? OFFSET ?",
+            (handle, limit - len(flits), max(0, offset - hot)),
+        )
+        flits += cursor.fetchall()
+    return flits
+
+
+def create_archive(db):
+    # Same columns as the hot table, whatever migrations it has been through
+    (schema,) = db.execute("SELECT sql FROM main.sqlite_master WHERE name = 'flits'").fetchone()
+    db.execute(schema.replace("flits", "archive.flits", 1).replace("CREATE TABLE", "CREATE TABLE IF NOT EXISTS", 1))
+    # An archive made before a migration gets the columns it missed, so
+    # INSERT ... SELECT * still lines up
+    archived = {row[1] for row in db.execute("PRAGMA archive.table_info(flits)")}
+    for _, name, type_, notnull, default, _ in db.execute("PRAGMA main.table_info(flits)").fetchall():
+        if name not in archived:
+            constraint = f" NOT NULL DEFAULT {default}" if notnull else ""
+            db.execute(f"ALTER TABLE archive.flits ADD COLUMN {name} {type_}{constraint}")
+    db.execute("CREATE INDEX IF NOT EXISTS archive.flits_user_timestamp ON flits (userHandle, timestamp)")
+
+
+def archive_before(cutoff, batch=BATCH, pause=0.05, log=print, limit=None):
+    """Move every flit with a timestamp before cutoff, batch rows at a time.
+
+    Sleeps pause seconds between batches so the app gets the write lock.
+    Stops once limit flits have moved, if given. Returns the number of
+    flits moved.
+    """
+    db = sqlite3.connect(helpers.DATABASE, isolation_level=None)
+    db.execute("PRAGMA busy_timeout = 5000")
+    open(ARCHIVE_DATABASE, "a").close()
+    attach(db)
+    create_archive(db)
+    moved = 0
+    try:
+        while True:
+            if limit is not None:
+                batch = min(batch, limit - moved)
+            ids = [row[0] for row in db.execute(
+                "SELECT id FROM main.flits WHERE timestamp < ? ORDER BY timestamp LIMIT ?", (cutoff, batch)
+            ).fetchall()]
+            if not ids:
+                return moved
+            marks = ",".join("?" * len(ids))
+            db.execute("BEGIN IMMEDIATE")
+            db.execute(f"INSERT OR IGNORE INTO archive.flits SELECT * FROM main.flits WHERE id IN ({marks})", ids)
+            db.execute("COMMIT")
+            db.execute("BEGIN IMMEDIATE")
+            db.execute(f"DELETE FROM main.flits WHERE id IN ({marks})", ids)
+            hashtags.discard(db, ids)
+            db.execute("COMMIT")
+            moved += len(ids)
+            if moved % (batch * 100) == 0:
+                log(f"archived {moved} flits")
+            time.sleep(pause)
+    finally:
+        db.close()
+
+
+def archive_older_than(days, **kwargs):
+    db = sqlite3.connect(helpers.DATABASE)
+    (cutoff,) = db.execute("SELECT datetime('now', ?)", (f"-{days} days",)).fetchone()
+    db.close()
+    return archive_before(cutoff, **kwargs)
+
+
+if os.getenv("TWEETOR_ARCHIVE_DAYS"):
+
+    @scheduler.job(3600, leader_only=True)
+    def archive_old_flits():
+        days = float(os.getenv("TWEETOR_ARCHIVE_DAYS"))
+        moved = helpers.run_db(lambda: archive_older_than(days, limit=JOB_LIMIT, log=logger.info))
+        logger.info("archived %d flits", moved)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=float, required=True, help="archive flits older than this")
+    parser.add_argument("--batch", type=int, default=BATCH)
+    parser.add_argument("--pause", type=float, default=0.05, help="seconds between batches")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM tweetor.db afterwards")
+    args = parser.parse_args()
+
+    moved = archive_older_than(args.days, batch=args.batch, pause=args.pause)
+    print(f"archived {moved} flits")
+    if args.vacuum:
+        db = sqlite3.connect(helpers.DATABASE)
+        db.execute("VACUUM")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
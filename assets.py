@@ -0,0 +1,126 @@
+"""Fingerprinted, precompressed static files.
+
+    python assets.py    # server.py runs this at startup too
+
+build() copies every file under static/ to static_build/ with a hash of
+its content in the name, e.g. js/flitRenderer.1f0c3a9b2d.js. Text files
+(CSS, JS, SVG, JSON) also get a gzip -9 copy next to them, compressed
+once here rather than sent as they are. manifest.json maps each name
+to its hashed one. Old hashed files are kept, so pages rendered before a
+deploy still load theirs.
+
+init_app() makes url_for("static", filename=...) emit the hashed name
+whenever the manifest has one, so templates need no changes. Hashed
+files are served with a one year immutable Cache-Control, since their
+name changes whenever their content does. A browser fetches each one
+once and never revalidates it. The gzip copy is sent to clients that
+accept it, and Range requests get a 206, which audio players rely on
+to seek. Names the manifest doesn't know, such as paths hard-coded in
+JS, and everything when no build exists, are served by Flask as before.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import sys
+
+from flask import current_app, request, send_file
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BUILD_DIR = os.path.join(ROOT, "static_build")
+COMPRESS = (".css", ".js", ".svg", ".json", ".txt", ".map")
+HASH_LENGTH = 10
+MAX_AGE = 365 * 24 * 3600
+
+# Logical name -> hashed name, and the hashed names, from manifest.json.
+# None until the first lookup reads it.
+manifest = None
+hashed_names = set()
+build_dir = BUILD_DIR
+
+
+def write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+
+
+def build(static_folder=os.path.join(ROOT, "static"), out=BUILD_DIR):
+    """Fingerprint and compress static_folder into out, returning the manifest."""
+    built = {}
+    for directory, subdirectories, files in os.walk(static_folder):
+        subdirectories[:] = sorted(name for name in subdirectories if not name.startswith("."))
+        for name in sorted(files):
+            if name.startswith("."):
+                continue
+            path = os.path.join(directory, name)
+            logical = os.path.relpath(path, static_folder).replace(os.sep, "/")
+            with open(path, "rb") as f:
+                data = f.read()
+            stem, extension = os.path.splitext(logical)
+            hashed = f"{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{extension}"
+            target = os.path.join(out, hashed)
+            if not os.path.exists(target):
+                write_atomic(target, data)
+                if extension in COMPRESS:
+                    compressed = gzip.compress(data, 9, mtime=0)
+                    if len(compressed) < len(data):
+                        write_atomic(target + ".gz", compressed)
+            built[logical] = hashed
+    write_atomic(os.path.join(out, "manifest.json"), json.dumps(built, indent=2, sort_keys=True).encode())
+    return built
+
+
+def load(directory=BUILD_DIR):
+    """Use the build in directory, or none if it has no manifest."""
+    global manifest, hashed_names, build_dir
+    build_dir = directory
+    try:
+        with open(os.path.join(directory, "manifest.json")) as f:
+            loaded = json.load(f)
+    except FileNotFoundError:
+        loaded = {}
+    hashed_names = set(loaded.values())
+    manifest = loaded
+
+
+def hashed_name(filename):
+    if manifest is None:
+        load(build_dir)
+    return manifest.get(filename, filename)
+
+
+def send_static(filename):
+    if manifest is None:
+        load(build_dir)
+    if filename not in hashed_names:
+        return current_app.send_static_file(filename)
+
+    path = os.path.join(build_dir, filename)
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    compressed = os.path.exists(path + ".gz")
+    if compressed and request.accept_encodings["gzip"]:
+        response = send_file(path + ".gz", mimetype=mimetype, conditional=True, max_age=MAX_AGE)
+        response.content_encoding = "gzip"
+    else:
+        response = send_file(path, mimetype=mimetype, conditional=True, max_age=MAX_AGE)
+    if compressed:
+        response.vary.add("Accept-Encoding")
+    response.cache_control.immutable = True
+    return response
+
+
+def init_app(app):
+    @app.url_defaults
+    def fingerprint_static(endpoint, values):
+        if endpoint == "static" and "filename" in values:
+            values["filename"] = hashed_name(values["filename"])
+
+    app.view_functions["static"] = send_static
+
+
+if __name__ == "__main__":
+    built = build()
+    print(f"Built {len(built)} static files into {BUILD_DIR}", file=sys.stderr)
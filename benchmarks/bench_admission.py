@@ -0,0 +1,114 @@
+"""Cheap route latency while expensive routes are saturated, admission control off and on.
+
+Runs benchmarks/serve.py (server.py, stubbed) in a copy of a fixture
+database (see fixtures.py) and drives it over HTTP with two groups of
+keep-alive clients at once:
+
+    cheap       /api/handle, and /healthz, which the load balancer polls
+    expensive   /api/get_flits?limit=1000 (leaderboard.js) and the first
+                page of a busy profile
+
+First the cheap clients run alone for a baseline, then both groups
+together, once with TWEETOR_ADMISSION=0 and once with admission control
+on. For every run each group gets requests/sec and p50/p95/p99 as JSON.
+Expensive requests shed with 503 are counted as errors. Like the site's
+own scripts, an expensive client waits out Retry-After (at least a
+second) before its next request.
+
+    python benchmarks/bench_admission.py --db bench/tweetor.db --seconds 20
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import loadgen
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+CHEAP = ["/api/handle", "/healthz"]
+
+# The shortest Retry-After admission.py sends
+RETRY_AFTER = 1
+
+
+def run_server(directory, port, env, groups, seconds):
+    env = dict(os.environ, PYTHONPATH=ROOT, TWEETOR_PORT=str(port), TWEETOR_WORKERS="1", **env)
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "benchmarks", "serve.py")],
+        cwd=directory, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    results = {}
+    try:
+        loadgen.wait_until_up(port)
+
+        def load(name, paths, clients):
+            def next_request(i):
+                return [("GET", paths[i % len(paths)], None, None)]
+
+            def make_worker():
+                worker = loadgen.http_worker(port, next_request)
+
+                def backing_off(i):
+                    status, elapsed = worker(i)
+                    if status == 503:
+                        time.sleep(RETRY_AFTER)
+                    return status, elapsed
+
+                return backing_off
+
+            results[name] = loadgen.run_clients(make_worker, clients, seconds)
+
+        threads = [threading.Thread(target=load, args=group) for group in groups]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        proc.terminate()
+        proc.wait()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", required=True, help="fixture database from fixtures.py")
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--cheap-clients", type=int, default=4)
+    parser.add_argument("--expensive-clients", type=int, default=50)
+    parser.add_argument("--port", type=int, default=5098)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="tweetor-admission-")
+    try:
+        shutil.copy(os.path.abspath(args.db), os.path.join(scratch, "tweetor.db"))
+        for name in ("blocklist.txt", "profane_words.json"):
+            shutil.copy(os.path.join(ROOT, name), scratch)
+        db = sqlite3.connect(os.path.join(scratch, "tweetor.db"))
+        (busiest,) = db.execute(
+            "SELECT userHandle FROM flits GROUP BY userHandle ORDER BY count(*) DESC LIMIT 1"
+        ).fetchone()
+        db.close()
+        expensive = ["/api/get_flits?skip=0&limit=1000", f"/user/{busiest}"]
+
+        cheap = ("cheap", CHEAP, args.cheap_clients)
+        results = {"baseline": run_server(scratch, args.port, {}, [cheap], args.seconds)}
+        for name, setting in (("admission_off", "0"), ("admission_on", "1")):
+            results[name] = run_server(
+                scratch, args.port, {"TWEETOR_ADMISSION": setting},
+                [cheap, ("expensive", expensive, args.expensive_clients)], args.seconds,
+            )
+            print(name, results[name], file=sys.stderr)
+        print(json.dumps(results, indent=2))
+    finally:
+        shutil.rmtree(scratch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Feed and profile latency and tweetor.db size before and after archiving.
+
+Copies a fixture database (see fixtures.py), times the feed, profile and
+single flit routes through the test client, moves the oldest --fraction of
+flits to the archive with archive.py, VACUUMs, and times them again. The
+single flit and last profile page are picked so they fall through to the
+archive afterwards.
+
+    python benchmarks/bench_archive.py --db bench/tweetor.db --fraction 0.9
+"""
+import argparse
+import json
+import os
+import runpy
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+import stubs
+
+
+def timed(client, path, requests):
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = client.get(path)
+        samples.append(time.perf_counter() - start)
+        assert response.status_code == 200, (path, response.status_code)
+    samples.sort()
+    return {
+        "p50_ms": round(samples[len(samples) // 2] * 1000, 2),
+        "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, 2),
+    }
+
+
+def sizes():
+    mb = {}
+    for name in ("tweetor.db", "tweetor_archive.db"):
+        if os.path.exists(name):
+            mb[name] = round(os.path.getsize(name) / 2**20, 1)
+    return mb
+
+
+def measure(client, paths):
+    return {name: timed(client, path, count) for name, (path, count) in paths.items()} | {"size_mb": sizes()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", required=True, help="fixture database from fixtures.py")
+    parser.add_argument("--fraction", type=float, default=0.9, help="share of flits to archive")
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    database = os.path.abspath(args.db)
+    scratch = tempfile.mkdtemp(prefix="tweetor-archive-")
+    try:
+        shutil.copy(database, os.path.join(scratch, "tweetor.db"))
+        for name in ("blocklist.txt", "profane_words.json"):
+            shutil.copy(os.path.join(ROOT, name), scratch)
+        os.chdir(scratch)
+        # Brings older fixtures up to the current indexes
+        runpy.run_path(os.path.join(ROOT, "database_setup.py"), run_name="__main__")
+
+        db = sqlite3.connect("tweetor.db")
+        (flits,) = db.execute("SELECT count(*) FROM flits").fetchone()
+        (cutoff,) = db.execute(
+            "SELECT timestamp FROM flits ORDER BY timestamp LIMIT 1 OFFSET ?", (int(flits * args.fraction),)
+        ).fetchone()
+        (old_flit,) = db.execute("SELECT id FROM flits WHERE timestamp < ? ORDER BY id LIMIT 1", (cutoff,)).fetchone()
+        (busy,) = db.execute(
+            "SELECT userHandle FROM flits GROUP BY userHandle ORDER BY count(*) DESC LIMIT 1"
+        ).fetchone()
+        (busy_flits,) = db.execute("SELECT count(*) FROM flits WHERE userHandle = ?", (busy,)).fetchone()
+        db.execute("VACUUM")
+        db.close()
+
+        import app as tweetor
+        import archive
+
+        stubs.install(tweetor)
+        client = tweetor.app.test_client()
+        last_page = (busy_flits - 1) // tweetor.PROFILE_PAGE_SIZE + 1
+        paths = {
+            "home": ("/", max(1, args.requests // 50)),
+            "api_get_flits": ("/api/get_flits?skip=0&limit=10", args.requests),
+            "api_get_flits_page_50": ("/api/get_flits?skip=500&limit=10", args.requests),
+            "profile_first_page": (f"/user/{busy}", args.requests),
+            "profile_last_page": (f"/user/{busy}?page={last_page}", args.requests),
+            "old_flit": (f"/flits/{old_flit}", args.requests),
+        }
+
+        results = {"flits": flits, "archived_fraction": args.fraction}
+        results["before"] = measure(client, paths)
+        start = time.perf_counter()
+        results["archived"] = archive.archive_before(cutoff, batch=5000, pause=0, log=lambda *a: None)
+        db = sqlite3.connect("tweetor.db")
+        db.execute("VACUUM")
+        db.close()
+        results["archive_seconds"] = round(time.perf_counter() - start, 1)
+        results["after"] = measure(client, paths)
+        print(json.dumps(results, indent=2))
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(scratch)
+
+
+if __name__ == "__main__":
+    main()
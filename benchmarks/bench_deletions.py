@@ -0,0 +1,90 @@
+"""Home feed latency while a busy user's content is deleted in the background.
+
+Copies a fixture database (see fixtures.py), deletes its busiest user
+with deletions.delete_user() and, until the job has finished, requests
+the first feed page through the test client as fast as it can. Reports
+how long the cascade took, how many rows it deleted, and the feed's
+p50/p99 during it, next to a baseline taken before the deletion.
+
+    python benchmarks/bench_deletions.py --db bench/tweetor.db
+"""
+import argparse
+import json
+import os
+import runpy
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+import stubs
+
+FEED = "/api/get_flits?skip=0&limit=10"
+
+
+def summary(samples):
+    samples = sorted(samples)
+    return {
+        "requests": len(samples),
+        "p50_ms": round(samples[len(samples) // 2] * 1000, 3),
+        "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, 3),
+    }
+
+
+def timed(client):
+    start = time.perf_counter()
+    assert client.get(FEED).status_code == 200
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", required=True, help="fixture database from fixtures.py")
+    parser.add_argument("--baseline", type=int, default=500, help="feed requests before the deletion")
+    args = parser.parse_args()
+
+    database = os.path.abspath(args.db)
+    scratch = tempfile.mkdtemp(prefix="tweetor-deletions-")
+    try:
+        shutil.copy(database, os.path.join(scratch, "tweetor.db"))
+        for name in ("blocklist.txt", "profane_words.json"):
+            shutil.copy(os.path.join(ROOT, name), scratch)
+        os.chdir(scratch)
+        runpy.run_path(os.path.join(ROOT, "database_setup.py"), run_name="__main__")
+
+        import app as tweetor
+        import deletions
+
+        stubs.install(tweetor)
+        client = tweetor.app.test_client()
+        db = sqlite3.connect("tweetor.db")
+        handle, flits = db.execute(
+            "SELECT userHandle, count(*) FROM flits GROUP BY userHandle ORDER BY count(*) DESC LIMIT 1"
+        ).fetchone()
+        db.close()
+
+        results = {"handle": handle, "flits": flits}
+        results["baseline"] = summary([timed(client) for _ in range(args.baseline)])
+
+        start = time.perf_counter()
+        deletions.delete_user(handle)
+        samples = []
+        while not deletions.wait_idle(timeout=0):
+            samples.append(timed(client))
+        results["deletion_seconds"] = round(time.perf_counter() - start, 2)
+        results["during_deletion"] = summary(samples)
+        db = sqlite3.connect("tweetor.db")
+        (results["rows_deleted"],) = db.execute("SELECT deleted FROM deletion_jobs WHERE target = ?", (handle,)).fetchone()
+        db.close()
+        print(json.dumps(results, indent=2))
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(scratch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Per-message server cost: form post + redirect + re-render vs WebSocket send.
+
+Builds a scratch database with a conversation of --history messages, then
+times sending --messages more, first through POST /submit_dm followed by
+the GET /dm/<handle> it redirects to, then as "send" frames on one
+/ws/dm/<handle> connection with the other participant subscribed.
+SightEngine and rate limits are stubbed out so only our own work is timed.
+
+    python benchmarks/bench_dm.py --history 500 --messages 200
+"""
+import argparse
+import json
+import os
+import runpy
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+
+class FakeSocket:
+    closed = False
+
+    def __init__(self, frames=()):
+        self.frames = list(frames)
+        self.sent = 0
+
+    def receive(self):
+        return self.frames.pop(0) if self.frames else None
+
+    def send(self, data):
+        self.sent += 1
+
+    def close(self):
+        self.closed = True
+
+
+def setup(scratch, history):
+    for name in ("blocklist.txt", "profane_words.json"):
+        shutil.copy(os.path.join(ROOT, name), scratch)
+    os.chdir(scratch)
+    runpy.run_path(os.path.join(ROOT, "database_setup.py"), run_name="__main__")
+
+    db = sqlite3.connect("tweetor.db")
+    for handle in ("bob", "amy"):
+        db.execute(
+            "INSERT INTO users (username, handle, password) VALUES (?, ?, ?)",
+            (handle, handle, "x"),
+        )
+    db.executemany(
+        "INSERT INTO direct_messages (sender_handle, receiver_handle, content, profane_dm) VALUES (?, ?, ?, 'no')",
+        [(("bob", "amy") if i % 2 else ("amy", "bob")) + (f"message {i}",) for i in range(history)],
+    )
+    db.commit()
+    db.close()
+
+    import app as tweetor
+
+    tweetor.is_profanity = lambda text: {"status": "success", "profanity": {"matches": []}}
+    tweetor.limiter.enabled = False
+    tweetor.app.config["WTF_CSRF_ENABLED"] = False
+    tweetor.dm_socket_limit = tweetor.parse_limit("1000000/minute")
+    return tweetor
+
+
+def login(tweetor, handle):
+    client = tweetor.app.test_client()
+    with client.session_transaction() as session:
+        session["handle"] = handle
+        session["username"] = handle
+    return client
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--history", type=int, default=500)
+    parser.add_argument("--messages", type=int, default=200)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="tweetor-dm-")
+    try:
+        tweetor = setup(scratch, args.history)
+        client = login(tweetor, "bob")
+
+        start = time.perf_counter()
+        for i in range(args.messages):
+            response = client.post("/submit_dm/amy", data={"content": f"post {i}"}, follow_redirects=True)
+            assert response.status_code == 200
+        redirect_cost = (time.perf_counter() - start) / args.messages
+
+        # Amy is listening, so every message is also pushed to her socket
+        listener = FakeSocket()
+        amy = tweetor.dm_channel.Subscriber(listener, "amy", "bob", [])
+        tweetor.dm_channel.subscribers[tweetor.dm_channel.conversation_key("amy", "bob")].add(amy)
+        frames = [json.dumps({"type": "send", "client_id": str(i), "content": f"ws {i}"}) for i in range(args.messages)]
+        sender = FakeSocket(frames)
+        start = time.perf_counter()
+        client.get(
+            "/ws/dm/amy",
+            headers={"Upgrade": "websocket", "Connection": "Upgrade"},
+            environ_overrides={"wsgi.websocket": sender},
+        )
+        socket_cost = (time.perf_counter() - start) / args.messages
+        assert listener.sent == args.messages
+
+        print(json.dumps({
+            "history": args.history,
+            "messages": args.messages,
+            "post_redirect_rerender_ms": round(redirect_cost * 1000, 3),
+            "websocket_send_ms": round(socket_cost * 1000, 3),
+        }, indent=2))
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(scratch)
+
+
+if __name__ == "__main__":
+    main()
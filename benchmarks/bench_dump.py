@@ -0,0 +1,66 @@
+"""Export and import throughput of dump.py, in both formats.
+
+Exports --tables from a fixture database (see fixtures.py) and imports
+the dump into an empty database, once per format, and reports rows/sec
+each way and the dump's size. dump.py's targets are 100k rows/s out and
+50k rows/s in on one core.
+
+    python benchmarks/bench_dump.py --db bench/tweetor.db --tables flits
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+import dump
+
+
+def quiet(*args):
+    pass
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", required=True, help="fixture database from fixtures.py")
+    parser.add_argument("--tables", default="flits")
+    args = parser.parse_args()
+
+    database = os.path.abspath(args.db)
+    tables = args.tables.split(",")
+    db = sqlite3.connect(database)
+    rows = sum(db.execute(f"SELECT count(*) FROM {table}").fetchone()[0] for table in tables)
+    db.close()
+
+    results = {"rows": rows}
+    scratch = tempfile.mkdtemp(prefix="tweetor-dump-")
+    try:
+        for format in ("ndjson", "columnar"):
+            out = os.path.join(scratch, format)
+            start = time.perf_counter()
+            dump.export_dump(database, out, tables, format, log=quiet)
+            export_seconds = time.perf_counter() - start
+            size = sum(entry.stat().st_size for entry in os.scandir(out))
+
+            start = time.perf_counter()
+            dump.import_dump(out, os.path.join(scratch, f"{format}.db"), tables, log=quiet)
+            import_seconds = time.perf_counter() - start
+            results[format] = {
+                "export_rows_per_s": round(rows / export_seconds),
+                "import_rows_per_s": round(rows / import_seconds),
+                "bytes": size,
+            }
+            print(format, results[format], file=sys.stderr)
+        print(json.dumps(results, indent=2))
+    finally:
+        shutil.rmtree(scratch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Serializing a feed page, one object per flit versus ?format=columnar.
+
+Copies a fixture database (see fixtures.py), reads one --limit flit page
+of the home feed with storage.feed_page() and serializes it --repeat
+times each way, the way get_flits() does: inside a request, through
+jsonify. For each format it reports CPU per page (time.process_time),
+the body's size raw and gzipped, and the CPU json.loads takes to parse
+it again, standing in for the client's res.json().
+
+    python benchmarks/bench_feed_format.py --db bench/tweetor.db --limit 1000
+"""
+import argparse
+import gzip
+import json
+import os
+import runpy
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+import stubs
+
+
+def cpu_ms(f, repeat):
+    start = time.process_time()
+    for _ in range(repeat):
+        result = f()
+    return round((time.process_time() - start) / repeat * 1000, 3), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", required=True, help="fixture database from fixtures.py")
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    database = os.path.abspath(args.db)
+    scratch = tempfile.mkdtemp(prefix="tweetor-feed-format-")
+    try:
+        shutil.copy(database, os.path.join(scratch, "tweetor.db"))
+        for name in ("blocklist.txt", "profane_words.json"):
+            shutil.copy(os.path.join(ROOT, name), scratch)
+        os.chdir(scratch)
+        runpy.run_path(os.path.join(ROOT, "database_setup.py"), run_name="__main__")
+
+        import app as tweetor
+        import columnar
+        import storage
+        from flask import jsonify
+
+        stubs.install(tweetor)
+        formats = {
+            "objects": lambda rows: jsonify([dict(row) for row in rows]),
+            "columnar": lambda rows: jsonify(columnar.encode(rows)),
+        }
+        results = {}
+        with tweetor.app.test_request_context("/api/get_flits"):
+            rows = storage.feed_page(None, args.limit, 0)
+            results["flits"] = len(rows)
+            for name, serialize in formats.items():
+                serialize_ms, body = cpu_ms(lambda: serialize(rows).get_data(), args.repeat)
+                parse_ms, _ = cpu_ms(lambda: json.loads(body), args.repeat)
+                results[name] = {
+                    "serialize_cpu_ms": serialize_ms,
+                    "parse_cpu_ms": parse_ms,
+                    "bytes": len(body),
+                    "gzip_bytes": len(gzip.compress(body, 6)),
+                }
+        print(json.dumps(results, indent=2))
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(scratch)
+
+
+if __name__ == "__main__":
+    main()
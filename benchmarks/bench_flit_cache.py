@@ -0,0 +1,105 @@
+"""Single-flit lookups under a Zipf-distributed id workload, flit_cache on and off.
+
+Copies a fixture database (see fixtures.py) and requests /api/flit, then
+/flits/<id>, through the test client for ids drawn so the k-th most
+popular is requested in proportion to 1 / k**s. One in --missing
+requests is for an id that doesn't exist. Each request's latency is
+timed, first with flit_cache off (TWEETOR_FLIT_CACHE_MB=0) and then on
+at --mb. The cached runs also report their hit ratio, and the cache's
+entries and estimated bytes when they finish.
+
+    python benchmarks/bench_flit_cache.py --db bench/tweetor.db --requests 20000
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import runpy
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+import stubs
+
+
+def workload(flit_ids, requests, s, missing, seed=1):
+    """requests ids, the most popular first in a shuffled ranking."""
+    rng = random.Random(seed)
+    ranked = list(flit_ids)
+    rng.shuffle(ranked)
+    weights = list(itertools.accumulate(1 / k**s for k in range(1, len(ranked) + 1)))
+    ids = rng.choices(ranked, cum_weights=weights, k=requests)
+    absent = max(flit_ids) + 1
+    return [absent + i if missing and i % missing == 0 else flit_id for i, flit_id in enumerate(ids)]
+
+
+def run(client, route, ids):
+    samples = []
+    start = time.perf_counter()
+    for flit_id in ids:
+        path = route.format(flit_id)
+        before = time.perf_counter()
+        response = client.get(path)
+        samples.append(time.perf_counter() - before)
+        assert response.status_code in (200, 302), path
+    elapsed = time.perf_counter() - start
+    samples.sort()
+    return {
+        "requests_per_s": round(len(ids) / elapsed),
+        "p50_ms": round(samples[len(samples) // 2] * 1000, 3),
+        "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", required=True, help="fixture database from fixtures.py")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--s", type=float, default=1.1, help="Zipf exponent")
+    parser.add_argument("--missing", type=int, default=20, help="every nth request is for a missing id, 0 for none")
+    parser.add_argument("--mb", type=float, default=16, help="TWEETOR_FLIT_CACHE_MB for the cached run")
+    args = parser.parse_args()
+
+    database = os.path.abspath(args.db)
+    scratch = tempfile.mkdtemp(prefix="tweetor-flit-cache-")
+    try:
+        shutil.copy(database, os.path.join(scratch, "tweetor.db"))
+        for name in ("blocklist.txt", "profane_words.json"):
+            shutil.copy(os.path.join(ROOT, name), scratch)
+        os.chdir(scratch)
+        runpy.run_path(os.path.join(ROOT, "database_setup.py"), run_name="__main__")
+
+        import app as tweetor
+        import flit_cache
+        import storage
+
+        stubs.install(tweetor)
+        client = tweetor.app.test_client()
+        flit_ids = [row["id"] for row in storage.fetchall("SELECT id FROM flits")]
+        ids = workload(flit_ids, args.requests, args.s, args.missing)
+        results = {"flits": len(flit_ids), "distinct_ids": len(set(ids))}
+
+        for name, route in (("api_flit", "/api/flit?flit_id={}"), ("flit_page", "/flits/{}")):
+            flit_cache.max_bytes = 0
+            flit_cache.clear()
+            results[f"{name}_off"] = run(client, route, ids)
+
+            flit_cache.max_bytes = int(args.mb * 2**20)
+            flit_cache.clear()
+            hits, misses = flit_cache.hits, flit_cache.misses
+            on = results[f"{name}_on"] = run(client, route, ids)
+            hits, misses = flit_cache.hits - hits, flit_cache.misses - misses
+            on.update(hit_ratio=round(hits / (hits + misses), 3), entries=len(flit_cache._cache), bytes=flit_cache._size)
+        print(json.dumps(results, indent=2))
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(scratch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Hashtag backfill time, tag timeline latency and /api/trending latency.
+
+Copies a fixture database (see fixtures.py), runs hashtags.py's backfill
+over every flit, then times /api/hashtag/<tag> through the test client:
+the first page, and a page --depth flits into the tag's history (the
+before= cursor of a reader who kept scrolling). The same deep page is
+also timed as a LIKE '%#tag%' scan, which is what a tag search needed
+without the index. The fixture's four tags are each on about a quarter
+of all flits, so a scan soon finds ten; --rare more flits, spread evenly
+through history, are tagged #rare first, and its first page is timed
+both ways too. /api/trending is timed for its first read, which
+loads the last 24 hours, and for the reads after it.
+
+    python benchmarks/bench_hashtags.py --db bench/tweetor.db --tag music
+"""
+import argparse
+import json
+import os
+import runpy
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+import stubs
+
+
+def timed(f, requests):
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        f()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {
+        "p50_ms": round(samples[len(samples) // 2] * 1000, 2),
+        "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", required=True, help="fixture database from fixtures.py")
+    parser.add_argument("--tag", default="music")
+    parser.add_argument("--depth", type=int, default=100000, help="flits into the tag's history for the deep page")
+    parser.add_argument("--rare", type=int, default=100, help="flits to tag #rare")
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    database = os.path.abspath(args.db)
+    scratch = tempfile.mkdtemp(prefix="tweetor-hashtags-")
+    try:
+        shutil.copy(database, os.path.join(scratch, "tweetor.db"))
+        for name in ("blocklist.txt", "profane_words.json"):
+            shutil.copy(os.path.join(ROOT, name), scratch)
+        os.chdir(scratch)
+        runpy.run_path(os.path.join(ROOT, "database_setup.py"), run_name="__main__")
+        db = sqlite3.connect("tweetor.db")
+        (last,) = db.execute("SELECT max(id) FROM flits").fetchone()
+        db.execute(
+            "UPDATE flits SET content = content || ' #rare' WHERE id % ? = 0", (max(1, last // args.rare),)
+        )
+        db.commit()
+        db.close()
+
+        import app as tweetor
+        import hashtags
+
+        stubs.install(tweetor)
+        client = tweetor.app.test_client()
+        results = {}
+
+        start = time.perf_counter()
+        results["backfill_tags"] = hashtags.backfill(pause=0, log=lambda _: None)
+        results["backfill_s"] = round(time.perf_counter() - start, 1)
+
+        db = sqlite3.connect("tweetor.db")
+        results["flits"] = db.execute("SELECT count(*) FROM flits").fetchone()[0]
+        results["tagged"] = db.execute("SELECT count(*) FROM flit_hashtags WHERE tag = ?", (args.tag,)).fetchone()[0]
+        row = db.execute(
+            "SELECT flit_id FROM flit_hashtags WHERE tag = ? ORDER BY flit_id DESC LIMIT 1 OFFSET ?",
+            (args.tag, min(args.depth, results["tagged"] - 1)),
+        ).fetchone()
+        before = row[0]
+
+        def page(path):
+            response = client.get(path)
+            assert response.status_code == 200 and response.get_json(), path
+
+        results["timeline_first_page"] = timed(lambda: page(f"/api/hashtag/{args.tag}"), args.requests)
+        results["timeline_deep_page"] = timed(lambda: page(f"/api/hashtag/{args.tag}?before={before}"), args.requests)
+
+        def like_scan(tag, before):
+            # A tag search without flit_hashtags
+            assert db.execute(
+                "SELECT id FROM flits WHERE content LIKE ? AND id < ? AND profane_flit = 'no' ORDER BY id DESC LIMIT 10",
+                (f"%#{tag}%", before),
+            ).fetchall()
+
+        scans = max(1, args.requests // 20)
+        results["like_scan_deep_page"] = timed(lambda: like_scan(args.tag, before), scans)
+        results["rare_first_page"] = timed(lambda: page("/api/hashtag/rare"), args.requests)
+        results["like_scan_rare_first_page"] = timed(lambda: like_scan("rare", 2**63 - 1), scans)
+
+        results["trending_first_ms"] = round(timed(lambda: page("/api/trending"), 1)["p50_ms"], 2)
+        results["trending"] = timed(lambda: client.get("/api/trending"), args.requests)
+        results["trending_top"] = client.get("/api/trending?limit=5").get_json()
+        db.close()
+        print(json.dumps(results, indent=2))
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(scratch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""CPU time to render a 50-flit profile page, with and without the fragment cache.
+
+Renders the busiest user's profile through the test client and reports
+the CPU time per page for three states of fragments.py: the cache off,
+a cold cache (cleared before every page) and a warm one. It also
+reports what the browser used to add on top of the page: one /api/flit
+request per flit. Template compile time is measured twice:
+once with the bytecode cache empty, and once loading what the first
+pass stored.
+
+    python benchmarks/bench_render.py --db bench/tweetor.db
+"""
+import argparse
+import json
+import os
+import runpy
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+import stubs
+
+
+def cpu_ms(f, requests):
+    samples = []
+    for _ in range(requests):
+        start = time.process_time()
+        f()
+        samples.append(time.process_time() - start)
+    samples.sort()
+    return {
+        "p50_ms": round(samples[len(samples) // 2] * 1000, 2),
+        "mean_ms": round(sum(samples) / len(samples) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", required=True, help="fixture database from fixtures.py")
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    database = os.path.abspath(args.db)
+    scratch = tempfile.mkdtemp(prefix="tweetor-render-")
+    try:
+        shutil.copy(database, os.path.join(scratch, "tweetor.db"))
+        for name in ("blocklist.txt", "profane_words.json"):
+            shutil.copy(os.path.join(ROOT, name), scratch)
+        os.chdir(scratch)
+        runpy.run_path(os.path.join(ROOT, "database_setup.py"), run_name="__main__")
+
+        db = sqlite3.connect("tweetor.db")
+        (busy,) = db.execute(
+            "SELECT userHandle FROM flits GROUP BY userHandle ORDER BY count(*) DESC LIMIT 1"
+        ).fetchone()
+        flit_ids = [row[0] for row in db.execute(
+            "SELECT id FROM flits WHERE userHandle = ? ORDER BY timestamp DESC LIMIT 50", (busy,)
+        )]
+        db.close()
+
+        import app as tweetor
+        import fragments
+        from jinja2 import FileSystemBytecodeCache
+
+        stubs.install(tweetor)
+        client = tweetor.app.test_client()
+        path = f"/user/{busy}"
+
+        results = {"flits_on_page": len(flit_ids)}
+        bytecode = tempfile.mkdtemp(prefix="tweetor-bytecode-")
+        tweetor.app.jinja_env.bytecode_cache = FileSystemBytecodeCache(bytecode)
+        for state in ("compile_templates_cold_ms", "compile_templates_cached_ms"):
+            tweetor.app.jinja_env.cache.clear()
+            start = time.process_time()
+            fragments.precompile(tweetor.app)
+            results[state] = round((time.process_time() - start) * 1000, 1)
+        shutil.rmtree(bytecode)
+
+        def page():
+            assert client.get(path).status_code == 200
+
+        def api_flits():
+            # Before, the page held empty divs and the browser then asked
+            # for each flit on top of the page itself
+            for flit_id in flit_ids:
+                client.get(f"/api/flit?flit_id={flit_id}")
+
+        max_bytes = fragments.max_bytes
+        fragments.max_bytes = 0
+        results["cache_off"] = cpu_ms(page, args.requests)
+        fragments.max_bytes = max_bytes
+        results["cache_cold"] = cpu_ms(lambda: (fragments.clear(), page()), args.requests)
+        page()
+        results["cache_warm"] = cpu_ms(page, args.requests)
+        results["api_flit_x50"] = cpu_ms(api_flits, max(1, args.requests // 10))
+        print(json.dumps(results, indent=2))
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(scratch)
+
+
+if __name__ == "__main__":
+    main()
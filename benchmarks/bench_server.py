@@ -0,0 +1,60 @@
+"""Load test the development server (python app.py) against server.py.
+
+Starts each server in turn from the directory holding tweetor.db, hammers a
+few read routes with concurrent keep-alive clients for a fixed time and
+prints requests/sec and latency percentiles as JSON.
+
+    python benchmarks/bench_server.py --dir . --clients 50 --seconds 20
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import loadgen
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+PATHS = ["/healthz", "/api/get_flits?skip=0&limit=10", "/api/flit?flit_id=1"]
+
+SERVERS = {
+    "dev": [sys.executable, "-c", "import sys, app; app.app.run(port=int(sys.argv[1]), threaded=False)"],
+    "gevent": [sys.executable, os.path.join(ROOT, "server.py")],
+}
+
+
+def load(port, clients, seconds, paths=PATHS):
+    def next_request(i):
+        return [("GET", paths[i % len(paths)], None, None)]
+
+    return loadgen.run_clients(lambda: loadgen.http_worker(port, next_request), clients, seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dir", default=".", help="directory containing tweetor.db")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--workers", type=int, default=1, help="server.py worker processes")
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYTHONPATH=ROOT, TWEETOR_PORT=str(args.port), TWEETOR_WORKERS=str(args.workers))
+    results = {"clients": args.clients, "seconds": args.seconds, "paths": PATHS}
+    for name, command in SERVERS.items():
+        proc = subprocess.Popen(
+            command + [str(args.port)], cwd=args.dir, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            loadgen.wait_until_up(args.port)
+            results[name] = load(args.port, args.clients, args.seconds)
+        finally:
+            proc.terminate()
+            proc.wait()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
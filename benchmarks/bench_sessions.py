@@ -0,0 +1,160 @@
+"""Compare the SQLite session store against the old filesystem backend.
+
+Seeds the same number of sessions into both backends, then times
+open_session/save_session for random existing sessions, once with the
+session left untouched and once with a write. Results are printed as JSON.
+
+    python benchmarks/bench_sessions.py --sessions 1000000 --ops 20000
+"""
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from flask import Flask
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from sqlite_session import SQLiteSessionInterface
+
+
+class FileSystemSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None):
+        def on_update(self):
+            self.modified = True
+
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.modified = False
+
+
+class FileSystemSessionInterface(SessionInterface):
+    """What SESSION_TYPE = "filesystem" did: one pickled file per session,
+    named by the md5 of its key, holding the expiry followed by the data."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, sid):
+        return os.path.join(self.directory, hashlib.md5(sid.encode()).hexdigest())
+
+    def write(self, sid, data, expiry):
+        with open(self.path(sid), "wb") as f:
+            pickle.dump(expiry, f)
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        try:
+            with open(self.path(sid), "rb") as f:
+                expiry = pickle.load(f)
+                if expiry > time.time():
+                    return FileSystemSession(pickle.load(f), sid)
+        except (OSError, TypeError):
+            pass
+        return FileSystemSession(sid=sid)
+
+    def save_session(self, app, session, response):
+        if not session.modified:
+            return
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        self.write(session.sid, dict(session), time.time() + lifetime)
+
+
+def session_data(i):
+    return {"handle": f"user{i}", "username": f"user{i}", "csrf_token": os.urandom(20).hex()}
+
+
+def seed_sqlite(interface, count):
+    expiry = int(time.time()) + 86400
+    interface.execute("SELECT 1")
+    db = sqlite3.connect(interface.database)
+    batch = []
+    for i in range(count):
+        batch.append((f"sid{i}", interface.serializer.dumps(session_data(i)), expiry))
+        if len(batch) == 10000:
+            db.executemany("INSERT INTO sessions VALUES (?, ?, ?)", batch)
+            db.commit()
+            batch = []
+    db.executemany("INSERT INTO sessions VALUES (?, ?, ?)", batch)
+    db.commit()
+    db.close()
+
+
+def seed_filesystem(interface, count):
+    expiry = time.time() + 86400
+    for i in range(count):
+        interface.write(f"sid{i}", session_data(i), expiry)
+
+
+def percentile(samples, p):
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def run(app, interface, count, ops, modify):
+    app.session_interface = interface
+    timings = []
+    for _ in range(ops):
+        sid = f"sid{random.randrange(count)}"
+        request = app.request_class({"HTTP_COOKIE": f"session={sid}"})
+        response = app.response_class()
+        start = time.perf_counter()
+        s = interface.open_session(app, request)
+        assert s.get("handle") is not None
+        if modify:
+            s["last_seen"] = time.time()
+        interface.save_session(app, s, response)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        "ops_per_sec": round(ops / sum(timings)),
+        "p50_us": round(percentile(timings, 0.50) * 1e6, 1),
+        "p99_us": round(percentile(timings, 0.99) * 1e6, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=1_000_000)
+    parser.add_argument("--ops", type=int, default=20_000)
+    parser.add_argument("--dir", default=None, help="scratch directory (default: a temp dir)")
+    args = parser.parse_args()
+
+    scratch = args.dir or tempfile.mkdtemp(prefix="tweetor-sessions-")
+    os.makedirs(os.path.join(scratch, "flask_session"), exist_ok=True)
+    app = Flask(__name__)
+    app.secret_key = "bench"
+
+    sqlite_interface = SQLiteSessionInterface(os.path.join(scratch, "sessions.db"))
+    filesystem_interface = FileSystemSessionInterface(os.path.join(scratch, "flask_session"))
+
+    results = {"sessions": args.sessions, "ops": args.ops}
+    for name, interface, seed in (
+        ("sqlite", sqlite_interface, seed_sqlite),
+        ("filesystem", filesystem_interface, seed_filesystem),
+    ):
+        start = time.perf_counter()
+        seed(interface, args.sessions)
+        results[name] = {
+            "seed_seconds": round(time.perf_counter() - start, 1),
+            "read": run(app, interface, args.sessions, args.ops, modify=False),
+            "write": run(app, interface, args.sessions, args.ops, modify=True),
+        }
+
+    sqlite_interface.close()
+    if args.dir is None:
+        shutil.rmtree(scratch)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""The storage.py repository on SQLite and on PostgreSQL, on the same data.
+
+Copies a fixture database (see fixtures.py) to a scratch directory for
+SQLite, and loads the same users, flits, DMs and blocks into a new
+database on the PostgreSQL server at --postgres. Then, per backend, it
+times each read the routes make, and the insert rate and latency of
+--writers threads posting flits at once for --seconds. Prints JSON.
+
+    python benchmarks/bench_storage.py --db bench/tweetor.db --postgres postgresql://postgres@localhost/postgres
+
+Without --postgres only SQLite is measured.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import re
+import runpy
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+import storage
+
+TABLES = {
+    "users": "id, username, turbo, handle, password",
+    "flits": "id, content, timestamp, profane_flit, userHandle, username, hashtag, ip, is_reflit, meme_link, original_flit_id",
+    "direct_messages": "id, sender_handle, receiver_handle, content, profane_dm, timestamp",
+    "blocks": "id, blocker_handle, blocked_handle, block_time",
+}
+
+
+def timed(f, requests):
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        f()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {
+        "p50_ms": round(samples[len(samples) // 2] * 1000, 2),
+        "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, 2),
+    }
+
+
+def load_postgres(sqlite_path, server_url, log):
+    """Copy the fixture into a new database on server_url, returning its URL."""
+    import psycopg2
+
+    name = f"tweetor_bench_{uuid.uuid4().hex[:8]}"
+    admin = psycopg2.connect(server_url)
+    admin.autocommit = True
+    admin.cursor().execute(f"CREATE DATABASE {name}")
+    admin.close()
+    url = re.sub(r"/[^/]*$", f"/{name}", server_url)
+
+    backend = storage.PostgresBackend(url, size=1)
+    backend.create_schema()
+    source = sqlite3.connect(sqlite_path)
+    connection = psycopg2.connect(url)
+    for table, columns in TABLES.items():
+        start = time.perf_counter()
+        rows = source.execute(f"SELECT {columns} FROM {table}")
+        while True:
+            chunk = rows.fetchmany(100_000)
+            if not chunk:
+                break
+            buffer = io.StringIO()
+            # Quoted, so '' stays an empty string and only None loads as NULL
+            csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC).writerows(chunk)
+            buffer.seek(0)
+            connection.cursor().copy_expert(f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+        cursor = connection.cursor()
+        # Ids were copied, so move each identity past them
+        cursor.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), coalesce(max(id), 0) + 1, false) FROM {table}")
+        connection.commit()
+        log(f"postgresql: {table} loaded in {time.perf_counter() - start:.1f}s")
+    # Sets the visibility map too, as a long-running server would have, so
+    # counts can be index-only scans
+    connection.autocommit = True
+    connection.cursor().execute("VACUUM ANALYZE")
+    connection.close()
+    source.close()
+    backend.close()
+    return url, name
+
+
+def drop_postgres(server_url, name):
+    import psycopg2
+
+    admin = psycopg2.connect(server_url)
+    admin.autocommit = True
+    admin.cursor().execute(f"DROP DATABASE IF EXISTS {name} WITH (FORCE)")
+    admin.close()
+
+
+def writers(count, seconds):
+    latencies, errors = [], []
+    stop_at = time.time() + seconds
+
+    def post(n):
+        i = 0
+        while time.time() < stop_at:
+            start = time.perf_counter()
+            try:
+                storage.insert_flit(f"user{n}", f"user{n}", f"bench {n}-{i} {time.time()}", "", None, "127.0.0.1")
+            except Exception as e:
+                errors.append(repr(e))
+            else:
+                latencies.append(time.perf_counter() - start)
+            i += 1
+
+    threads = [threading.Thread(target=post, args=(n,)) for n in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    latencies.sort()
+    return {
+        "inserts_per_sec": round(len(latencies) / seconds),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2) if latencies else None,
+        "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 2) if latencies else None,
+        "errors": len(errors),
+    }
+
+
+def measure(args, busy, partner, flit_id):
+    (hot, total, _) = storage.user_flit_stats(busy)
+    reads = {
+        "feed_first_page": lambda: storage.feed_page("user1", 10, 0),
+        "feed_page_1000": lambda: storage.feed_page("user1", 10, 10_000),
+        "flit": lambda: storage.flit(flit_id),
+        "user": lambda: storage.user(busy),
+        "profile_stats": lambda: storage.user_flit_stats(busy),
+        "profile_first_page": lambda: storage.user_flits(busy, 50, 0, hot),
+        "profile_page_20": lambda: storage.user_flits(busy, 50, 50 * 19, hot),
+        "conversation": lambda: storage.conversation(busy, partner),
+        "blocked_handles": lambda: storage.blocked_handles(busy),
+    }
+    results = {name: timed(f, args.requests) for name, f in reads.items()}
+    results["insert_flit_1_writer"] = writers(1, args.seconds)
+    results[f"insert_flit_{args.writers}_writers"] = writers(args.writers, args.seconds)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", required=True, help="fixture database from fixtures.py")
+    parser.add_argument("--postgres", help="postgresql:// URL of a server to create the benchmark database on")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--writers", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    log = lambda message: print(message, file=sys.stderr)
+    database = os.path.abspath(args.db)
+    scratch = tempfile.mkdtemp(prefix="tweetor-storage-")
+    postgres = None
+    try:
+        shutil.copy(database, os.path.join(scratch, "tweetor.db"))
+        for name in ("blocklist.txt", "profane_words.json"):
+            shutil.copy(os.path.join(ROOT, name), scratch)
+        os.chdir(scratch)
+        runpy.run_path(os.path.join(ROOT, "database_setup.py"), run_name="__main__")
+
+        db = sqlite3.connect("tweetor.db")
+        (busy,) = db.execute("SELECT userHandle FROM flits GROUP BY userHandle ORDER BY count(*) DESC LIMIT 1").fetchone()
+        (partner,) = db.execute(
+            "SELECT receiver_handle FROM direct_messages WHERE sender_handle = ? GROUP BY 1 ORDER BY count(*) DESC LIMIT 1",
+            (busy,),
+        ).fetchone() or ("user1",)
+        (flit_id,) = db.execute("SELECT id FROM flits ORDER BY id LIMIT 1 OFFSET (SELECT count(*) / 2 FROM flits)").fetchone()
+        results = {"flits": db.execute("SELECT count(*) FROM flits").fetchone()[0]}
+        db.close()
+
+        if args.postgres:
+            url, postgres = load_postgres("tweetor.db", args.postgres, log)
+            storage.use(storage.PostgresBackend(url, size=args.writers))
+            results["postgresql"] = measure(args, busy, partner, flit_id)
+            storage.backend().close()
+
+        storage.use(storage.SQLiteBackend())
+        results["sqlite"] = measure(args, busy, partner, flit_id)
+        print(json.dumps(results, indent=2))
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(scratch)
+        if postgres:
+            drop_postgres(args.postgres, postgres)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Post latency and write lock hold time for submit_flit on a large table.
+
+Seeds --flits rows into a scratch database, then times:
+  - the old duplicate check, SELECT * FROM flits ORDER BY timestamp DESC LIMIT 1
+  - insert_flit() alone, which is the BEGIN IMMEDIATE ... COMMIT window
+    (plus opening the connection), i.e. how long the write lock is held
+  - a full POST /submit_flit through the test client
+SightEngine, Mixpanel and rate limits are stubbed out.
+
+    python benchmarks/bench_submit_flit.py --flits 10000000 --posts 500
+"""
+import argparse
+import json
+import os
+import runpy
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+import storage
+
+
+def seed(count, users=1000):
+    db = sqlite3.connect("tweetor.db")
+    db.executemany(
+        "INSERT INTO users (username, handle, password) VALUES (?, ?, 'x')",
+        ((f"user{i}", f"user{i}") for i in range(users)),
+    )
+    rows = (
+        (f"user{i % users}", f"flit number {i}", f"user{i % users}", "", "no", "", 0, -1, "127.0.0.1")
+        for i in range(count)
+    )
+    db.executemany(
+        "INSERT INTO flits (username, content, userHandle, hashtag, profane_flit, meme_link, is_reflit, original_flit_id, ip) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        rows,
+    )
+    db.commit()
+    db.close()
+
+
+def summary(samples):
+    samples = sorted(samples)
+    return {
+        "p50_ms": round(samples[len(samples) // 2] * 1000, 3),
+        "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--flits", type=int, default=10_000_000)
+    parser.add_argument("--posts", type=int, default=500)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="tweetor-flits-")
+    try:
+        for name in ("blocklist.txt", "profane_words.json"):
+            shutil.copy(os.path.join(ROOT, name), scratch)
+        os.chdir(scratch)
+        runpy.run_path(os.path.join(ROOT, "database_setup.py"), run_name="__main__")
+        start = time.perf_counter()
+        seed(args.flits)
+        seed_seconds = time.perf_counter() - start
+
+        db = sqlite3.connect("tweetor.db")
+        old_check = []
+        for _ in range(5):
+            start = time.perf_counter()
+            db.execute("SELECT * FROM flits ORDER BY timestamp DESC LIMIT 1").fetchone()
+            old_check.append(time.perf_counter() - start)
+        db.close()
+
+        import app as tweetor
+
+        tweetor.is_profanity = lambda text: {"status": "success", "profanity": {"matches": []}}
+        tweetor.track = lambda *args, **kwargs: None
+        tweetor.limiter.enabled = False
+        tweetor.app.config["WTF_CSRF_ENABLED"] = False
+
+        lock_hold = []
+        for i in range(args.posts):
+            start = time.perf_counter()
+            storage.insert_flit("user1", "user1", f"direct {i}", "", None, "127.0.0.1")
+            lock_hold.append(time.perf_counter() - start)
+
+        client = tweetor.app.test_client()
+        with client.session_transaction() as session:
+            session["handle"] = session["username"] = "user2"
+        post = []
+        for i in range(args.posts):
+            start = time.perf_counter()
+            response = client.post(
+                "/submit_flit",
+                data={"content": f"posted {i}", "meme_link": "", "original_flit_id": ""},
+                headers={"User-Agent": "Mozilla"},
+            )
+            post.append(time.perf_counter() - start)
+            assert response.status_code == 302
+
+        print(json.dumps({
+            "flits": args.flits,
+            "seed_seconds": round(seed_seconds, 1),
+            "old_duplicate_check": summary(old_check),
+            "insert_flit_lock_hold": summary(lock_hold),
+            "submit_flit_request": summary(post),
+        }, indent=2))
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(scratch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Thread page latency for very deep and very wide threads.
+
+Copies a fixture database (see fixtures.py) and adds two threads through
+storage.write_flit(), the same code submit_flit uses: a chain of --size
+replies, each to the one before, and a flit with --size direct replies.
+Then it times GET /flits/<id> through the test client for:
+
+    deep_top, deep_middle, deep_bottom   the chain's first, middle and last flit
+    wide_first_page, wide_last_page      the wide flit, without after= and
+                                         with the cursor of its last page
+
+The middle and bottom of the chain are where a thread stored as reply_to
+alone costs a query per level. That walk, from the bottom of the chain up
+to its top by primary key, is timed as naive_ancestors_bottom.
+path_bytes_deep is what the chain's thread_path values take up.
+
+    python benchmarks/bench_threads.py --db bench/tweetor.db --size 10000
+"""
+import argparse
+import json
+import os
+import runpy
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+import stubs
+
+
+def timed(f, requests):
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        f()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {
+        "p50_ms": round(samples[len(samples) // 2] * 1000, 2),
+        "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, 2),
+    }
+
+
+def build(storage, size):
+    """(the deep chain's ids, the wide thread's root and reply ids)."""
+    def write(cursor, content, reply_to):
+        return storage.write_flit(cursor, "bench", "bench", content, content, "", None, "127.0.0.1", reply_to)
+
+    chain = [storage.backend().transaction(write, "deep 0", None)]
+    for i in range(1, size + 1):
+        chain.append(storage.backend().transaction(write, f"deep {i}", chain[-1]))
+    root = storage.backend().transaction(write, "wide", None)
+    wide = [storage.backend().transaction(write, f"wide {i}", root) for i in range(size)]
+    return chain, root, wide
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", required=True, help="fixture database from fixtures.py")
+    parser.add_argument("--size", type=int, default=10000, help="replies in each thread")
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    database = os.path.abspath(args.db)
+    scratch = tempfile.mkdtemp(prefix="tweetor-threads-")
+    try:
+        shutil.copy(database, os.path.join(scratch, "tweetor.db"))
+        for name in ("blocklist.txt", "profane_words.json"):
+            shutil.copy(os.path.join(ROOT, name), scratch)
+        os.chdir(scratch)
+        runpy.run_path(os.path.join(ROOT, "database_setup.py"), run_name="__main__")
+
+        import app as tweetor
+        import storage
+        import threads
+
+        stubs.install(tweetor)
+        client = tweetor.app.test_client()
+        results = {}
+
+        start = time.perf_counter()
+        chain, root, wide = build(storage, args.size)
+        results["build_s"] = round(time.perf_counter() - start, 1)
+
+        def page(path):
+            response = client.get(path)
+            assert response.status_code == 200 and b"flit" in response.data, path
+
+        results["deep_top"] = timed(lambda: page(f"/flits/{chain[0]}"), args.requests)
+        results["deep_middle"] = timed(lambda: page(f"/flits/{chain[len(chain) // 2]}"), args.requests)
+        results["deep_bottom"] = timed(lambda: page(f"/flits/{chain[-1]}"), args.requests)
+        results["wide_first_page"] = timed(lambda: page(f"/flits/{root}"), args.requests)
+        after = wide[-(len(wide) % threads.PAGE_SIZE or threads.PAGE_SIZE) - 1]
+        results["wide_last_page"] = timed(lambda: page(f"/flits/{root}?after={after}"), args.requests)
+
+        db = sqlite3.connect("tweetor.db")
+
+        def naive_ancestors(flit_id):
+            while flit_id is not None:
+                (flit_id,) = db.execute("SELECT reply_to FROM flits WHERE id = ?", (flit_id,)).fetchone()
+
+        results["naive_ancestors_bottom"] = timed(lambda: naive_ancestors(chain[-1]), max(1, args.requests // 10))
+        results["path_bytes_deep"] = db.execute(
+            "SELECT sum(length(thread_path)) FROM flits WHERE content LIKE 'deep %'"
+        ).fetchone()[0]
+        db.close()
+        print(json.dumps(results, indent=2))
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(scratch)
+
+
+if __name__ == "__main__":
+    main()
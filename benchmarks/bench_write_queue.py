@@ -0,0 +1,92 @@
+"""Sustained insert rate and latency: per-request commits vs the write queue.
+
+Runs --writers threads that each insert flits back to back through
+storage.insert_flit() for --seconds, first with one transaction per insert and
+then with the group-commit queue. Prints inserts/sec, p50/p99 latency and how
+many inserts failed (e.g. "database is locked") as JSON.
+
+    python benchmarks/bench_write_queue.py --writers 32 --seconds 10
+"""
+import argparse
+import json
+import os
+import runpy
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+import storage
+
+
+def writer(tweetor, n, stop_at, latencies, errors):
+    i = 0
+    while time.time() < stop_at:
+        start = time.perf_counter()
+        try:
+            storage.insert_flit(f"user{n}", f"user{n}", f"flit {n}-{i}", "", None, "127.0.0.1")
+        except (sqlite3.Error, tweetor.WriteQueueFull) as e:
+            errors.append(repr(e))
+        else:
+            latencies.append(time.perf_counter() - start)
+        i += 1
+
+
+def run(tweetor, writers, seconds):
+    latencies, errors = [], []
+    stop_at = time.time() + seconds
+    threads = [
+        threading.Thread(target=writer, args=(tweetor, n, stop_at, latencies, errors))
+        for n in range(writers)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    latencies.sort()
+    return {
+        "inserts_per_sec": round(len(latencies) / seconds),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 2),
+        "errors": len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--batch", type=int, default=64)
+    parser.add_argument("--delay-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="tweetor-writes-")
+    try:
+        for name in ("blocklist.txt", "profane_words.json"):
+            shutil.copy(os.path.join(ROOT, name), scratch)
+        os.chdir(scratch)
+        runpy.run_path(os.path.join(ROOT, "database_setup.py"), run_name="__main__")
+
+        import app as tweetor
+        import helpers
+
+        results = {"writers": args.writers, "seconds": args.seconds}
+        results["per_request_commit"] = run(tweetor, args.writers, args.seconds)
+        helpers.use_write_queue(args.batch, args.delay_ms / 1000)
+        results["write_queue"] = run(tweetor, args.writers, args.seconds)
+        results["write_queue"]["avg_batch"] = round(
+            helpers.write_queue.writes / max(helpers.write_queue.batches, 1), 1
+        )
+        print(json.dumps(results, indent=2))
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(scratch)
+
+
+if __name__ == "__main__":
+    main()
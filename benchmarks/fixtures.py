@@ -0,0 +1,187 @@
+"""Generate a realistic synthetic tweetor.db for benchmarks.
+
+Authors, DM conversations and block targets follow a Zipf distribution, so a
+few accounts are very busy and most are quiet, like on the real site.
+Timestamps rise with ids over the past year. About 1% of flits and DMs are
+flagged profane and a few flits are reported. Users are user0 (the busiest)
+to user<N-1>, all with the password "password", plus the "admin" account
+database_setup.py creates.
+
+    python benchmarks/fixtures.py --users 100k --flits 10M --dms 5M --blocks 1M --out bench/tweetor.db
+
+To benchmark against real data instead, load an export with dump.py:
+
+    python dump.py import --in backup/ --db bench/tweetor.db
+"""
+import argparse
+import datetime
+import hashlib
+import itertools
+import os
+import random
+import runpy
+import sqlite3
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+PASSWORD = "password"
+ADMIN_PASSWORD = "admin_password"
+CHUNK = 50_000
+WORDS = (
+    "the a flit tweetor today just really new love hate pigeon bread coffee game "
+    "music linux python school lunch weekend cat dog #tweetor #gaming #music #memes "
+    "lol ok yes no why how when where who what good bad best worst here there"
+).split()
+
+
+def count(value):
+    """Parse counts like 500, 100k or 10M."""
+    value = value.strip().lower()
+    scale = {"k": 1_000, "m": 1_000_000}.get(value[-1:], 1)
+    return int(float(value.rstrip("km")) * scale)
+
+
+def zipf_picker(n, s=1.1, rng=random):
+    cum_weights = list(itertools.accumulate(1 / (rank ** s) for rank in range(1, n + 1)))
+
+    def pick(k):
+        return rng.choices(range(n), cum_weights=cum_weights, k=k)
+
+    return pick
+
+
+def sentence(rng, low=3, high=20):
+    return " ".join(rng.choices(WORDS, k=rng.randint(low, high)))
+
+
+def timestamps(total, rng, days=365):
+    start = datetime.datetime.now() - datetime.timedelta(days=days)
+    step = days * 86400 / max(total, 1)
+    for i in range(total):
+        yield (start + datetime.timedelta(seconds=i * step + rng.random() * step)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def chunks(rows):
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, CHUNK))
+        if not chunk:
+            return
+        yield chunk
+
+
+def generate(out, users, flits, dms, blocks, seed=0, log=print):
+    rng = random.Random(seed)
+    out = os.path.abspath(out)
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    if os.path.exists(out):
+        raise SystemExit(f"{out} already exists")
+
+    # Create the schema exactly as the app does
+    cwd = os.getcwd()
+    os.chdir(os.path.dirname(out))
+    try:
+        runpy.run_path(os.path.join(ROOT, "database_setup.py"), run_name="__main__")
+        if os.path.basename(out) != "tweetor.db":
+            os.rename("tweetor.db", out)
+    finally:
+        os.chdir(cwd)
+
+    db = sqlite3.connect(out)
+    db.execute("PRAGMA journal_mode=OFF")
+    db.execute("PRAGMA synchronous=OFF")
+    password = hashlib.sha256(PASSWORD.encode()).hexdigest()
+
+    start = time.perf_counter()
+    for chunk in chunks((f"user{i}", password, f"user{i}") for i in range(users)):
+        db.executemany("INSERT INTO users (username, password, handle, turbo) VALUES (?, ?, ?, 0)", chunk)
+    db.commit()
+    log(f"users: {users} in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    pick_user = zipf_picker(users, rng=rng)
+    authors = (a for chunk in iter(lambda: pick_user(CHUNK), None) for a in chunk)
+
+    def flit_rows():
+        for i, timestamp in enumerate(timestamps(flits, rng)):
+            author = next(authors)
+            is_reflit = i > 0 and rng.random() < 0.05
+            yield (
+                sentence(rng),
+                timestamp,
+                "yes" if rng.random() < 0.01 else "no",
+                f"user{author}",
+                f"user{author}",
+                "",
+                "10.0.0.1",
+                int(is_reflit),
+                "",
+                rng.randint(1, i) if is_reflit else -1,
+            )
+
+    for chunk in chunks(flit_rows()):
+        db.executemany(
+            "INSERT INTO flits (content, timestamp, profane_flit, userHandle, username, hashtag, ip, is_reflit, meme_link, original_flit_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            chunk,
+        )
+    db.commit()
+    log(f"flits: {flits} in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+
+    def dm_rows():
+        for timestamp in timestamps(dms, rng):
+            sender, receiver = pick_user(2)
+            if sender == receiver:
+                receiver = (receiver + 1) % users
+            yield (f"user{sender}", f"user{receiver}", sentence(rng, 1, 12), "yes" if rng.random() < 0.01 else "no", timestamp)
+
+    for chunk in chunks(dm_rows()):
+        db.executemany(
+            "INSERT INTO direct_messages (sender_handle, receiver_handle, content, profane_dm, timestamp) VALUES (?, ?, ?, ?, ?)",
+            chunk,
+        )
+    db.commit()
+    log(f"dms: {dms} in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+
+    def block_rows():
+        for _ in range(blocks):
+            blocker = rng.randrange(users)
+            (blocked,) = pick_user(1)
+            if blocker != blocked:
+                yield (f"user{blocker}", f"user{blocked}")
+
+    for chunk in chunks(block_rows()):
+        db.executemany("INSERT OR IGNORE INTO blocks (blocker_handle, blocked_handle) VALUES (?, ?)", chunk)
+    db.commit()
+    log(f"blocks: {blocks} in {time.perf_counter() - start:.1f}s")
+
+    reports = [
+        (rng.randint(1, flits), f"user{rng.randrange(users)}", "spam")
+        for _ in range(min(flits, max(10, flits // 1000)))
+    ] if flits else []
+    db.executemany("INSERT INTO reported_flits (flit_id, reporter_handle, reason) VALUES (?, ?, ?)", reports)
+    db.commit()
+    db.execute("ANALYZE")
+    db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=count, default=count("10k"))
+    parser.add_argument("--flits", type=count, default=count("100k"))
+    parser.add_argument("--dms", type=count, default=count("50k"))
+    parser.add_argument("--blocks", type=count, default=count("10k"))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="bench/tweetor.db")
+    args = parser.parse_args()
+    generate(args.out, args.users, args.flits, args.dms, args.blocks, args.seed)
+
+
+if __name__ == "__main__":
+    main()
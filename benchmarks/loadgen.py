@@ -0,0 +1,191 @@
+"""A small closed-loop HTTP and WebSocket load generator.
+
+Each client thread holds one keep-alive connection (or one WebSocket) and
+sends its next request as soon as the previous answer arrives, for a fixed
+number of seconds. Latencies from all clients are pooled into percentiles.
+"""
+import base64
+import http.client
+import json
+import os
+import socket
+import struct
+import threading
+import time
+import urllib.parse
+
+
+def wait_until_up(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/healthz")
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server on port {port} did not come up")
+
+
+def summary(latencies, errors, seconds):
+    latencies = sorted(latencies)
+
+    def pct(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 2) if latencies else None
+
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rps": round(len(latencies) / seconds, 1),
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+    }
+
+
+def run_clients(make_worker, clients, seconds):
+    """Call make_worker() in clients threads and then the worker it returns
+    as worker(i) until time is up. A worker returns (status, seconds) for
+    its timed request; statuses >= 500 and exceptions count as errors."""
+    latencies, errors = [], []
+    stop_at = time.time() + seconds
+
+    def client():
+        try:
+            worker = make_worker()
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(repr(e))
+            return
+        i = 0
+        while time.time() < stop_at:
+            i += 1
+            try:
+                status, elapsed = worker(i)
+            except (OSError, http.client.HTTPException, ValueError) as e:
+                errors.append(repr(e))
+                try:
+                    worker = make_worker()
+                except (OSError, http.client.HTTPException):
+                    return
+                continue
+            latencies.append(elapsed)
+            if status >= 500:
+                errors.append(status)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return summary(latencies, errors, seconds)
+
+
+class HTTPClient:
+    """One keep-alive connection that keeps the session cookie it is given."""
+
+    def __init__(self, port):
+        self.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        self.cookie = None
+
+    def send(self, method, path, form=None, body=None):
+        headers = {"User-Agent": "Mozilla/5.0 (tweetor benchmark)"}
+        if self.cookie:
+            headers["Cookie"] = self.cookie
+        data = None
+        if form is not None:
+            data = urllib.parse.urlencode(form)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        elif body is not None:
+            data = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        try:
+            self.conn.request(method, path, data, headers)
+            response = self.conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            raise
+        for header, value in response.getheaders():
+            if header.lower() == "set-cookie" and value.startswith("session="):
+                # An empty value is the session being deleted
+                self.cookie = value.split(";", 1)[0] if value.split(";", 1)[0] != "session=" else None
+        return response.status
+
+
+def http_worker(port, next_request, setup=()):
+    """Build a worker for run_clients. setup requests are sent once, then
+    next_request(i) returns a list of (method, path, form, json) requests
+    of which only the last is timed."""
+    client = HTTPClient(port)
+    for request in setup:
+        client.send(*request)
+
+    def worker(i):
+        *untimed, timed = next_request(i)
+        for request in untimed:
+            client.send(*request)
+        start = time.perf_counter()
+        status = client.send(*timed)
+        return status, time.perf_counter() - start
+
+    return worker
+
+
+class WebSocket:
+    """Just enough of RFC 6455 to send and receive text frames."""
+
+    def __init__(self, port, path, cookie=None):
+        self.sock = socket.create_connection(("127.0.0.1", port), timeout=30)
+        key = base64.b64encode(os.urandom(16)).decode()
+        request = (
+            f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\n"
+            f"Upgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n"
+        )
+        if cookie:
+            request += f"Cookie: {cookie}\r\n"
+        self.sock.sendall((request + "\r\n").encode())
+        self.buffer = b""
+        while b"\r\n\r\n" not in self.buffer:
+            self.buffer += self.recv()
+        head, self.buffer = self.buffer.split(b"\r\n\r\n", 1)
+        if not head.startswith(b"HTTP/1.1 101"):
+            raise http.client.HTTPException(head.split(b"\r\n", 1)[0].decode())
+
+    def recv(self):
+        chunk = self.sock.recv(65536)
+        if not chunk:
+            raise ConnectionError("WebSocket closed")
+        return chunk
+
+    def read(self, n):
+        while len(self.buffer) < n:
+            self.buffer += self.recv()
+        data, self.buffer = self.buffer[:n], self.buffer[n:]
+        return data
+
+    def send(self, text):
+        payload = text.encode()
+        mask = os.urandom(4)
+        if len(payload) < 126:
+            header = struct.pack("!BB", 0x81, 0x80 | len(payload))
+        else:
+            header = struct.pack("!BBH", 0x81, 0x80 | 126, len(payload))
+        masked = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        self.sock.sendall(header + mask + masked)
+
+    def receive(self):
+        first, second = self.read(2)
+        length = second & 0x7F
+        if length == 126:
+            (length,) = struct.unpack("!H", self.read(2))
+        elif length == 127:
+            (length,) = struct.unpack("!Q", self.read(8))
+        payload = self.read(length)
+        if first & 0x0F == 0x8:
+            raise ConnectionError("WebSocket closed")
+        return payload.decode()
+
+    def close(self):
+        self.sock.close()
@@ -0,0 +1,90 @@
+"""What the benchmark sends to each route in app.py.
+
+Every spec names a route, who is logged in ("user" is a Zipf-picked
+fixture account, "admin" is the admin account) and the request. Paths and
+form values are str.format templates filled per request:
+
+    {handle}   a Zipf-picked user, so busy accounts are hit more often
+    {partner}  a second Zipf-picked user, the other side of a DM or block
+    {victim}   a uniformly picked user, for deletes
+    {flit_id}  a uniformly picked flit id
+    {skip}     an offset into the timeline
+    {n}        a number unique to this run
+
+"before" requests are sent untimed ahead of every timed one. Specs that change
+data run last so they don't skew the reads.
+"""
+ROUTES = [
+    {"name": "home", "path": "/"},
+    {"name": "home_logged_in", "path": "/", "login": "user"},
+    {"name": "healthz", "path": "/healthz"},
+    {"name": "api_handle", "path": "/api/handle", "login": "user"},
+    {"name": "api_flit", "path": "/api/flit?flit_id={flit_id}"},
+    {"name": "api_get_flits", "path": "/api/get_flits?skip={skip}&limit=10"},
+    {"name": "api_get_captcha", "path": "/api/get_captcha"},
+    {"name": "api_render_online", "path": "/api/render_online", "login": "user"},
+    {"name": "api_get_gif", "method": "POST", "path": "/api/get_gif", "json": {"q": "pigeon"}, "login": "user"},
+    {"name": "settings", "path": "/settings", "login": "user"},
+    {"name": "users", "path": "/users"},
+    {"name": "signup_form", "path": "/signup"},
+    {"name": "login_form", "path": "/login"},
+    {"name": "leaderboard", "path": "/leaderboard"},
+    {"name": "flit", "path": "/flits/{flit_id}"},
+    {"name": "user_profile", "path": "/user/{handle}"},
+    {"name": "profanity", "path": "/profanity", "login": "admin"},
+    {"name": "reported_flits", "path": "/reported_flits", "login": "admin"},
+    {"name": "direct_messages", "path": "/dm/{partner}", "login": "user"},
+    {"name": "sitemap", "path": "/sitemap.xml"},
+    {"name": "block_unblock_form", "path": "/block_unblock", "login": "user"},
+    {"name": "view_blocks", "path": "/view_blocks", "login": "user"},
+    {"name": "login", "method": "POST", "path": "/login", "form": {"handle": "{handle}", "password": "password"}},
+    {
+        "name": "logout", "path": "/logout", "login": "user",
+        "before": {"method": "POST", "path": "/login", "form": {"handle": "{handle}", "password": "password"}},
+    },
+    {
+        "name": "change_password", "method": "POST", "path": "/change_password", "login": "user",
+        "form": {"current_password": "password", "new_password": "password"},
+    },
+    {
+        "name": "submit_flit", "method": "POST", "path": "/submit_flit", "login": "user",
+        "form": {"content": "benchmark flit {n} #tweetor", "meme_link": "", "original_flit_id": ""},
+    },
+    {
+        "name": "reflit", "method": "POST", "path": "/submit_flit", "login": "user",
+        "form": {"content": "reflit {n}", "meme_link": "", "original_flit_id": "{flit_id}"},
+    },
+    {
+        "name": "submit_dm", "method": "POST", "path": "/submit_dm/{partner}", "login": "user",
+        "form": {"content": "benchmark dm {n}"},
+    },
+    {"name": "dm_socket", "websocket": True, "path": "/ws/dm/{partner}", "login": "user"},
+    {
+        "name": "report_flit", "method": "POST", "path": "/report_flit", "login": "user",
+        "form": {"flit_id": "{flit_id}", "reason": "spam"},
+    },
+    {
+        "name": "block", "method": "POST", "path": "/block_unblock", "login": "user",
+        "form": {"action": "block", "user_handle": "{partner}"},
+    },
+    {
+        "name": "unblock", "method": "POST", "path": "/block_unblock", "login": "user",
+        "form": {"action": "unblock", "user_handle": "{partner}"},
+    },
+    {
+        "name": "signup", "method": "POST", "path": "/signup",
+        # An empty captcha matches a session that never fetched one
+        "form": {"username": "b{n}", "password": "password", "passwordConformation": "password", "input": ""},
+    },
+    {"name": "mute", "path": "/mute/{handle}", "login": "admin"},
+    {
+        "name": "unmute", "path": "/unmute/{handle}", "login": "admin",
+        "before": {"path": "/mute/{handle}"},
+    },
+    {
+        "name": "dismiss_reports", "method": "POST", "path": "/reported_flits", "login": "admin",
+        "form": {"action": "approve", "flit_id": "{flit_id}"},
+    },
+    {"name": "delete_flit", "path": "/delete_flit?flit_id={flit_id}", "login": "admin"},
+    {"name": "delete_user", "method": "POST", "path": "/delete_user", "login": "admin", "form": {"user_handle": "{victim}"}},
+]
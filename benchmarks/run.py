@@ -0,0 +1,269 @@
+"""Benchmark every route in app.py against a fixture database.
+
+Copies the fixture (see fixtures.py) to a scratch directory, then runs each
+spec in routes.py for --seconds, either in process through the Flask test
+client (--mode client, one request at a time, so it shows the cost of our
+own code) or over real HTTP against benchmarks/serve.py with --clients
+concurrent connections (--mode http). SightEngine, Tenor and Mixpanel are
+replaced by stubs.py in both modes. Prints p50/p95/p99 and throughput per
+route as JSON, and writes it to --out so runs can be diffed.
+
+    python benchmarks/fixtures.py --users 100k --flits 10M --dms 5M --blocks 1M --out bench/tweetor.db
+    python benchmarks/run.py --db bench/tweetor.db --mode client --seconds 5
+    python benchmarks/run.py --db bench/tweetor.db --mode http --clients 50 --workers 4
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import fixtures
+import loadgen
+import stubs
+from routes import ROUTES
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+class Picker:
+    """Fills the placeholders in routes.py from the fixture's contents."""
+
+    def __init__(self, database, seed=0):
+        db = sqlite3.connect(database)
+        self.users = db.execute("SELECT count(*) FROM users WHERE handle LIKE 'user%'").fetchone()[0]
+        self.max_flit_id = db.execute("SELECT max(id) FROM flits").fetchone()[0] or 1
+        db.close()
+        self.rng = random.Random(seed)
+        self.zipf = fixtures.zipf_picker(self.users, rng=self.rng)
+        self.counter = itertools.count(int(time.time()))
+
+    def values(self):
+        handle, partner = self.zipf(2)
+        return {
+            "handle": f"user{handle}",
+            "partner": f"user{partner}",
+            "victim": f"user{self.rng.randrange(self.users)}",
+            "flit_id": self.rng.randint(1, self.max_flit_id),
+            "skip": self.rng.randrange(1000),
+            "n": next(self.counter),
+        }
+
+    def login(self, role):
+        if role == "admin":
+            return ("POST", "/login", {"handle": "admin", "password": fixtures.ADMIN_PASSWORD}, None)
+        handle = f"user{self.zipf(1)[0]}"
+        return ("POST", "/login", {"handle": handle, "password": fixtures.PASSWORD}, None)
+
+
+def fill(template, values):
+    if isinstance(template, str):
+        return template.format(**values)
+    if isinstance(template, dict):
+        return {key: fill(value, values) for key, value in template.items()}
+    return template
+
+
+def as_request(spec, values):
+    return (
+        spec.get("method", "GET"),
+        fill(spec["path"], values),
+        fill(spec.get("form"), values),
+        fill(spec.get("json"), values),
+    )
+
+
+def next_requests(spec, picker):
+    def next_request(i):
+        values = picker.values()
+        requests = [as_request(spec["before"], values)] if "before" in spec else []
+        return requests + [as_request(spec, values)]
+
+    return next_request
+
+
+# --mode client
+
+
+class FakeSocket:
+    """Feeds "send" frames to dm_socket and times each one until its ack."""
+
+    def __init__(self, picker, stop_at):
+        self.picker = picker
+        self.stop_at = stop_at
+        self.started = None
+        self.latencies = []
+        self.errors = []
+
+    def receive(self):
+        if time.time() >= self.stop_at:
+            return None
+        self.started = time.perf_counter()
+        return json.dumps({"type": "send", "client_id": "c", "content": f"benchmark dm {self.picker.values()['n']}"})
+
+    def send(self, data):
+        frame = json.loads(data)
+        if frame["type"] == "ack":
+            self.latencies.append(time.perf_counter() - self.started)
+        elif frame["type"] == "error":
+            self.errors.append(frame["error"])
+
+    def close(self):
+        pass
+
+
+def client_send(client, method, path, form=None, body=None):
+    return client.open(
+        path, method=method, data=form, json=body,
+        headers={"User-Agent": "Mozilla/5.0 (tweetor benchmark)"},
+    ).status_code
+
+
+def client_worker(tweetor, spec, picker):
+    client = tweetor.app.test_client()
+    if spec.get("login"):
+        client_send(client, *picker.login(spec["login"]))
+    next_request = next_requests(spec, picker)
+
+    def worker(i):
+        *untimed, timed = next_request(i)
+        for request in untimed:
+            client_send(client, *request)
+        start = time.perf_counter()
+        status = client_send(client, *timed)
+        return status, time.perf_counter() - start
+
+    return worker
+
+
+def client_socket(tweetor, spec, picker, seconds):
+    client = tweetor.app.test_client()
+    client_send(client, *picker.login(spec["login"]))
+    socket = FakeSocket(picker, time.time() + seconds)
+    client.get(
+        fill(spec["path"], picker.values()),
+        headers={"Upgrade": "websocket", "Connection": "Upgrade"},
+        environ_overrides={"wsgi.websocket": socket},
+    )
+    return loadgen.summary(socket.latencies, socket.errors, seconds)
+
+
+def run_client_mode(routes, picker, seconds):
+    import app as tweetor
+
+    stubs.install(tweetor)
+    results = {}
+    for spec in routes:
+        if spec.get("websocket"):
+            results[spec["name"]] = client_socket(tweetor, spec, picker, seconds)
+        else:
+            results[spec["name"]] = loadgen.run_clients(lambda: client_worker(tweetor, spec, picker), 1, seconds)
+        print(spec["name"], results[spec["name"]], file=sys.stderr)
+    return results
+
+
+# --mode http
+
+
+def socket_worker(port, spec, picker):
+    client = loadgen.HTTPClient(port)
+    client.send(*picker.login(spec["login"]))
+    ws = loadgen.WebSocket(port, fill(spec["path"], picker.values()), client.cookie)
+
+    def worker(i):
+        start = time.perf_counter()
+        ws.send(json.dumps({"type": "send", "client_id": str(i), "content": f"benchmark dm {picker.values()['n']}"}))
+        while True:
+            frame = json.loads(ws.receive())
+            if frame.get("client_id") == str(i):
+                status = 200 if frame["type"] == "ack" else 500
+                return status, time.perf_counter() - start
+
+    return worker
+
+
+def http_worker(port, spec, picker):
+    setup = [picker.login(spec["login"])] if spec.get("login") else []
+    return loadgen.http_worker(port, next_requests(spec, picker), setup)
+
+
+def run_http_mode(routes, picker, seconds, clients, port, workers):
+    env = dict(os.environ, TWEETOR_PORT=str(port), TWEETOR_WORKERS=str(workers))
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "benchmarks", "serve.py")],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    results = {}
+    try:
+        loadgen.wait_until_up(port)
+        for spec in routes:
+            make_worker = socket_worker if spec.get("websocket") else http_worker
+            results[spec["name"]] = loadgen.run_clients(lambda: make_worker(port, spec, picker), clients, seconds)
+            print(spec["name"], results[spec["name"]], file=sys.stderr)
+    finally:
+        proc.terminate()
+        proc.wait()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", required=True, help="fixture database from fixtures.py")
+    parser.add_argument("--mode", choices=["client", "http"], default="client")
+    parser.add_argument("--seconds", type=float, default=5, help="per route")
+    parser.add_argument("--clients", type=int, default=20, help="concurrent connections (http)")
+    parser.add_argument("--workers", type=int, default=1, help="server.py worker processes (http)")
+    parser.add_argument("--port", type=int, default=5098)
+    parser.add_argument("--routes", help="comma separated route names to run (default: all)")
+    parser.add_argument("--out", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    routes = ROUTES
+    if args.routes:
+        wanted = set(args.routes.split(","))
+        routes = [spec for spec in ROUTES if spec["name"] in wanted]
+
+    database = os.path.abspath(args.db)
+    out = args.out and os.path.abspath(args.out)
+    picker = Picker(database)
+    scratch = tempfile.mkdtemp(prefix="tweetor-bench-")
+    try:
+        # Routes write, so work on a copy and keep the fixture reusable
+        shutil.copy(database, os.path.join(scratch, "tweetor.db"))
+        for name in ("blocklist.txt", "profane_words.json"):
+            shutil.copy(os.path.join(ROOT, name), scratch)
+        os.chdir(scratch)
+        sys.path.insert(0, ROOT)
+
+        if args.mode == "client":
+            results = run_client_mode(routes, picker, args.seconds)
+        else:
+            results = run_http_mode(routes, picker, args.seconds, args.clients, args.port, args.workers)
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(scratch)
+
+    report = {
+        "mode": args.mode,
+        "db": args.db,
+        "users": picker.users,
+        "flits": picker.max_flit_id,
+        "seconds": args.seconds,
+        "clients": args.clients if args.mode == "http" else 1,
+        "workers": args.workers if args.mode == "http" else None,
+        "routes": results,
+    }
+    print(json.dumps(report, indent=2))
+    if out:
+        with open(out, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
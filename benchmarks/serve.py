@@ -0,0 +1,33 @@
+"""server.py with the third-party services stubbed and rate limits off.
+
+Run from the directory holding the benchmark tweetor.db; configured through
+the same TWEETOR_* variables as server.py.
+"""
+from gevent import monkey
+
+monkey.patch_all()
+
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+import server
+import stubs
+
+serve = server.serve
+
+
+def stubbed_serve(listener):
+    # Runs in each worker after the fork, like server.serve itself
+    import app as tweetor
+
+    stubs.install(tweetor)
+    serve(listener)
+
+
+server.serve = stubbed_serve
+
+if __name__ == "__main__":
+    server.main()
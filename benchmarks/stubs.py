@@ -0,0 +1,70 @@
+"""Local stand-ins for SightEngine, Tenor and Mixpanel.
+
+Benchmarks should time our own code, not a third party's API (or its rate
+limits). install() swaps the network calls app.py makes for canned answers
+after the same amount of serialization work the real clients do.
+"""
+import json
+
+from mixpanel import Mixpanel
+
+# Content containing this word is reported as profane by the fake SightEngine
+PROFANE_MARKER = "badword"
+
+
+def is_profanity(text):
+    matches = [{"type": "inappropriate", "match": PROFANE_MARKER}] if PROFANE_MARKER in text else []
+    return {"status": "success", "profanity": {"matches": matches}}
+
+
+class NullConsumer:
+    """Mixpanel consumer that serializes events and drops them."""
+
+    def __init__(self):
+        self.sent = 0
+
+    def send(self, endpoint, json_message, api_key=None, api_secret=None):
+        self.sent += 1
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.text = json.dumps(payload)
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class FakeRequests:
+    """Stands in for the requests module inside app.py."""
+
+    def get(self, url, params=None, **kwargs):
+        if "tenor.googleapis.com" in url:
+            query = (params or {}).get("q", "")
+            limit = int((params or {}).get("limit", 8))
+            return FakeResponse({"results": [
+                {"id": str(i), "content_description": query, "media_formats": {"gif": {"url": f"https://media.tenor.com/{i}.gif"}}}
+                for i in range(limit)
+            ]})
+        raise RuntimeError(f"unexpected GET {url} during a benchmark")
+
+    def post(self, url, data=None, **kwargs):
+        if "sightengine.com" in url:
+            return FakeResponse(is_profanity((data or {}).get("text", "")))
+        raise RuntimeError(f"unexpected POST {url} during a benchmark")
+
+
+def install(tweetor):
+    """Point an imported app module at the local stubs.
+
+    Also turns off rate limits and CSRF, which would otherwise reject most
+    of the load after the first few requests.
+    """
+    tweetor.requests = FakeRequests()
+    tweetor.mp = Mixpanel("benchmark", consumer=NullConsumer())
+    tweetor.limiter.enabled = False
+    tweetor.dm_socket_limit = tweetor.parse_limit("1000000/minute")
+    tweetor.app.config["WTF_CSRF_ENABLED"] = False
@@ -0,0 +1,57 @@
+"""Feed pages as column arrays, for /api/get_flits?format=columnar.
+
+The default feed format is a list of one object per flit, which repeats
+every key and every poster's handle and name, and sends the hashtag and
+(mostly empty) meme_link of every flit. Clients that poll the feed
+download and parse that again and again. With ?format=columnar the same
+page comes back as:
+
+    {
+      "count": 3,
+      "strings": ["alice", "Alice", "bob", "Bob"],
+      "columns": {
+        "id": [12, 11, 10],
+        "content": ["hi", "hello", "hey"],
+        "timestamp": ["2024-05-01 12:00:03", ...],
+        "userHandle": [0, 2, 0],
+        "username": [1, 3, 1],
+        "is_reflit": [0, 1, 0],
+        "original_flit_id": {"1": 7},
+        "meme_link": {"2": "https://..."}
+      }
+    }
+
+Each column has one value per flit, in feed order. The STRINGS columns
+hold indexes into "strings", where each handle and username appears
+once. The SPARSE columns are objects of row index -> value, holding
+only the rows whose value isn't the column's empty one (-1 for a flit
+that isn't a reflit, "" for no GIF). DROPPED columns are left out.
+
+encode() builds this straight from the cursor's rows, transposing them
+with zip() rather than making a dict per flit.
+"""
+# Columns whose values are shared between flits, sent once in "strings"
+STRINGS = ("userHandle", "username")
+# Columns that are usually empty -> their empty value, sent only for the
+# rows with another
+SPARSE = {"original_flit_id": -1, "meme_link": ""}
+# Columns no client reads
+DROPPED = ("hashtag",)
+
+
+def encode(rows):
+    """The columnar form of rows, a list of sqlite3.Row or DictRow."""
+    if not rows:
+        return {"count": 0, "strings": [], "columns": {}}
+    strings = {}
+    columns = {}
+    for name, values in zip(rows[0].keys(), zip(*rows)):
+        if name in DROPPED:
+            continue
+        if name in STRINGS:
+            values = [strings.setdefault(value, len(strings)) for value in values]
+        elif name in SPARSE:
+            empty = SPARSE[name]
+            values = {i: value for i, value in enumerate(values) if value != empty}
+        columns[name] = values
+    return {"count": len(rows), "strings": list(strings), "columns": columns}
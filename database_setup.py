@@ -1,170 +1,225 @@
-import helpers
-import sqlite3
-import hashlib
+"""Creates tweetor.db's tables and indexes, and brings older databases up to date.
 
-DATABASE = "tweetor.db"
+    python database_setup.py
 
+server.py runs setup() once before starting workers. The database's
+PRAGMA user_version records the SCHEMA_VERSION it was last set up for, so
+on a current database setup() is that one read. Otherwise every statement
+below runs in a single transaction on a single connection; each is safe
+to repeat, so a database from any earlier version comes out the same.
 
+Bump SCHEMA_VERSION whenever this file changes, or existing databases
+won't pick the change up.
+"""
+import hashlib
+import sqlite3
 
+DATABASE = "tweetor.db"
 
-with sqlite3.connect(DATABASE) as conn:
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT NOT NULL,
-            turbo INTEGER DEFAULT 0,
-            handle TEXT NOT NULL UNIQUE,
-            password TEXT NOT NULL
-        )
+SCHEMA_VERSION = 3
+
+SCHEMA = [
     """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL,
+        turbo INTEGER DEFAULT 0,
+        handle TEXT NOT NULL UNIQUE,
+        password TEXT NOT NULL
     )
-
-with sqlite3.connect(DATABASE) as conn:
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS profane_flits  (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            content TEXT,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            userHandle TEXT NOT NULL,
-            username TEXT NOT NULL,
-            hashtag TEXT NOT NULL
-        )
+    """,
     """
+    CREATE TABLE IF NOT EXISTS profane_flits  (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        content TEXT,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        userHandle TEXT NOT NULL,
+        username TEXT NOT NULL,
+        hashtag TEXT NOT NULL
     )
-
-with sqlite3.connect(DATABASE) as conn:
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS flits  (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            content TEXT,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            profane_flit TEXT,
-            userHandle TEXT NOT NULL,
-            username TEXT NOT NULL,
-            hashtag TEXT NOT NULL,
-            ip TEXT NOT NULL
-        )
+    """,
     """
+    CREATE TABLE IF NOT EXISTS flits  (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        content TEXT,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        profane_flit TEXT,
+        userHandle TEXT NOT NULL,
+        username TEXT NOT NULL,
+        hashtag TEXT NOT NULL,
+        ip TEXT NOT NULL
     )
-
-with sqlite3.connect(DATABASE) as conn:
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT NOT NULL,
-            turbo INTEGER DEFAULT 0,
-            handle TEXT NOT NULL UNIQUE,
-            password TEXT NOT NULL
-        )
+    """,
     """
+    CREATE TABLE IF NOT EXISTS direct_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sender_handle TEXT NOT NULL,
+        receiver_handle TEXT NOT NULL,
+        content TEXT,
+        profane_dm TEXT NOT NULL,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )
-
-with sqlite3.connect(DATABASE) as conn:
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS direct_messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sender_handle TEXT NOT NULL,
-            receiver_handle TEXT NOT NULL,
-            content TEXT,
-            profane_dm TEXT NOT NULL,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
+    """,
     """
+    CREATE TABLE IF NOT EXISTS reported_flits (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        flit_id INTEGER NOT NULL,
+        reporter_handle TEXT NOT NULL,
+        reason TEXT NOT NULL
     )
-
-with sqlite3.connect(DATABASE) as conn:
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS reported_flits (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            flit_id INTEGER NOT NULL,
-            reporter_handle TEXT NOT NULL,
-            reason TEXT NOT NULL
-        )
+    """,
     """
+    CREATE TABLE IF NOT EXISTS blocks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        blocker_handle TEXT NOT NULL,
+        blocked_handle TEXT NOT NULL,
+        block_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(blocker_handle, blocked_handle)
     )
-with sqlite3.connect(DATABASE) as conn:    
-    conn.execute(
-"""
-        CREATE TABLE IF NOT EXISTS blocks (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    blocker_handle TEXT NOT NULL,
-    blocked_handle TEXT NOT NULL,
-    block_time DATETIME DEFAULT CURRENT_TIMESTAMP,
-    UNIQUE(blocker_handle, blocked_handle)
-);
-"""
-)
-def add_is_reflit_column_if_not_exists():
-  db = helpers.get_db()
-  cursor = db.cursor()
-
-  # Check if the is_reflit column exists
-  cursor.execute("PRAGMA table_info(flits)")
-  columns = cursor.fetchall()
-  column_names = [column[1] for column in columns]
-  if 'is_reflit' not in column_names:
-      # If the is_reflit column doesn't exist, add it
-      cursor.execute("ALTER TABLE flits ADD COLUMN is_reflit INTEGER")
-      db.commit()
-
-  db.close()
-
-def add_meme_link_column_if_not_exists():
-   db = helpers.get_db()
-   cursor = db.cursor()
-
-   # Check if the meme_link column exists
-   cursor.execute("PRAGMA table_info(flits)")
-   columns = cursor.fetchall()
-   column_names = [column[1] for column in columns]
-   if 'meme_link' not in column_names:
-       # If the meme_link column doesn't exist, add it
-       cursor.execute("ALTER TABLE flits ADD COLUMN meme_link VARCHAR(255)")
-       db.commit()
-
-   db.close()
-
-
-def create_admin_if_not_exists():
-  db = helpers.get_db()
-  cursor = db.cursor()
-  cursor.execute("SELECT * FROM users WHERE username = 'admin'")
-  admin_account = cursor.fetchone()
-  print("Admin account found:", admin_account)
-
-  if not admin_account:
-    hashed_password = hashlib.sha256("admin_password".encode()).hexdigest()
-    cursor.execute(
-      "INSERT INTO users (username, handle, password) VALUES (?, ?, ?)",
-      ("admin", "admin", hashed_password),
+    """,
+    # Conversation reads (DM page and the WebSocket resume) filter on the
+    # handle pair and read forward from the last seen id
+    """
+    CREATE INDEX IF NOT EXISTS direct_messages_conversation
+    ON direct_messages (sender_handle, receiver_handle, id)
+    """,
+    # Each user's latest flit, kept up to date by submit_flit in the same
+    # transaction as the insert, for duplicate post detection
+    """
+    CREATE TABLE IF NOT EXISTS user_last_flit (
+        handle TEXT PRIMARY KEY,
+        content_hash TEXT NOT NULL,
+        flit_id INTEGER NOT NULL
     )
-    db.commit()
-    print("Admin account created")
-
-
-def add_original_flit_id_column_if_not_exists():
- db = helpers.get_db()
- cursor = db.cursor()
-
- # Check if the original_flit_id column exists
- cursor.execute("PRAGMA table_info(flits)")
- columns = cursor.fetchall()
- column_names = [column[1] for column in columns]
- if 'original_flit_id' not in column_names:
-     # If the original_flit_id column doesn't exist, add it
-     cursor.execute("ALTER TABLE flits ADD COLUMN original_flit_id INTEGER")
-     db.commit()
-
- db.close()
-
-
-create_admin_if_not_exists()
-add_meme_link_column_if_not_exists()
-add_is_reflit_column_if_not_exists()
-add_original_flit_id_column_if_not_exists()
+    """,
+    # Profiles page through a user's flits newest first, and archive.py
+    # picks the oldest flits to move out
+    "CREATE INDEX IF NOT EXISTS flits_user_timestamp ON flits (userHandle, timestamp)",
+    "CREATE INDEX IF NOT EXISTS flits_timestamp ON flits (timestamp)",
+    # Moderation queues (moderation.py): reports grouped per flit, and the
+    # profane flits and DMs, which partial indexes keep to just those rows
+    "CREATE INDEX IF NOT EXISTS reported_flits_flit ON reported_flits (flit_id, reporter_handle, reason)",
+    "CREATE INDEX IF NOT EXISTS flits_profane ON flits (id) WHERE profane_flit = 'yes'",
+    "CREATE INDEX IF NOT EXISTS direct_messages_profane ON direct_messages (id) WHERE profane_dm = 'yes'",
+    # Users and flits being deleted in the background, see deletions.py
+    """
+    CREATE TABLE IF NOT EXISTS deletion_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        target TEXT NOT NULL,
+        deleted INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        finished_at TIMESTAMP
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS deletion_jobs_pending ON deletion_jobs (kind, target) WHERE finished_at IS NULL",
+    # Hashtags of each flit, keyed for tag timelines, see hashtags.py
+    """
+    CREATE TABLE IF NOT EXISTS flit_hashtags (
+        tag TEXT NOT NULL,
+        flit_id INTEGER NOT NULL,
+        PRIMARY KEY (tag, flit_id)
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS flit_hashtags_flit ON flit_hashtags (flit_id)",
+    # Mention and DM inboxes and how far each user has read, see notifications.py
+    """
+    CREATE TABLE IF NOT EXISTS notifications (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        handle TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        actor_handle TEXT NOT NULL,
+        source_id INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS notifications_handle ON notifications (handle, id)",
+    """
+    CREATE TABLE IF NOT EXISTS notification_reads (
+        handle TEXT PRIMARY KEY,
+        last_read_id INTEGER NOT NULL
+    )
+    """,
+    # Which worker runs the shared housekeeping jobs, and when each last
+    # ran, see scheduler.py
+    """
+    CREATE TABLE IF NOT EXISTS scheduler_lease (
+        name TEXT PRIMARY KEY,
+        holder TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS scheduled_jobs (
+        name TEXT PRIMARY KEY,
+        last_started REAL NOT NULL,
+        last_seconds REAL NOT NULL,
+        last_error TEXT,
+        runs INTEGER NOT NULL
+    )
+    """,
+]
+
+# Columns added to flits after it was first created
+FLIT_COLUMNS = {
+    "meme_link": "VARCHAR(255)",
+    "is_reflit": "INTEGER",
+    "original_flit_id": "INTEGER",
+    # Reply threads, see threads.py
+    "reply_to": "INTEGER",
+    "thread_path": "TEXT",
+    "reply_count": "INTEGER NOT NULL DEFAULT 0",
+}
+
+# Indexes on those columns, made once they exist
+FLIT_COLUMN_INDEXES = [
+    # A flit's replies in thread order are a range of thread_path
+    "CREATE INDEX IF NOT EXISTS flits_thread ON flits (thread_path) WHERE thread_path IS NOT NULL",
+]
+
+
+def add_flit_columns(conn):
+    existing = {column[1] for column in conn.execute("PRAGMA table_info(flits)")}
+    for name, type_ in FLIT_COLUMNS.items():
+        if name not in existing:
+            conn.execute(f"ALTER TABLE flits ADD COLUMN {name} {type_}")
+
+
+def create_admin_if_not_exists(conn):
+    admin_account = conn.execute("SELECT id FROM users WHERE username = 'admin'").fetchone()
+    if not admin_account:
+        hashed_password = hashlib.sha256("admin_password".encode()).hexdigest()
+        conn.execute(
+            "INSERT INTO users (username, handle, password) VALUES (?, ?, ?)",
+            ("admin", "admin", hashed_password),
+        )
+        print("Admin account created")
+
+
+def setup(database=DATABASE):
+    """Bring database up to SCHEMA_VERSION, if it isn't already."""
+    conn = sqlite3.connect(database, isolation_level=None)
+    try:
+        (version,) = conn.execute("PRAGMA user_version").fetchone()
+        if version >= SCHEMA_VERSION:
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        # Another process may have finished setup while we waited for the lock
+        (version,) = conn.execute("PRAGMA user_version").fetchone()
+        if version >= SCHEMA_VERSION:
+            conn.execute("ROLLBACK")
+            return
+        for statement in SCHEMA:
+            conn.execute(statement)
+        add_flit_columns(conn)
+        for statement in FLIT_COLUMN_INDEXES:
+            conn.execute(statement)
+        create_admin_if_not_exists(conn)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    setup()
@@ -0,0 +1,216 @@
+"""Background cascade for deleted users and flits.
+
+Deleting a busy account in one transaction would hold the write lock for
+as long as it takes to remove every flit, DM and block it ever made, and
+every post on the site would wait behind it. Instead delete_user() and
+delete_flits() only tombstone: in one short transaction they remove the
+users (or flits) row and queue a row in deletion_jobs. Reads hide the
+content of users with an unfinished job (helpers.DELETED_HANDLES), so
+it disappears from the feed straight away.
+
+A worker thread, started on first use like the write queue, then removes
+the dependent rows BATCH at a time, one transaction per batch. It sleeps
+PAUSE seconds between batches so other writers get the lock. Progress is
+kept in deletion_jobs.deleted, updated in the same transaction as each
+batch. Every batch is idempotent, so a job interrupted by a restart
+is picked up again by the scheduler's leader within a minute (or the
+next worker to start), and two workers running the same job only do
+some of its work twice.
+
+Dependent rows, for a user: their flits (hot and archived) and the
+reports and hashtags of them, their DMs sent and received, blocks either way,
+reports they filed, their user_last_flit row, and the notifications they
+received or caused. For a flit: the reports against it. A flit's few
+hashtag rows go with it straight away, and so does its place in its
+parent's reply count. Its replies stay, under a gap in the thread.
+
+This worker's flit_cache drops deleted flits, and parents whose reply
+counts changed, as it goes; other workers read the jobs (flit_cache.poll()).
+"""
+import logging
+import sqlite3
+import threading
+import time
+
+import archive
+import flit_cache
+import fragments
+import hashtags
+import helpers
+import scheduler
+import threads
+
+BATCH = 500
+PAUSE = 0.01
+
+logger = logging.getLogger("tweetor.deletions")
+
+# Started by delete_user()/delete_flits(), see start()
+worker = None
+_start_lock = threading.Lock()
+_wake = threading.Event()
+
+
+def delete_user(handle):
+    """Tombstone handle and queue its content for deletion."""
+    helpers.write_transaction(write_delete_user, handle)
+    flit_cache.discard_author(handle)
+    start()
+
+
+def write_delete_user(cursor, handle):
+    cursor.execute("DELETE FROM users WHERE handle = ?", (handle,))
+    cursor.execute("INSERT INTO deletion_jobs (kind, target) VALUES ('user', ?)", (handle,))
+
+
+def delete_flits(flit_ids):
+    """Delete flits now and queue the reports against them for deletion."""
+    parents = helpers.write_transaction(write_delete_flits, flit_ids)
+    fragments.discard(flit_ids)
+    flit_cache.discard([*flit_ids, *parents])
+    start()
+
+
+def write_delete_flits(cursor, flit_ids):
+    """Returns the ids of the flits they replied to."""
+    marks = ",".join("?" * len(flit_ids))
+    parents = threads.discard(cursor, flit_ids)
+    cursor.execute(f"DELETE FROM flits WHERE id IN ({marks})", flit_ids)
+    hashtags.discard(cursor, flit_ids)
+    cursor.executemany(
+        "INSERT INTO deletion_jobs (kind, target) VALUES ('flit', ?)", [(str(flit_id),) for flit_id in flit_ids]
+    )
+    return parents
+
+
+def steps(kind, target):
+    """(table, condition, params, keyset) for each table a job cleans up.
+
+    Conditions an index answers are re-run from the top each batch.
+    Those that scan (the receiving or blocked side, reporters) walk the
+    table once in rowid order instead, so every batch starts where the
+    last one stopped.
+    """
+    if kind == "flit":
+        return [("reported_flits", "flit_id = ?", (int(target),), False)]
+    return [
+        ("flits", "userHandle = ?", (target,), False),
+        ("archive.flits", "userHandle = ?", (target,), False),
+        ("direct_messages", "sender_handle = ? OR receiver_handle = ?", (target, target), True),
+        ("blocks", "blocker_handle = ? OR blocked_handle = ?", (target, target), True),
+        ("reported_flits", "reporter_handle = ?", (target,), True),
+        ("user_last_flit", "handle = ?", (target,), False),
+        ("notifications", "handle = ?", (target,), False),
+        ("notifications", "actor_handle = ?", (target,), True),
+        ("notification_reads", "handle = ?", (target,), False),
+    ]
+
+
+def delete_batch(db, job_id, table, rowids):
+    """Returns the ids of flits whose reply counts changed."""
+    marks = ",".join("?" * len(rowids))
+    parents = []
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        if table.endswith("flits") and table != "reported_flits":
+            # The reports against a flit go with it
+            db.execute(f"DELETE FROM reported_flits WHERE flit_id IN ({marks})", rowids)
+        if table == "flits":
+            hashtags.discard(db, rowids)
+            parents = threads.discard(db, rowids)
+        db.execute(f"DELETE FROM {table} WHERE rowid IN ({marks})", rowids)
+        db.execute("UPDATE deletion_jobs SET deleted = deleted + ? WHERE id = ?", (len(rowids), job_id))
+        db.execute("COMMIT")
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+    return parents
+
+
+def run_job(db, job_id, kind, target):
+    for table, condition, params, keyset in steps(kind, target):
+        if table.startswith("archive.") and not archive.attach(db):
+            continue
+        after = 0
+        while True:
+            if keyset:
+                rowids = select_rowids(
+                    db, f"SELECT rowid FROM {table} WHERE ({condition}) AND rowid > ? ORDER BY rowid LIMIT ?",
+                    (*params, after, BATCH),
+                )
+            else:
+                rowids = select_rowids(db, f"SELECT rowid FROM {table} WHERE {condition} LIMIT ?", (*params, BATCH))
+            if not rowids:
+                break
+            after = rowids[-1]
+            flit_cache.discard(helpers.run_db(delete_batch, db, job_id, table, rowids))
+            time.sleep(PAUSE)
+    helpers.run_db(db.execute, "UPDATE deletion_jobs SET finished_at = CURRENT_TIMESTAMP WHERE id = ?", (job_id,))
+    (deleted,) = helpers.run_db(lambda: db.execute("SELECT deleted FROM deletion_jobs WHERE id = ?", (job_id,)).fetchone())
+    logger.info("Deleted %s %s: %d rows", kind, target, deleted)
+
+
+def select_rowids(db, sql, params):
+    return helpers.run_db(lambda: [row[0] for row in db.execute(sql, params).fetchall()])
+
+
+def run_pending(db):
+    """Run unfinished jobs, oldest first, until there are none. Returns how many ran."""
+    ran = 0
+    while True:
+        job = helpers.run_db(lambda: db.execute(
+            "SELECT id, kind, target FROM deletion_jobs WHERE finished_at IS NULL ORDER BY id LIMIT 1"
+        ).fetchone())
+        if job is None:
+            return ran
+        run_job(db, *job)
+        ran += 1
+
+
+def run():
+    db = sqlite3.connect(helpers.DATABASE, isolation_level=None, check_same_thread=False)
+    while True:
+        _wake.clear()
+        try:
+            run_pending(db)
+        except sqlite3.Error:
+            # Most likely the lock timed out, try again in a while
+            logger.exception("Deletion job failed")
+            time.sleep(5)
+            continue
+        _wake.wait()
+
+
+def start():
+    """Start the worker if this process hasn't yet, and wake it.
+
+    server.py calls this at startup too, to finish jobs a restart cut short.
+    """
+    global worker
+    if worker is None:
+        # Started on first use so a forked worker gets its own thread
+        with _start_lock:
+            if worker is None:
+                worker = threading.Thread(target=run, name="deletions", daemon=True)
+                worker.start()
+    _wake.set()
+
+
+@scheduler.job(60, leader_only=True)
+def resume_deletions():
+    """Pick up jobs left unfinished by a worker that has since exited."""
+    start()
+
+
+def wait_idle(timeout=None):
+    """Block until no job is left unfinished, for tests and benchmarks."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    db = sqlite3.connect(helpers.DATABASE)
+    try:
+        while db.execute("SELECT 1 FROM deletion_jobs WHERE finished_at IS NULL LIMIT 1").fetchone():
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
+    finally:
+        db.close()
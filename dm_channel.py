@@ -0,0 +1,149 @@
+"""Real-time direct message delivery over WebSocket.
+
+Every open /ws/dm/<handle> socket is a Subscriber of its conversation. A new
+message is pushed once to every subscriber of that conversation in this
+worker. Each subscriber also reads its conversation from the database
+every POLL_INTERVAL seconds, starting after the last id it has seen, which
+catches messages written by other worker processes and replays anything
+missed while a client was disconnected (the client resumes from its last id).
+
+Frames are JSON. Client to server:
+    {"type": "resume", "last_id": 41}
+    {"type": "send", "client_id": "c1", "content": "hi"}
+Server to client:
+    {"type": "message", "message": {"id": 42, "sender_handle": ..., ...}}
+    {"type": "ack", "client_id": "c1", "id": 42}
+    {"type": "error", "client_id": "c1", "error": "..."}
+    {"type": "error", "error": "..."}        (a resume frame without a valid last_id)
+
+Frames that aren't JSON objects are ignored.
+"""
+import json
+import threading
+from collections import defaultdict
+
+import gevent
+from geventwebsocket.exceptions import WebSocketError
+
+import helpers
+
+POLL_INTERVAL = 2
+RESUME_LIMIT = 200
+
+# Open subscribers per conversation, keyed by the sorted pair of handles
+subscribers = defaultdict(set)
+
+
+def conversation_key(handle_a, handle_b):
+    return tuple(sorted((handle_a, handle_b)))
+
+
+def fetch_since(handle_a, handle_b, last_id, limit=RESUME_LIMIT):
+    db = helpers.get_db()
+    cursor = db.cursor()
+    cursor.execute(
+        """
+        SELECT id, sender_handle, receiver_handle, content, timestamp
+        FROM direct_messages
+        WHERE ((sender_handle = ? AND receiver_handle = ?)
+            OR (sender_handle = ? AND receiver_handle = ?))
+        AND id > ? AND profane_dm = 'no'
+        ORDER BY id
+        LIMIT ?
+    """,
+        (handle_a, handle_b, handle_b, handle_a, last_id, limit),
+    )
+    messages = [dict(row) for row in cursor.fetchall()]
+    db.close()
+    return messages
+
+
+def last_id_of(frame):
+    """A resume frame's last_id as an int, or None if it isn't one."""
+    last_id = frame.get("last_id") or 0
+    if isinstance(last_id, bool):
+        return None
+    try:
+        return int(last_id)
+    except (TypeError, ValueError):
+        return None
+
+
+class Subscriber:
+    def __init__(self, ws, handle, partner_handle, blocked_handles):
+        self.ws = ws
+        self.handle = handle
+        self.partner_handle = partner_handle
+        self.blocked_handles = set(blocked_handles)
+        # Highest id read back from the database, and ids pushed above it.
+        # Polling waits for the client's resume frame to know where to start
+        self.last_id = 0
+        self.resumed = False
+        self.sent = set()
+        self.lock = threading.Lock()
+
+    def send(self, frame):
+        with self.lock:
+            self.ws.send(json.dumps(frame))
+
+    def deliver(self, message):
+        # Same rule as the DM page: hide messages from people you blocked
+        if message["id"] in self.sent or message["sender_handle"] in self.blocked_handles:
+            return
+        self.sent.add(message["id"])
+        self.send({"type": "message", "message": message})
+
+    def catch_up(self):
+        while True:
+            messages = fetch_since(self.handle, self.partner_handle, self.last_id)
+            for message in messages:
+                if message["id"] > self.last_id:
+                    self.deliver(message)
+            if messages:
+                self.last_id = messages[-1]["id"]
+                self.sent = {i for i in self.sent if i > self.last_id}
+            if len(messages) < RESUME_LIMIT:
+                return
+
+    def resume(self, last_id):
+        self.last_id = last_id
+        self.resumed = True
+        self.catch_up()
+
+    def poll(self):
+        while not self.ws.closed:
+            gevent.sleep(POLL_INTERVAL)
+            if not self.resumed:
+                continue
+            try:
+                self.catch_up()
+            except WebSocketError:
+                return
+
+
+def subscribe(subscriber):
+    subscribers[conversation_key(subscriber.handle, subscriber.partner_handle)].add(subscriber)
+    return gevent.spawn(subscriber.poll)
+
+
+def unsubscribe(subscriber):
+    key = conversation_key(subscriber.handle, subscriber.partner_handle)
+    subscribers[key].discard(subscriber)
+    if not subscribers[key]:
+        del subscribers[key]
+
+
+def publish(message):
+    """Push a newly stored message to everyone in its conversation.
+
+    Profane messages are stored but never pushed, as on the DM page.
+    """
+    if message.get("profane_dm") == "yes":
+        return
+    message = {k: v for k, v in message.items() if k != "profane_dm"}
+    key = conversation_key(message["sender_handle"], message["receiver_handle"])
+    for subscriber in list(subscribers.get(key, ())):
+        try:
+            subscriber.deliver(message)
+        except WebSocketError:
+            unsubscribe(subscriber)
@@ -0,0 +1,277 @@
+"""Stream tables out of tweetor.db and back in, for backups, migrations and
+benchmark fixtures.
+
+    python dump.py export --out backup/ [--format ndjson|columnar] [--tables users,flits]
+    python dump.py import --in backup/ [--db tweetor.db]
+
+Export steps a single read cursor through each table and writes it
+CHUNK rows at a time, so memory stays flat however big the table is.
+Each table becomes <table>.ndjson (a line of column names, then one JSON
+array per row) or <table>.col, a columnar file made of blocks. Each block
+holds CHUNK rows, stored column by column as zlib-compressed JSON arrays. That is about a third
+the size of the NDJSON, since handles and timestamps repeat down a column.
+schema.json records each table's CREATE TABLE and CREATE INDEX statements.
+Tables the database doesn't have yet (it predates them) are skipped.
+
+Import creates missing tables from schema.json. It drops the table's indexes,
+inserts with executemany in transactions of BATCH rows, and rebuilds the
+indexes at the end. Each transaction also records how many rows of the
+table it has imported in an import_checkpoint table. An interrupted import
+run again with the same arguments skips those rows and carries on. Import
+into an empty database; ids are kept as they are.
+
+Throughput targets, one core, SSD: 10M flits exported in under 2 minutes
+(100k rows/s) and imported in under 4 minutes (50k rows/s), in either
+format. benchmarks/bench_dump.py measures both.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import struct
+import sys
+import time
+import zlib
+
+import helpers
+
+TABLES = [
+    "users", "flits", "direct_messages", "blocks", "reported_flits",
+    # Kept up to date as flits and DMs are written, so a restore needs them too
+    "flit_hashtags", "user_last_flit", "notifications", "notification_reads",
+    # Unfinished deletions, whose users' content must stay hidden
+    "deletion_jobs",
+]
+CHUNK = 50_000
+BATCH = 200_000
+MAGIC = b"TWEETORCOL1\n"
+
+
+def table_columns(db, table):
+    return [row[1] for row in db.execute(f"PRAGMA table_info({table})").fetchall()]
+
+
+def schema(db, table):
+    return [
+        row[0] for row in db.execute(
+            "SELECT sql FROM sqlite_master WHERE tbl_name = ? AND sql IS NOT NULL ORDER BY type DESC", (table,)
+        ).fetchall()
+    ]
+
+
+def rows_of(db, table, columns):
+    # A WITHOUT ROWID table has no rowid, and a full scan of it is already in
+    # primary key order
+    (without_rowid,) = db.execute(
+        "SELECT sql LIKE '%WITHOUT ROWID%' FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone()
+    order = "" if without_rowid else " ORDER BY rowid"
+    cursor = db.execute(f"SELECT {', '.join(columns)} FROM {table}{order}")
+    while True:
+        chunk = cursor.fetchmany(CHUNK)
+        if not chunk:
+            return
+        yield chunk
+
+
+# Formats. A writer takes (file, columns, chunks of row tuples); a reader
+# takes a file and yields (columns, chunk of row tuples).
+
+
+def write_ndjson(f, columns, chunks):
+    f.write(json.dumps(columns).encode() + b"\n")
+    for chunk in chunks:
+        f.write(b"".join(json.dumps(row).encode() + b"\n" for row in chunk))
+
+
+def read_ndjson(f):
+    columns = json.loads(f.readline())
+    chunk = []
+    for line in f:
+        chunk.append(json.loads(line))
+        if len(chunk) == CHUNK:
+            yield columns, chunk
+            chunk = []
+    if chunk:
+        yield columns, chunk
+
+
+def write_columnar(f, columns, chunks):
+    f.write(MAGIC)
+    header = json.dumps(columns).encode()
+    f.write(struct.pack("<I", len(header)) + header)
+    for chunk in chunks:
+        f.write(struct.pack("<I", len(chunk)))
+        for column in zip(*chunk):
+            data = zlib.compress(json.dumps(column, separators=(",", ":")).encode(), 1)
+            f.write(struct.pack("<I", len(data)) + data)
+
+
+def read_columnar(f):
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError(f"{f.name} is not a columnar dump")
+    (size,) = struct.unpack("<I", f.read(4))
+    columns = json.loads(f.read(size))
+    while True:
+        head = f.read(4)
+        if not head:
+            return
+        (count,) = struct.unpack("<I", head)
+        data = []
+        for _ in columns:
+            (size,) = struct.unpack("<I", f.read(4))
+            data.append(json.loads(zlib.decompress(f.read(size))))
+        yield columns, list(zip(*data)) if data else [()] * count
+
+
+FORMATS = {
+    "ndjson": (".ndjson", write_ndjson, read_ndjson),
+    "columnar": (".col", write_columnar, read_columnar),
+}
+
+
+def export_dump(database, out, tables=TABLES, format="ndjson", log=print):
+    extension, write, _ = FORMATS[format]
+    os.makedirs(out, exist_ok=True)
+    db = sqlite3.connect(database)
+    statements = {}
+    for table in tables:
+        start = time.perf_counter()
+        columns = table_columns(db, table)
+        if not columns:
+            log(f"{table}: not in {database}, skipped")
+            continue
+        statements[table] = schema(db, table)
+        counted = []
+
+        def counting(chunks):
+            for chunk in chunks:
+                counted.append(len(chunk))
+                yield chunk
+
+        with open(os.path.join(out, table + extension), "wb") as f:
+            write(f, columns, counting(rows_of(db, table, columns)))
+        seconds = time.perf_counter() - start
+        log(f"{table}: {sum(counted)} rows in {seconds:.1f}s")
+    db.close()
+    with open(os.path.join(out, "schema.json"), "w") as f:
+        json.dump(statements, f, indent=2)
+
+
+def find_dump(directory, table):
+    for extension, _, read in FORMATS.values():
+        path = os.path.join(directory, table + extension)
+        if os.path.exists(path):
+            return path, read
+    return None, None
+
+
+def write_batch(db, table, columns, rows, done):
+    """Insert rows and move the checkpoint past them in one transaction."""
+    marks = ", ".join("?" * len(columns))
+    db.execute("BEGIN")
+    db.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({marks})", rows)
+    db.execute("INSERT OR REPLACE INTO import_checkpoint (tbl, done, finished) VALUES (?, ?, 0)", (table, done))
+    db.execute("COMMIT")
+
+
+def import_table(db, directory, table, statements, log=print):
+    path, read = find_dump(directory, table)
+    if path is None:
+        return 0
+    row = db.execute("SELECT done, finished FROM import_checkpoint WHERE tbl = ?", (table,)).fetchone()
+    skip, finished = row if row else (0, 0)
+    if finished:
+        log(f"{table}: already imported")
+        return 0
+
+    if not db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone():
+        for sql in statements.get(table, []):
+            if sql.upper().startswith("CREATE TABLE"):
+                db.execute(sql)
+
+    # Drop the indexes now and rebuild them once at the end, instead of
+    # updating every b-tree on every insert. UNIQUE and PRIMARY KEY
+    # constraints (autoindexes) stay, they have no SQL to recreate them.
+    indexes = db.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (table,)
+    ).fetchall()
+    for name, _ in indexes:
+        db.execute(f"DROP INDEX {name}")
+    # Indexes from a dump whose table already existed are rebuilt too
+    wanted = [sql for _, sql in indexes] or [
+        sql for sql in statements.get(table, []) if sql.upper().startswith("CREATE INDEX")
+    ]
+
+    start = time.perf_counter()
+    seen, done = 0, skip
+    pending = []
+    with open(path, "rb") as f:
+        for columns, chunk in read(f):
+            if seen + len(chunk) <= skip:
+                seen += len(chunk)
+                continue
+            chunk = chunk[max(0, skip - seen):]
+            seen = max(seen, skip) + len(chunk)
+            pending += chunk
+            if len(pending) >= BATCH:
+                done += len(pending)
+                write_batch(db, table, columns, pending, done)
+                pending = []
+        if pending:
+            done += len(pending)
+            write_batch(db, table, columns, pending, done)
+
+    for sql in wanted:
+        db.execute(sql.replace("CREATE INDEX", "CREATE INDEX IF NOT EXISTS", 1))
+    db.execute("UPDATE import_checkpoint SET finished = 1 WHERE tbl = ?", (table,))
+    log(f"{table}: {done - skip} rows in {time.perf_counter() - start:.1f}s")
+    return done - skip
+
+
+def import_dump(directory, database, tables=TABLES, log=print):
+    statements = {}
+    schema_path = os.path.join(directory, "schema.json")
+    if os.path.exists(schema_path):
+        with open(schema_path) as f:
+            statements = json.load(f)
+
+    db = sqlite3.connect(database, isolation_level=None)
+    db.execute("PRAGMA synchronous = NORMAL")
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS import_checkpoint (tbl TEXT PRIMARY KEY, done INTEGER NOT NULL, finished INTEGER NOT NULL)"
+    )
+    total = 0
+    for table in tables:
+        total += import_table(db, directory, table, statements, log)
+    db.execute("DROP TABLE import_checkpoint")
+    db.execute("ANALYZE")
+    db.close()
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export")
+    export.add_argument("--out", required=True)
+    export.add_argument("--format", choices=FORMATS, default="ndjson")
+    export.add_argument("--db", default=helpers.DATABASE)
+    export.add_argument("--tables", default=",".join(TABLES))
+    load = commands.add_parser("import")
+    load.add_argument("--in", dest="directory", required=True)
+    load.add_argument("--db", default=helpers.DATABASE)
+    load.add_argument("--tables", default=",".join(TABLES))
+    args = parser.parse_args()
+
+    tables = args.tables.split(",")
+    if args.command == "export":
+        export_dump(args.db, args.out, tables, args.format)
+    else:
+        if not os.path.isdir(args.directory):
+            sys.exit(f"{args.directory} is not a directory")
+        import_dump(args.directory, args.db, tables)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""Flit records cached per worker, for single-flit lookups.
+
+/api/flit, /flits/<id> and every reflit rendered (fragments.py) look
+flits up by id, and a viral flit is looked up thousands of times a
+minute. storage.flit() reads through this cache: a hit costs no query.
+
+Entries are Records, a tuple of FIELDS that still reads like a row
+(record["content"], record.keys(), dict(record)), with userHandle and
+username interned so a user's flits share them. The ip column is left
+out. Ids that don't exist, or whose author is being deleted, are cached
+as None, so a dead link shared widely doesn't hit the database either.
+Only ids below the highest this worker has found are, though: one above
+it may be a flit about to be posted, through another worker too.
+Profane flits are cached like any other; callers check profane_flit.
+
+The cache is least recently used, bounded at TWEETOR_FLIT_CACHE_MB
+(default 16) of estimated memory per worker. 0 turns it off.
+
+In this worker, writes that change a cached flit drop it: deletions.py
+for deleted flits and users, moderation.py for approved flits and
+storage.insert_flit() for the new flit and a new reply's parent, whose
+reply_count changed. A lookup that raced one of those isn't stored, see generation.
+Other workers notice deleted flits and users from deletion_jobs, read at
+most every POLL seconds by poll(). Anything else another worker changes
+(an approval, a reply count) is right again within
+TWEETOR_FLIT_CACHE_TTL (default 30) seconds, when the entry expires.
+"""
+import collections
+import os
+import sys
+import threading
+import time
+
+max_bytes = int(float(os.getenv("TWEETOR_FLIT_CACHE_MB", "16")) * 2**20)
+ttl = float(os.getenv("TWEETOR_FLIT_CACHE_TTL", "30"))
+POLL = 1.0
+
+FIELDS = (
+    "id",
+    "content",
+    "timestamp",
+    "userHandle",
+    "username",
+    "hashtag",
+    "is_reflit",
+    "original_flit_id",
+    "meme_link",
+    "profane_flit",
+    "reply_to",
+    "thread_path",
+    "reply_count",
+)
+INDEX = {field: i for i, field in enumerate(FIELDS)}
+
+# get()'s result for an id the cache knows nothing about
+NOT_CACHED = object()
+
+# Rough per entry cost of the OrderedDict slot, key and expiry
+ENTRY_BYTES = 150
+
+
+class Record(tuple):
+    """A flit row as a tuple of FIELDS, readable by field name."""
+
+    __slots__ = ()
+
+    @classmethod
+    def of(cls, row):
+        keys = set(row.keys())
+        values = [row[field] if field in keys else None for field in FIELDS]
+        for field in ("userHandle", "username"):
+            if isinstance(values[INDEX[field]], str):
+                values[INDEX[field]] = sys.intern(values[INDEX[field]])
+        return cls(values)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return tuple.__getitem__(self, INDEX[key])
+        return tuple.__getitem__(self, key)
+
+    def keys(self):
+        return FIELDS
+
+
+# id -> (Record or None, expiry, size in bytes), least recently used first
+_cache = collections.OrderedDict()
+_size = 0
+_lock = threading.Lock()
+hits = 0
+misses = 0
+# The highest id cached with a record; missing ids above it aren't cached
+highest = 0
+# Bumped by every discard, so a lookup that read the database before it
+# can't store what it read after it
+generation = 0
+# deletion_jobs already acted on, and when poll() last looked
+_last_job = None
+_last_poll = 0.0
+
+
+def size_of(record):
+    if record is None:
+        return ENTRY_BYTES
+    return ENTRY_BYTES + sys.getsizeof(record) + sum(sys.getsizeof(value) for value in record if value is not None)
+
+
+def get(flit_id):
+    """The cached Record or None for flit_id, or NOT_CACHED."""
+    global hits, misses
+    with _lock:
+        entry = _cache.get(flit_id)
+        if entry is None or entry[1] < time.monotonic():
+            misses += 1
+            return NOT_CACHED
+        hits += 1
+        _cache.move_to_end(flit_id)
+        return entry[0]
+
+
+def put(flit_id, row, seen_generation):
+    """Cache the row storage read for flit_id, None if there wasn't one.
+
+    seen_generation is the generation from before the read. Returns the
+    row as it is cached.
+    """
+    global _size, highest
+    record = None if row is None else Record.of(row)
+    size = size_of(record)
+    if size > max_bytes:
+        return record
+    with _lock:
+        if seen_generation != generation:
+            return record
+        if record is None:
+            if flit_id > highest:
+                return record
+        elif flit_id > highest:
+            highest = flit_id
+        old = _cache.pop(flit_id, None)
+        if old is not None:
+            _size -= old[2]
+        _cache[flit_id] = (record, time.monotonic() + ttl, size)
+        _size += size
+        while _size > max_bytes:
+            _, (_, _, evicted) = _cache.popitem(last=False)
+            _size -= evicted
+    return record
+
+
+def discard(flit_ids):
+    global _size, generation
+    with _lock:
+        generation += 1
+        for flit_id in flit_ids:
+            entry = _cache.pop(int(flit_id), None)
+            if entry is not None:
+                _size -= entry[2]
+
+
+def discard_author(handle):
+    """Drop handle's flits."""
+    global _size, generation
+    with _lock:
+        generation += 1
+        for flit_id, (record, _, size) in list(_cache.items()):
+            if record is not None and record["userHandle"] == handle:
+                del _cache[flit_id]
+                _size -= size
+
+
+def clear():
+    """Forget everything, as for a different database."""
+    global _size, generation, highest, _last_job, _last_poll
+    with _lock:
+        generation += 1
+        _cache.clear()
+        _size = highest = 0
+        _last_job = None
+        _last_poll = 0.0
+
+
+def due():
+    """Whether poll() should run before the next lookup."""
+    return max_bytes > 0 and time.monotonic() - _last_poll >= POLL
+
+
+def poll(cursor):
+    """Drop flits deleted through other workers since the last poll."""
+    global _last_job, _last_poll
+    _last_poll = time.monotonic()
+    if _last_job is None:
+        # Nothing is cached yet that an earlier job could have touched
+        cursor.execute("SELECT coalesce(max(id), 0) FROM deletion_jobs")
+        _last_job = cursor.fetchone()[0]
+        return
+    cursor.execute("SELECT id, kind, target FROM deletion_jobs WHERE id > ? ORDER BY id", (_last_job,))
+    for job in cursor.fetchall():
+        if job["kind"] == "flit":
+            discard([job["target"]])
+        else:
+            discard_author(job["target"])
+        _last_job = job["id"]
+
+
+def stats():
+    with _lock:
+        return {"hits": hits, "misses": misses, "entries": len(_cache), "bytes": _size}
@@ -0,0 +1,134 @@
+"""Rendered flit HTML, cached per flit, and templates compiled up front.
+
+Profile and single flit pages render their flits on the server through
+templates/_flit.html. A flit's markup depends only on its own row (and
+its original's, for a reflit), so each fragment is rendered once and
+reused by every page that shows it. The cache key is the flit id plus a
+version: a hash of the rendered fields. An approved flit or a changed
+original gets a new key instead of stale markup. Entries are evicted
+least recently used once the cache holds more than
+TWEETOR_FRAGMENT_CACHE_MB (default 32) of HTML per worker. 0 turns the
+cache off. Deleted flits are discarded straight away; see deletions.py.
+
+Jinja compiles a template the first time it is rendered, so the first
+visitor to each page of every new worker paid for it. init_app() points
+Jinja at a bytecode cache on disk, and precompile(), called by server.py
+as a worker starts, loads every template before the first request.
+"""
+import collections
+import os
+import threading
+
+from flask import render_template
+from jinja2 import FileSystemBytecodeCache, TemplateError
+from markupsafe import Markup
+
+import storage
+
+max_bytes = int(float(os.getenv("TWEETOR_FRAGMENT_CACHE_MB", "32")) * 2**20)
+
+# Fields _flit.html renders; a change to any of them is a new version
+FIELDS = ("content", "username", "userHandle", "timestamp", "meme_link", "is_reflit", "original_flit_id")
+
+# (id, version) -> (html, size in bytes), least recently used first
+_cache = collections.OrderedDict()
+_size = 0
+_lock = threading.Lock()
+hits = 0
+misses = 0
+
+
+def init_app(app):
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
+
+
+def precompile(app):
+    """Compile every template now rather than on its first request."""
+    for name in app.jinja_env.list_templates():
+        try:
+            app.jinja_env.get_template(name)
+        except TemplateError as e:
+            # Left to fail when something renders it, as it would have
+            app.logger.warning("Template %s doesn't compile: %s", name, e)
+
+
+def version(flit, original=None):
+    return hash((tuple(flit[field] for field in FIELDS), version(original) if original else None))
+
+
+def get(key):
+    global hits, misses
+    with _lock:
+        entry = _cache.get(key)
+        if entry is None:
+            misses += 1
+            return None
+        hits += 1
+        _cache.move_to_end(key)
+        return entry[0]
+
+
+def put(key, html):
+    global _size
+    size = len(html.encode())
+    if size > max_bytes:
+        return
+    with _lock:
+        old = _cache.pop(key, None)
+        if old is not None:
+            _size -= old[1]
+        _cache[key] = (html, size)
+        _size += size
+        while _size > max_bytes:
+            _, (_, evicted) = _cache.popitem(last=False)
+            _size -= evicted
+
+
+def discard(flit_ids):
+    """Drop every version of the given flits."""
+    global _size
+    flit_ids = {int(flit_id) for flit_id in flit_ids}
+    with _lock:
+        for key in [key for key in _cache if key[0] in flit_ids]:
+            _size -= _cache.pop(key)[1]
+
+
+def clear():
+    global _size
+    with _lock:
+        _cache.clear()
+        _size = 0
+
+
+def render_flit(flit, original=None):
+    """HTML for one flit, with its original inside it if it is a reflit."""
+    key = (flit["id"], version(flit, original))
+    html = get(key)
+    if html is None:
+        html = render_template("_flit.html", flit=flit, original=original)
+        put(key, html)
+    return Markup(html)
+
+
+def render_flits(flits):
+    """HTML for each flit a page shows."""
+    return [html for _, html in rendered(flits)]
+
+
+def rendered(flits):
+    """(flit, HTML) for each flit a page shows, for pages that need both.
+
+    Like flitRenderer.js, profane flits are left out, and so are reflits
+    whose original is profane or gone.
+    """
+    pairs = []
+    for flit in flits:
+        if flit["profane_flit"] == "yes":
+            continue
+        original = None
+        if flit["is_reflit"]:
+            original = storage.flit(flit["original_flit_id"])
+            if original is None or original["profane_flit"] == "yes":
+                continue
+        pairs.append((flit, render_flit(flit, original)))
+    return pairs
@@ -0,0 +1,230 @@
+"""Hashtags: parsed at write time, indexed per tag, counted for trending.
+
+storage.write_flit() stores each #tag of a new flit in flit_hashtags (tag,
+flit_id) in the same transaction as the flit. The table's primary key
+is the tag timeline index, newest flit last. The flit_hashtags_flit
+index lets deletions and the archiver find a flit's tags. Tags are
+lowercased, so #Tweetor and #tweetor are one tag.
+
+Trending counts tag uses over the last 24 hours in minute buckets. Each
+worker keeps its own Window and fills it from flit_hashtags, not from
+its own writes, so every worker sees every post. The first read loads
+the last 24 hours. After that, a read at most POLL_INTERVAL seconds
+after the last one picks up rows newer than the last seen flit id.
+Buckets that leave the window are subtracted from the running totals,
+and the top tags are re-ranked only after the counts change. A read is
+a slice of that list, O(k).
+
+    python hashtags.py backfill [--batch 5000] [--pause 0.01] [--after ID]
+
+parses the flits posted before this existed. It walks flits by id in
+batches, recording the last id done in hashtag_backfill in the same
+transaction as each batch. Stopped and rerun, it carries on from there;
+--after 0 starts over.
+"""
+import argparse
+import collections
+import datetime
+import functools
+import heapq
+import re
+import sqlite3
+import threading
+import time
+
+import helpers
+
+TAG = re.compile(r"#(\w{1,64})")
+MAX_TAGS = 10
+WINDOW_MINUTES = 24 * 60
+POLL_INTERVAL = 10
+TOP = 50
+
+
+def extract(content):
+    """The distinct lowercased tags in content, in order, at most MAX_TAGS."""
+    tags = []
+    for tag in TAG.findall(content or ""):
+        tag = tag.lower()
+        if tag not in tags:
+            tags.append(tag)
+            if len(tags) == MAX_TAGS:
+                break
+    return tags
+
+
+def write_tags(cursor, flit_id, content):
+    tags = extract(content)
+    if tags:
+        cursor.executemany(
+            "INSERT INTO flit_hashtags (tag, flit_id) VALUES (?, ?) ON CONFLICT DO NOTHING",
+            [(tag, flit_id) for tag in tags],
+        )
+    return tags
+
+
+def timeline(db, tag, viewer=None, before=None, limit=10):
+    """Visible flits tagged tag, newest first, with ids below before."""
+    cursor = db.cursor()
+    cursor.execute(
+        f"""
+        SELECT f.id, f.content, f.timestamp, f.userHandle, f.username, f.hashtag, f.is_reflit, f.original_flit_id, f.meme_link
+        FROM flit_hashtags AS h
+        JOIN flits AS f ON f.id = h.flit_id
+        LEFT JOIN blocks AS b ON f.userHandle = b.blocked_handle AND b.blocker_handle = ?
+        WHERE h.tag = ? AND h.flit_id < ? AND f.profane_flit = 'no' AND b.blocked_handle IS NULL
+            AND f.userHandle NOT IN {helpers.DELETED_HANDLES}
+        ORDER BY h.flit_id DESC
+        LIMIT ?
+    """,
+        (viewer, tag.lower(), before if before is not None else 2**63 - 1, limit),
+    )
+    return cursor.fetchall()
+
+
+def minute_of(timestamp):
+    """Minutes since the epoch for a "YYYY-MM-DD HH:MM:SS" UTC timestamp."""
+    return parse_minute(timestamp[:16])
+
+
+@functools.lru_cache(maxsize=WINDOW_MINUTES)
+def parse_minute(minute):
+    moment = datetime.datetime.strptime(minute, "%Y-%m-%d %H:%M").replace(tzinfo=datetime.timezone.utc)
+    return int(moment.timestamp()) // 60
+
+
+class Window:
+    """Tag counts over the last `minutes` minutes, in minute buckets."""
+
+    def __init__(self, minutes=WINDOW_MINUTES):
+        self.minutes = minutes
+        self.buckets = {}
+        self.totals = collections.Counter()
+        self.ranked = []
+        self.dirty = False
+
+    def add(self, tag, minute, now):
+        if minute <= now - self.minutes or minute > now:
+            return
+        self.buckets.setdefault(minute, collections.Counter())[tag] += 1
+        self.totals[tag] += 1
+        self.dirty = True
+
+    def expire(self, now):
+        for minute in [minute for minute in self.buckets if minute <= now - self.minutes]:
+            self.totals.subtract(self.buckets.pop(minute))
+            self.dirty = True
+
+    def top(self, k):
+        if self.dirty:
+            self.ranked = heapq.nlargest(TOP, ((count, tag) for tag, count in self.totals.items() if count > 0))
+            self.totals = +self.totals  # drops tags that fell to zero
+            self.dirty = False
+        return [(tag, count) for count, tag in self.ranked[:k]]
+
+
+window = Window()
+last_flit_id = None
+last_poll = 0
+_lock = threading.Lock()
+
+
+def poll(db, now=None):
+    """Add tag uses newer than the last poll (or the whole window, the first time)."""
+    global last_flit_id, last_poll
+    now_minute = int(time.time() if now is None else now) // 60
+    cursor = db.cursor()
+    after = last_flit_id
+    if after is None:
+        # Ids grow with time, so the window starts at its oldest flit's id
+        cursor.execute(
+            "SELECT id FROM flits WHERE timestamp >= datetime('now', ?) ORDER BY timestamp LIMIT 1",
+            (f"-{WINDOW_MINUTES} minutes",),
+        )
+        first = cursor.fetchone()
+        cursor.execute("SELECT max(flit_id) FROM flit_hashtags")
+        after = (cursor.fetchone()[0] or 0) if first is None else first[0] - 1
+    cursor.execute(
+        """
+        SELECT h.tag, f.timestamp, f.id FROM flit_hashtags AS h
+        JOIN flits AS f ON f.id = h.flit_id
+        WHERE h.flit_id > ?
+    """,
+        (after,),
+    )
+    rows = cursor.fetchall()
+    latest = max([after] + [row[2] for row in rows])
+    for tag, timestamp, _ in rows:
+        window.add(tag, minute_of(timestamp), now_minute)
+    window.expire(now_minute)
+    last_flit_id = latest
+    last_poll = time.monotonic()
+
+
+def trending(k=10):
+    """[(tag, uses in the last 24 hours)], most used first."""
+    with _lock:
+        if last_flit_id is None or time.monotonic() - last_poll > POLL_INTERVAL:
+            db = helpers.get_db()
+            try:
+                poll(db)
+            finally:
+                db.close()
+        return window.top(k)
+
+
+def discard(cursor, flit_ids):
+    """Remove the tags of deleted or archived flits."""
+    marks = ",".join("?" * len(flit_ids))
+    cursor.execute(f"DELETE FROM flit_hashtags WHERE flit_id IN ({marks})", flit_ids)
+
+
+def backfill(batch=5000, pause=0.01, log=print, after=None):
+    """Parse the tags of flits with ids above after into flit_hashtags.
+
+    after defaults to where the last run stopped. Returns the tags written.
+    """
+    db = sqlite3.connect(helpers.DATABASE, isolation_level=None)
+    db.execute("PRAGMA busy_timeout = 5000")
+    db.execute("CREATE TABLE IF NOT EXISTS hashtag_backfill (last_flit_id INTEGER NOT NULL)")
+    if after is None:
+        (after,) = db.execute("SELECT coalesce(max(last_flit_id), 0) FROM hashtag_backfill").fetchone()
+        if after:
+            log(f"resuming after flit {after}")
+    first, written, start = after, 0, time.perf_counter()
+    try:
+        while True:
+            rows = db.execute(
+                "SELECT id, content FROM flits WHERE id > ? ORDER BY id LIMIT ?", (after, batch)
+            ).fetchall()
+            if not rows:
+                return written
+            tags = [(tag, flit_id) for flit_id, content in rows for tag in extract(content)]
+            after = rows[-1][0]
+            db.execute("BEGIN IMMEDIATE")
+            db.executemany("INSERT OR IGNORE INTO flit_hashtags (tag, flit_id) VALUES (?, ?)", tags)
+            db.execute("DELETE FROM hashtag_backfill")
+            db.execute("INSERT INTO hashtag_backfill (last_flit_id) VALUES (?)", (after,))
+            db.execute("COMMIT")
+            written += len(tags)
+            if after // batch % 100 == 0:
+                rate = (after - first) / (time.perf_counter() - start)
+                log(f"up to flit {after}: {written} tags, {rate:.0f} flits/s")
+            time.sleep(pause)
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    fill = commands.add_parser("backfill")
+    fill.add_argument("--batch", type=int, default=5000)
+    fill.add_argument("--pause", type=float, default=0.01, help="seconds between batches")
+    fill.add_argument("--after", type=int, help="start after this flit id (default: where the last run stopped)")
+    args = parser.parse_args()
+    print(f"wrote {backfill(args.batch, args.pause, after=args.after)} tags")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import sqlite3
+import time
 from flask import (
   Flask,
   request,
@@ -6,32 +7,163 @@ from flask import (
   session,
 )
 from functools import wraps
+import admission
+import metrics
+import query_log
 DATABASE = "tweetor.db"
+
+# Handles of users being deleted in the background (see deletions.py),
+# whose content reads should hide: "... AND userHandle NOT IN " + DELETED_HANDLES
+DELETED_HANDLES = "(SELECT target FROM deletion_jobs WHERE kind = 'user' AND finished_at IS NULL)"
+
+# Set by server.py when running under gevent, see use_db_threadpool()
+db_threadpool = None
+
+
+def use_db_threadpool(size):
+    """Run SQLite calls on a gevent threadpool of ``size`` threads.
+
+    sqlite3 is a C extension, so gevent can't make it cooperative. Without
+    this every query (and every busy wait on the write lock) blocks the whole
+    worker, with it the hub keeps serving other greenlets and at most ``size``
+    queries run at once.
+    """
+    global db_threadpool
+    from gevent.threadpool import ThreadPool
+    db_threadpool = ThreadPool(size)
+
+
+def run_db(f, *args):
+    if db_threadpool is None:
+        return f(*args)
+    return db_threadpool.apply(f, args)
+
+
+class CooperativeCursor(sqlite3.Cursor):
+    def execute(self, *args):
+        return run_db(super().execute, *args)
+
+    def executemany(self, *args):
+        return run_db(super().executemany, *args)
+
+    def fetchone(self):
+        return run_db(super().fetchone)
+
+    def fetchmany(self, *args):
+        return run_db(super().fetchmany, *args)
+
+    def fetchall(self):
+        return run_db(super().fetchall)
+
+
+class CooperativeConnection(sqlite3.Connection):
+    def cursor(self, factory=CooperativeCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def commit(self):
+        return run_db(super().commit)
+
+
+class InstrumentedCursor(CooperativeCursor):
+    """CooperativeCursor that reports its time to metrics and query_log."""
+
+    statement = None
+
+    def timed(self, f, args, statements):
+        start = time.perf_counter()
+        try:
+            return f(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.add_sql(elapsed, statements)
+            if query_log.enabled and self.statement is not None:
+                query_log.record(self.connection, *self.statement, elapsed, statements)
+
+    def execute(self, sql, params=()):
+        self.statement = (sql, params)
+        return self.timed(super().execute, (sql, params), 1)
+
+    def executemany(self, sql, seq_of_params):
+        self.statement = (sql, None)
+        return self.timed(super().executemany, (sql, seq_of_params), 1)
+
+    # Fetch time is counted against the statement that produced the rows
+    def fetchone(self):
+        return self.timed(super().fetchone, (), 0)
+
+    def fetchmany(self, *args):
+        return self.timed(super().fetchmany, args, 0)
+
+    def fetchall(self):
+        return self.timed(super().fetchall, (), 0)
+
+
+class InstrumentedConnection(CooperativeConnection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            metrics.add_sql(time.perf_counter() - start, 0)
+
+
 def get_db():
-  db = sqlite3.connect(DATABASE)
+  # Only the query profiler and requests picked for metrics sampling pay
+  # for the timing wrappers
+  if query_log.enabled or metrics.current() is not None:
+    factory = InstrumentedConnection
+  else:
+    factory = CooperativeConnection
+  db = sqlite3.connect(DATABASE, factory=factory, check_same_thread=False)
   db.row_factory = sqlite3.Row
+  # Requests in an admission cost class stop querying at their deadline
+  deadline = admission.deadline()
+  if deadline is not None:
+    admission.interrupt_after(db, deadline)
   return db
 
-def get_engaged_direct_messages(user_handle):
-    db = get_db()
-    cursor = db.cursor()
+# Set when TWEETOR_WRITE_QUEUE is on, see use_write_queue()
+write_queue = None
+
+
+def use_write_queue(max_batch, max_delay):
+    """Send write_transaction() calls through a group-commit WriteQueue."""
+    global write_queue
+    from write_queue import WriteQueue
+    write_queue = WriteQueue(DATABASE, max_batch=max_batch, max_delay=max_delay)
 
-    cursor.execute(
-        """
-        SELECT DISTINCT receiver_handle FROM direct_messages
-        WHERE sender_handle = ?
-        UNION
-        SELECT DISTINCT sender_handle FROM direct_messages
-        WHERE receiver_handle = ?
-    """,
-        (user_handle, user_handle),
-    )
 
-    engaged_dms = cursor.fetchall()
+def write_transaction(f, *args):
+    """Run f(cursor, *args) in a BEGIN IMMEDIATE transaction, return its result.
 
-    db.commit()
+    Taking the write lock up front means checks f makes before writing can't
+    race another writer. With the write queue on, f shares a transaction with
+    other queued writes instead.
+    """
+    if write_queue is not None:
+        return write_queue.submit(f, *args)
 
-    return engaged_dms
+    db = get_db()
+    try:
+        db.isolation_level = None
+        cursor = db.cursor()
+        # Inside the try, so a BEGIN that times out on the lock still closes db
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            result = f(cursor, *args)
+            cursor.execute("COMMIT")
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+    finally:
+        db.close()
+    return result
 
 def login_required(f):
     @wraps(f)
@@ -48,37 +180,8 @@ def get_client_ip():
         ip = request.remote_addr
     return ip
 
-def get_all_user_handles():
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("SELECT handle FROM users")
-    user_handles = [i[0] for i in cursor.fetchall()]
-    return user_handles
-
-
 def get_user_handle():
-  db = get_db()
-  cursor = db.cursor()
   if "username" not in session:
         return "Not Logged In"
   else:
         return session["handle"]
-def get_all_flit_ids():
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("SELECT id FROM flits")
-    flit_ids = [i[0] for i in cursor.fetchall()]
-    return flit_ids
-
-def get_blocked_users(current_user_handle):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT DISTINCT blocked_handle FROM blocks WHERE blocker_handle = ?
-    """, (current_user_handle,))
-    blocked_users = cursor.fetchall()
-    conn.close()
-
-    # Convert the result to a list of usernames
-    blocked_usernames = [row[0] for row in blocked_users]
-    return blocked_usernames
@@ -0,0 +1,213 @@
+"""Request, SQL, outbound HTTP and template timings, served at /metrics.
+
+TWEETOR_METRICS_SAMPLE is the fraction of requests to time (default 0, off).
+A sampled request gets a RequestStats on flask.g. helpers.get_db() hands it
+an instrumented connection, and timed_http() and the template signals add
+to it. When the request ends its totals go into per-endpoint histograms.
+An unsampled request costs one random() call. Its connections are the
+plain CooperativeConnection and the timers are no-ops. When sampling is
+off, not even the hooks are installed.
+
+Values that are always kept, like flit_cache's hit and miss counts and
+size, are registered with collect() and read when /metrics is scraped.
+Scheduled jobs (scheduler.py) always record their run times.
+
+Each worker process keeps its own numbers, so with TWEETOR_WORKERS > 1 a
+scrape reports whichever worker answered it.
+
+/metrics is for the admin and the scraper only. Set TWEETOR_METRICS_TOKEN
+and have Prometheus send it as a bearer token (`authorization:
+{credentials: ...}` in its scrape config); without one only the admin,
+signed in, can read it.
+"""
+import contextlib
+import hmac
+import os
+import random
+import threading
+import time
+
+from flask import before_render_template, g, has_request_context, request, session, template_rendered
+
+import flit_cache
+
+sample_rate = float(os.getenv("TWEETOR_METRICS_SAMPLE", "0"))
+token = os.getenv("TWEETOR_METRICS_TOKEN")
+
+SECONDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERIES = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+
+class Histogram:
+    def __init__(self, name, help, label, buckets=SECONDS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        # label value -> [count per bucket..., sum, count]
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, label):
+        with self.lock:
+            series = self.series.get(label)
+            if series is None:
+                series = self.series[label] = [0] * len(self.buckets) + [0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = {label: list(values) for label, values in self.series.items()}
+        for label, values in sorted(series.items()):
+            label = label.replace("\\", "\\\\").replace('"', '\\"')
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{self.label}="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{self.label}="{label}",le="+Inf"}} {values[-1]}')
+            lines.append(f'{self.name}_sum{{{self.label}="{label}"}} {values[-2]}')
+            lines.append(f'{self.name}_count{{{self.label}="{label}"}} {values[-1]}')
+        return lines
+
+
+request_seconds = Histogram(
+    "tweetor_request_duration_seconds", "Time spent handling a request.", "endpoint")
+sql_queries = Histogram(
+    "tweetor_request_sql_queries", "SQL statements run per request.", "endpoint", QUERIES)
+sql_seconds = Histogram(
+    "tweetor_request_sql_seconds", "Time per request spent in SQLite, including fetches.", "endpoint")
+http_seconds = Histogram(
+    "tweetor_outbound_http_seconds", "Time per call to an outside service.", "service")
+template_seconds = Histogram(
+    "tweetor_template_render_seconds", "Time to render a template.", "template")
+job_seconds = Histogram(
+    "tweetor_job_duration_seconds", "Time a scheduled job took, see scheduler.py.", "job")
+
+HISTOGRAMS = [request_seconds, sql_queries, sql_seconds, http_seconds, template_seconds, job_seconds]
+
+# (name, help, type, function) of values read when /metrics is scraped
+COLLECTED = []
+
+
+def collect(name, help, type_, f):
+    """Report f()'s value as name on every scrape, e.g. a cache's counters."""
+    COLLECTED.append((name, help, type_, f))
+
+
+collect("tweetor_flit_cache_hits_total", "Flit lookups flit_cache answered.", "counter", lambda: flit_cache.hits)
+collect("tweetor_flit_cache_misses_total", "Flit lookups that went to the database.", "counter", lambda: flit_cache.misses)
+collect("tweetor_flit_cache_entries", "Flits and missing ids flit_cache holds.", "gauge", lambda: len(flit_cache._cache))
+collect("tweetor_flit_cache_bytes", "Estimated memory flit_cache holds.", "gauge", lambda: flit_cache._size)
+
+
+class RequestStats:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.sql_queries = 0
+        self.sql_seconds = 0.0
+        self.templates = []
+
+
+def current():
+    """The sampled request's RequestStats, or None."""
+    if has_request_context():
+        return g.get("request_stats")
+    return None
+
+
+def add_sql(elapsed, statements):
+    """Count time spent in SQLite (and how many statements) against the request."""
+    stats = current()
+    if stats is not None:
+        stats.sql_seconds += elapsed
+        stats.sql_queries += statements
+
+
+NOT_TIMED = contextlib.nullcontext()
+
+
+@contextlib.contextmanager
+def _timed_http(service):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        http_seconds.observe(time.perf_counter() - start, service)
+
+
+def timed_http(service):
+    """Context manager timing a call to service, if this request is sampled."""
+    if current() is None:
+        return NOT_TIMED
+    return _timed_http(service)
+
+
+class TimedConsumer:
+    """Wraps a Mixpanel consumer so event sends show up as outbound HTTP."""
+
+    def __init__(self, consumer):
+        self.consumer = consumer
+
+    def send(self, *args, **kwargs):
+        with timed_http("mixpanel"):
+            return self.consumer.send(*args, **kwargs)
+
+
+def start_request():
+    if random.random() < sample_rate:
+        g.request_stats = RequestStats()
+
+
+def finish_request(exc):
+    stats = g.pop("request_stats", None)
+    if stats is None:
+        return
+    endpoint = request.endpoint or "unmatched"
+    request_seconds.observe(time.perf_counter() - stats.start, endpoint)
+    sql_queries.observe(stats.sql_queries, endpoint)
+    sql_seconds.observe(stats.sql_seconds, endpoint)
+
+
+def start_template(sender, template, context, **extra):
+    stats = current()
+    if stats is not None:
+        stats.templates.append(time.perf_counter())
+
+
+def finish_template(sender, template, context, **extra):
+    stats = current()
+    if stats is not None and stats.templates:
+        template_seconds.observe(time.perf_counter() - stats.templates.pop(), template.name or "inline")
+
+
+def init_app(app):
+    if not sample_rate:
+        return
+    # Registered before the app's own hooks so their time is counted too
+    app.before_request_funcs.setdefault(None, []).insert(0, start_request)
+    app.teardown_request(finish_request)
+    before_render_template.connect(start_template, app)
+    template_rendered.connect(finish_template, app)
+
+
+def authorized():
+    """Whether the current request may read /metrics."""
+    if token and hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        return True
+    return session.get("handle") == "admin"
+
+
+def render():
+    """All histograms and collected values in the Prometheus text format."""
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    for name, help, type_, f in COLLECTED:
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} {type_}", f"{name} {f()}"]
+    return "\n".join(lines) + "\n"
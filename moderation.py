@@ -0,0 +1,154 @@
+"""Moderation queues behind /reported_flits and /profanity.
+
+Reports are grouped per flit. Each row carries the report count, the
+number of distinct reporters and a sample reason, with the flit joined
+in the same query. The queue is ordered by distinct reporters, then
+reports, then newest flit, so a flit many people object to comes before
+one user reporting the same flit fifty times. The profane flit and DM
+queues are newest first.
+
+Pages are keyset paginated: the cursor is the sort key of the last row
+shown, and the next page starts strictly after it. Deep pages cost the
+same as the first, and rows removed by an action between pages don't
+shift the ones after them. Ranking reports still reads every report once,
+from the covering index reported_flits_flit, but flits are only joined
+for the page shown. The profane queues read partial indexes holding just
+the profane rows (see database_setup.py).
+
+Bulk approve and delete take a list of ids and each run as one
+transaction through helpers.write_transaction. Deleted flits' reports
+are left to deletions.py.
+"""
+import deletions
+import flit_cache
+import helpers
+
+PAGE_SIZE = 50
+
+
+def report_queue(after=None, limit=PAGE_SIZE):
+    """A page of reported flits, most reported first.
+
+    Returns (rows, cursor), where cursor is None on the last page.
+    """
+    after = parse_cursor(after, 3)
+    db = helpers.get_db()
+    cursor = db.cursor()
+    cursor.execute(
+        f"""
+        SELECT r.*, f.content, f.userHandle, f.username, f.timestamp, f.profane_flit
+        FROM (
+            SELECT flit_id, COUNT(*) AS reports, COUNT(DISTINCT reporter_handle) AS reporters,
+                   MAX(reason) AS reason
+            FROM reported_flits
+            GROUP BY flit_id
+            {"HAVING (reporters, reports, flit_id) < (?, ?, ?)" if after else ""}
+            ORDER BY reporters DESC, reports DESC, flit_id DESC
+            LIMIT ?
+        ) r
+        -- Joined after the LIMIT, so only the page's flits are looked up
+        LEFT JOIN flits f ON f.id = r.flit_id
+        ORDER BY r.reporters DESC, r.reports DESC, r.flit_id DESC
+        """,
+        (*(after or ()), limit + 1),
+    )
+    rows = cursor.fetchall()
+    db.close()
+    return page(rows, limit, lambda row: (row["reporters"], row["reports"], row["flit_id"]))
+
+
+def profane_flit_queue(after=None, limit=PAGE_SIZE):
+    after = parse_cursor(after, 1)
+    db = helpers.get_db()
+    cursor = db.cursor()
+    cursor.execute(
+        f"""
+        SELECT * FROM flits
+        WHERE profane_flit = 'yes' {"AND id < ?" if after else ""}
+        ORDER BY id DESC LIMIT ?
+        """,
+        (*(after or ()), limit + 1),
+    )
+    rows = cursor.fetchall()
+    db.close()
+    return page(rows, limit, lambda row: (row["id"],))
+
+
+def profane_dm_queue(after=None, limit=PAGE_SIZE):
+    after = parse_cursor(after, 1)
+    db = helpers.get_db()
+    cursor = db.cursor()
+    cursor.execute(
+        f"""
+        SELECT * FROM direct_messages
+        WHERE profane_dm = 'yes' {"AND id < ?" if after else ""}
+        ORDER BY id DESC LIMIT ?
+        """,
+        (*(after or ()), limit + 1),
+    )
+    rows = cursor.fetchall()
+    db.close()
+    return page(rows, limit, lambda row: (row["id"],))
+
+
+def page(rows, limit, key):
+    # One extra row was fetched to tell whether there is a next page
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, ".".join(str(value) for value in key(rows[-1]))
+
+
+def parse_cursor(cursor, size):
+    """Decode a cursor from page(), or None for the first page or a bad one."""
+    if not cursor:
+        return None
+    try:
+        values = tuple(int(value) for value in cursor.split("."))
+    except ValueError:
+        return None
+    return values if len(values) == size else None
+
+
+def parse_ids(values):
+    return [int(value) for value in values if value.isdigit()]
+
+
+def dismiss_reports(flit_ids):
+    """Approve flits: drop their reports and clear the profane flag."""
+    dismissed = helpers.write_transaction(write_dismiss_reports, flit_ids)
+    flit_cache.discard(flit_ids)
+    return dismissed
+
+
+def write_dismiss_reports(cursor, flit_ids):
+    marks = ",".join("?" * len(flit_ids))
+    cursor.execute(f"DELETE FROM reported_flits WHERE flit_id IN ({marks})", flit_ids)
+    cursor.execute(f"UPDATE flits SET profane_flit = 'no' WHERE id IN ({marks}) AND profane_flit = 'yes'", flit_ids)
+    return len(flit_ids)
+
+
+def delete_flits(flit_ids):
+    """Delete flits now, and the reports against them in the background."""
+    deletions.delete_flits(flit_ids)
+    return len(flit_ids)
+
+
+def approve_dms(dm_ids):
+    return helpers.write_transaction(write_approve_dms, dm_ids)
+
+
+def write_approve_dms(cursor, dm_ids):
+    marks = ",".join("?" * len(dm_ids))
+    cursor.execute(f"UPDATE direct_messages SET profane_dm = 'no' WHERE id IN ({marks})", dm_ids)
+    return len(dm_ids)
+
+
+def delete_dms(dm_ids):
+    return helpers.write_transaction(write_delete_dms, dm_ids)
+
+
+def write_delete_dms(cursor, dm_ids):
+    marks = ",".join("?" * len(dm_ids))
+    cursor.execute(f"DELETE FROM direct_messages WHERE id IN ({marks})", dm_ids)
+    return len(dm_ids)
@@ -0,0 +1,151 @@
+"""Per-user notification inbox, filled on write.
+
+A flit that @mentions someone and a DM to someone each add a row to the
+recipient's inbox in the notifications table, in the same transaction
+as the flit or DM (fan-out on write). Reading the inbox is then a
+single range read of the (handle, id) index, the newest rows first.
+Before, notifications.js diffed repeated /api/get_flits polls, which
+only ever noticed "new flits anywhere".
+
+Mentions go to handles that exist, are not the author, and haven't
+blocked the author, at most MAX_MENTIONS per flit; a DM from someone the
+receiver has blocked adds no row either. Rows point at the flit or DM by
+id and are joined to it when read, so a deleted or profane one drops out
+of the inbox without touching these rows, and so does everything from
+someone the user blocks later.
+
+Each user has a read marker, the highest id they have seen, in
+notification_reads. Marking read happens on every poll of an open inbox,
+so markers are kept in memory and written together, many users per
+transaction, by flush(), a job every worker runs each
+READ_FLUSH_INTERVAL seconds (see scheduler.py). A worker that exits
+between flushes loses only its most recent markers, which shows some
+notifications as unread again.
+"""
+import re
+import threading
+
+import helpers
+import scheduler
+
+MENTION = re.compile(r"@(\w{1,15})")
+MAX_MENTIONS = 10
+PAGE_SIZE = 50
+READ_FLUSH_INTERVAL = 5
+
+# Newest first, skipping rows whose flit or DM is gone or profane
+INBOX = f"""
+    SELECT n.id, n.kind, n.actor_handle, n.source_id, n.created_at,
+        coalesce(f.content, d.content) AS content
+    FROM notifications AS n
+    LEFT JOIN flits AS f ON n.kind = 'mention' AND f.id = n.source_id AND f.profane_flit = 'no'
+    LEFT JOIN direct_messages AS d ON n.kind = 'dm' AND d.id = n.source_id AND d.profane_dm = 'no'
+    WHERE n.handle = ? AND n.id > ?
+        AND coalesce(f.id, d.id) IS NOT NULL
+        AND n.actor_handle NOT IN {helpers.DELETED_HANDLES}
+        AND NOT EXISTS (SELECT 1 FROM blocks WHERE blocker_handle = n.handle AND blocked_handle = n.actor_handle)
+    ORDER BY n.id DESC
+    LIMIT ?
+"""
+
+# handle -> highest id marked read and not yet written
+pending_reads = {}
+_lock = threading.Lock()
+
+
+def mentions(content):
+    """The distinct handles content @mentions, at most MAX_MENTIONS."""
+    handles = []
+    for handle in MENTION.findall(content or ""):
+        if handle not in handles:
+            handles.append(handle)
+            if len(handles) == MAX_MENTIONS:
+                break
+    return handles
+
+
+def write_mentions(cursor, flit_id, author, content):
+    handles = [handle for handle in mentions(content) if handle != author]
+    if not handles:
+        return []
+    marks = ",".join("?" * len(handles))
+    cursor.execute(
+        f"""
+        SELECT u.handle FROM users AS u
+        WHERE u.handle IN ({marks})
+            AND NOT EXISTS (SELECT 1 FROM blocks WHERE blocker_handle = u.handle AND blocked_handle = ?)
+    """,
+        (*handles, author),
+    )
+    recipients = [row[0] for row in cursor.fetchall()]
+    cursor.executemany(
+        "INSERT INTO notifications (handle, kind, actor_handle, source_id) VALUES (?, 'mention', ?, ?)",
+        [(handle, author, flit_id) for handle in recipients],
+    )
+    return recipients
+
+
+def write_dm(cursor, dm_id, sender_handle, receiver_handle):
+    cursor.execute(
+        """
+        INSERT INTO notifications (handle, kind, actor_handle, source_id)
+        SELECT ?, 'dm', ?, ?
+        WHERE NOT EXISTS (SELECT 1 FROM blocks WHERE blocker_handle = ? AND blocked_handle = ?)
+    """,
+        (receiver_handle, sender_handle, dm_id, receiver_handle, sender_handle),
+    )
+
+
+def last_read(db, handle):
+    cursor = db.cursor()
+    cursor.execute("SELECT last_read_id FROM notification_reads WHERE handle = ?", (handle,))
+    row = cursor.fetchone()
+    with _lock:
+        return max(row[0] if row else 0, pending_reads.get(handle, 0))
+
+
+def inbox(db, handle, since_id=0, limit=PAGE_SIZE):
+    """(unread count, notifications newer than since_id, read marker).
+
+    One read of the newest limit notifications above the lower of
+    since_id and the read marker answers both, so the unread count is
+    capped at limit.
+    """
+    read = last_read(db, handle)
+    cursor = db.cursor()
+    cursor.execute(INBOX, (handle, min(since_id, read), limit))
+    rows = cursor.fetchall()
+    unread = sum(1 for row in rows if row["id"] > read)
+    return unread, [dict(row) for row in rows if row["id"] > since_id], read
+
+
+def mark_read(handle, up_to):
+    """Record that handle has seen every notification up to id up_to."""
+    with _lock:
+        if up_to > pending_reads.get(handle, 0):
+            pending_reads[handle] = up_to
+
+
+@scheduler.job(READ_FLUSH_INTERVAL, name="flush_notification_reads")
+def flush():
+    """Write the pending read markers."""
+    with _lock:
+        markers = list(pending_reads.items())
+    if not markers:
+        return
+    helpers.write_transaction(write_reads, markers)
+    with _lock:
+        for handle, up_to in markers:
+            # Unless it moved on while this was written
+            if pending_reads.get(handle) == up_to:
+                del pending_reads[handle]
+
+
+def write_reads(cursor, markers):
+    cursor.executemany(
+        """
+        INSERT INTO notification_reads (handle, last_read_id) VALUES (?, ?)
+        ON CONFLICT(handle) DO UPDATE SET last_read_id = max(last_read_id, excluded.last_read_id)
+    """,
+        markers,
+    )
@@ -0,0 +1,158 @@
+"""Per-statement query profile with EXPLAIN QUERY PLAN for slow ones.
+
+Enabled by TWEETOR_SLOW_QUERY_MS, the threshold in milliseconds. While on,
+helpers.get_db() hands out instrumented connections whose statements are
+fingerprinted: literals and parameter lists are normalized away, so every
+"SELECT * FROM flits WHERE id=?" lands in one entry however it was called.
+Each entry keeps the statement count and the total and max time, counting
+fetches as well as the execute. The first time a statement runs over the
+threshold, its EXPLAIN QUERY PLAN is captured and logged once, so a new
+"SCAN flits" shows up as soon as it happens.
+
+The live profile of a worker is at /admin/queries. Each worker also saves
+its profile to query_stats/<pid>.json every SAVE_INTERVAL seconds, and
+
+    python query_log.py [query_stats]
+
+merges those files and prints the report.
+"""
+import atexit
+import glob
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+threshold_ms = float(os.getenv("TWEETOR_SLOW_QUERY_MS", "0"))
+enabled = threshold_ms > 0
+
+STATS_DIR = "query_stats"
+SAVE_INTERVAL = 10
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+
+logger = logging.getLogger("tweetor.queries")
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE = re.compile(r"\s+")
+
+# fingerprint -> {"count", "total_ms", "max_ms", "slow", "plan"}
+stats = {}
+_lock = threading.Lock()
+_last_save = time.monotonic()
+
+
+def fingerprint(sql):
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _PLACEHOLDER_LIST.sub("(?...)", sql)
+    return _SPACE.sub(" ", sql).strip(" ;")
+
+
+def explain(db, sql, params):
+    if not sql.lstrip().upper().startswith(EXPLAINABLE):
+        return None
+    if params is None:
+        # executemany, plan it with NULLs
+        params = [None] * sql.count("?")
+    try:
+        # A plain cursor, so the EXPLAIN isn't profiled itself
+        rows = sqlite3.Cursor(db).execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    except sqlite3.Error as e:
+        return [f"(no plan: {e})"]
+    return [row[3] for row in rows]
+
+
+def record(db, sql, params, elapsed, statements=1):
+    """Add elapsed seconds of work on sql to its entry.
+
+    Fetches call this with statements=0, so their time is counted against
+    the statement that produced the rows.
+    """
+    ms = elapsed * 1000
+    key = fingerprint(sql)
+    with _lock:
+        entry = stats.get(key)
+        if entry is None:
+            entry = stats[key] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "slow": 0, "plan": None}
+        entry["count"] += statements
+        entry["total_ms"] += ms
+        entry["max_ms"] = max(entry["max_ms"], ms)
+        slow = ms >= threshold_ms
+        if slow:
+            entry["slow"] += 1
+        capture = slow and entry["plan"] is None
+        if capture:
+            # Claim it so only one thread runs the EXPLAIN
+            entry["plan"] = []
+    if capture:
+        entry["plan"] = explain(db, sql, params)
+        logger.warning("Slow query (%.1f ms): %s\n  %s", ms, key, "\n  ".join(entry["plan"] or ["(no plan)"]))
+    maybe_save()
+
+
+def maybe_save():
+    global _last_save
+    now = time.monotonic()
+    if now - _last_save < SAVE_INTERVAL:
+        return
+    _last_save = now
+    save()
+
+
+def save():
+    with _lock:
+        snapshot = json.dumps(stats)
+    os.makedirs(STATS_DIR, exist_ok=True)
+    path = os.path.join(STATS_DIR, f"{os.getpid()}.json")
+    with open(path + ".tmp", "w") as f:
+        f.write(snapshot)
+    os.replace(path + ".tmp", path)
+
+
+def merge(profiles):
+    merged = {}
+    for profile in profiles:
+        for key, entry in profile.items():
+            into = merged.setdefault(key, {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "slow": 0, "plan": None})
+            into["count"] += entry["count"]
+            into["total_ms"] += entry["total_ms"]
+            into["max_ms"] = max(into["max_ms"], entry["max_ms"])
+            into["slow"] += entry["slow"]
+            into["plan"] = into["plan"] or entry["plan"]
+    return merged
+
+
+def report(profile=None, limit=50):
+    """The profile as text, most total time first."""
+    if profile is None:
+        with _lock:
+            profile = {key: dict(entry) for key, entry in stats.items()}
+    lines = [f"{'total ms':>10} {'count':>8} {'avg ms':>8} {'max ms':>8} {'slow':>6}  statement"]
+    ranked = sorted(profile.items(), key=lambda item: item[1]["total_ms"], reverse=True)
+    for key, entry in ranked[:limit]:
+        avg = entry["total_ms"] / entry["count"] if entry["count"] else 0
+        lines.append(f"{entry['total_ms']:10.1f} {entry['count']:8d} {avg:8.2f} {entry['max_ms']:8.2f} {entry['slow']:6d}  {key}")
+        for step in entry["plan"] or []:
+            lines.append(f"{'':46}  plan: {step}")
+    return "\n".join(lines) + "\n"
+
+
+if enabled:
+    atexit.register(save)
+
+
+if __name__ == "__main__":
+    directory = sys.argv[1] if len(sys.argv) > 1 else STATS_DIR
+    profiles = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        with open(path) as f:
+            profiles.append(json.load(f))
+    if not profiles:
+        sys.exit(f"No profiles in {directory}, is TWEETOR_SLOW_QUERY_MS set?")
+    sys.stdout.write(report(merge(profiles)))
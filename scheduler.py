@@ -0,0 +1,251 @@
+"""Periodic housekeeping jobs, run off the request path.
+
+Modules register jobs where their state lives:
+
+    @scheduler.job(60, leader_only=True)
+    def expire_things():
+        ...
+
+Every worker runs a scheduler thread, started by server.py after the
+fork (and by `python app.py`). Each TICK seconds it runs the jobs that
+are due, one at a time, then waits for the next.
+
+Jobs are run by every worker, or by the leader alone.
+
+- Every worker: jobs that tidy up state the worker keeps in memory,
+  such as presence, used captchas and pending read markers.
+- The leader alone (leader_only): jobs on state every worker shares,
+  such as the databases.
+
+The leader is whichever worker, on whichever host, holds the lease row in
+scheduler_lease. A worker takes the lease when it has no holder or has
+expired. The holder renews it every LEASE_SECONDS / 3 seconds, so when
+the leader dies another worker takes over within LEASE_SECONDS. The
+leader jobs' last runs are kept in scheduled_jobs, so a new leader
+carries on the same schedule rather than starting every job again.
+
+Runs are spread out: each is due after its interval plus up to JITTER of
+it again, so workers that started together don't run together. Every
+run's time goes into the tweetor_job_duration_seconds histogram on
+/metrics. A job that raises is logged and tried again at its next run.
+A leader-only job's last run, time and error are also written to
+scheduled_jobs. Jobs should finish well within LEASE_SECONDS; ones that
+touch SQLite do so through helpers.run_db(), so under gevent they don't
+block the worker's other greenlets.
+"""
+import logging
+import os
+import random
+import secrets
+import socket
+import sqlite3
+import threading
+import time
+
+import helpers
+import metrics
+
+TICK = 1.0
+LEASE_SECONDS = 60
+JITTER = 0.1
+# tweetor.db's statistics are rebuilt from this many rows of each index
+ANALYSIS_LIMIT = 1000
+
+logger = logging.getLogger("tweetor.scheduler")
+
+
+class Job:
+    def __init__(self, name, interval, f, leader_only):
+        self.name = name
+        self.interval = interval
+        self.f = f
+        self.leader_only = leader_only
+        self.next_run = None
+
+
+# name -> Job, in the order they were registered
+JOBS = {}
+
+
+def holder_name():
+    return f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+
+
+# This worker's name in the lease row, renamed by start() after the fork
+holder = holder_name()
+# Until when this worker holds the lease, by time.time()
+leader_until = 0.0
+next_renewal = 0.0
+
+# Started by start(), see deletions.start()
+worker = None
+_start_lock = threading.Lock()
+
+
+def job(interval, leader_only=False, name=None):
+    """Register the decorated function to run every interval seconds."""
+    def register(f):
+        JOBS[name or f.__name__] = Job(name or f.__name__, interval, f, leader_only)
+        return f
+    return register
+
+
+def connect():
+    db = sqlite3.connect(helpers.DATABASE, isolation_level=None)
+    db.execute("PRAGMA busy_timeout = 5000")
+    return db
+
+
+def acquire(now):
+    """Take or renew the lease; returns whether this worker holds it."""
+    global leader_until
+
+    def upsert():
+        db = connect()
+        try:
+            cursor = db.execute(
+                """
+                INSERT INTO scheduler_lease (name, holder, expires_at) VALUES ('leader', ?, ?)
+                ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+                WHERE scheduler_lease.holder = excluded.holder OR scheduler_lease.expires_at < ?
+            """,
+                (holder, now + LEASE_SECONDS, now),
+            )
+            return cursor.rowcount == 1
+        finally:
+            db.close()
+
+    won = helpers.run_db(upsert)
+    if won and not is_leader(now):
+        logger.info("%s is now the scheduler leader", holder)
+        load_last_runs()
+    leader_until = now + LEASE_SECONDS if won else 0.0
+    return won
+
+
+def is_leader(now):
+    return now < leader_until
+
+
+def load_last_runs():
+    """Schedule leader jobs from their last runs, whoever ran them."""
+    def read():
+        db = connect()
+        try:
+            return dict(db.execute("SELECT name, last_started FROM scheduled_jobs").fetchall())
+        finally:
+            db.close()
+
+    last_runs = helpers.run_db(read)
+    for job in JOBS.values():
+        if job.leader_only:
+            job.next_run = schedule(job, last_runs.get(job.name))
+
+
+def schedule(job, last_run):
+    """When job is next due, having last started at last_run (None for never)."""
+    base = time.time() if last_run is None else last_run + job.interval
+    return base + random.uniform(0, JITTER * job.interval)
+
+
+def record(job, started, seconds, error):
+    def write():
+        db = connect()
+        try:
+            db.execute(
+                """
+                INSERT INTO scheduled_jobs (name, last_started, last_seconds, last_error, runs) VALUES (?, ?, ?, ?, 1)
+                ON CONFLICT(name) DO UPDATE SET last_started = excluded.last_started,
+                    last_seconds = excluded.last_seconds, last_error = excluded.last_error, runs = runs + 1
+            """,
+                (job.name, started, seconds, error),
+            )
+        finally:
+            db.close()
+
+    helpers.run_db(write)
+
+
+def run(job):
+    started = time.time()
+    start = time.perf_counter()
+    error = None
+    try:
+        job.f()
+    except Exception as e:
+        error = repr(e)
+        logger.exception("Scheduled job %s failed", job.name)
+    seconds = time.perf_counter() - start
+    metrics.job_seconds.observe(seconds, job.name)
+    if job.leader_only:
+        record(job, started, seconds, error)
+    job.next_run = schedule(job, started)
+
+
+def tick(now=None):
+    """Renew the lease if it is time to and run every job that is due."""
+    global next_renewal
+    now = time.time() if now is None else now
+    if now >= next_renewal:
+        next_renewal = now + LEASE_SECONDS / 3
+        acquire(now)
+    for job in list(JOBS.values()):
+        if job.leader_only and not is_leader(time.time()):
+            continue
+        if job.next_run is None:
+            job.next_run = schedule(job, None)
+        if time.time() >= job.next_run:
+            run(job)
+
+
+def loop():
+    while True:
+        try:
+            tick()
+        except sqlite3.Error:
+            # Most likely the lease's write timed out, try again next tick
+            logger.exception("Scheduler tick failed")
+        time.sleep(TICK)
+
+
+def start():
+    """Start this worker's scheduler thread, once."""
+    global holder, worker
+    if worker is None:
+        # Started after the fork so every worker gets its own thread and name
+        with _start_lock:
+            if worker is None:
+                holder = holder_name()
+                worker = threading.Thread(target=loop, name="scheduler", daemon=True)
+                worker.start()
+
+
+# Housekeeping for tweetor.db itself
+
+
+@job(6 * 3600, leader_only=True)
+def analyze():
+    """Refresh the query planner's statistics, from a sample of each index."""
+    def analyze_db():
+        db = connect()
+        try:
+            db.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+            db.execute("ANALYZE")
+        finally:
+            db.close()
+
+    helpers.run_db(analyze_db)
+
+
+@job(300, leader_only=True)
+def checkpoint():
+    """Copy the WAL back into tweetor.db and truncate it, if it is in WAL mode."""
+    def checkpoint_db():
+        db = connect()
+        try:
+            if db.execute("PRAGMA journal_mode").fetchone()[0] == "wal":
+                db.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+        finally:
+            db.close()
+
+    helpers.run_db(checkpoint_db)
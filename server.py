@@ -0,0 +1,132 @@
+"""Production entry point: gevent WSGI server with WebSocket support.
+
+    python server.py
+
+Configured through the environment (or .env):
+
+    TWEETOR_HOST            address to bind (default 0.0.0.0)
+    TWEETOR_PORT            port to bind (default 5000)
+    TWEETOR_WORKERS         worker processes sharing the socket (default 1)
+    TWEETOR_DB_THREADS      SQLite threadpool size per worker (default 4)
+    TWEETOR_SHUTDOWN_GRACE  seconds to let in-flight requests finish (default 10)
+"""
+# Patch before anything imports sqlite3, requests or socket
+from gevent import monkey
+
+monkey.patch_all()
+
+import os
+import signal
+import socket
+import sys
+import time
+
+import gevent
+from gevent.pywsgi import WSGIServer
+from geventwebsocket.handler import WebSocketHandler
+
+import assets
+import database_setup
+import deletions
+import fragments
+import helpers
+import notifications
+import scheduler
+import storage
+
+HOST = os.getenv("TWEETOR_HOST", "0.0.0.0")
+PORT = int(os.getenv("TWEETOR_PORT", "5000"))
+WORKERS = int(os.getenv("TWEETOR_WORKERS", "1"))
+DB_THREADS = int(os.getenv("TWEETOR_DB_THREADS", "4"))
+SHUTDOWN_GRACE = float(os.getenv("TWEETOR_SHUTDOWN_GRACE", "10"))
+
+
+def make_listener():
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    # pywsgi sends headers and body in separate writes; with Nagle on, the
+    # body waits for the client's delayed ACK (~40ms). Accepted sockets
+    # inherit this on Linux.
+    listener.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    listener.bind((HOST, PORT))
+    listener.listen(1024)
+    return listener
+
+
+def serve(listener):
+    # Import the app after forking so no worker inherits another process's
+    # threads (the rate limiter starts a timer) or open database handles
+    from app import create_app
+
+    app = create_app()
+
+    helpers.use_db_threadpool(DB_THREADS)
+    fragments.precompile(app)
+    # Finish any background deletions the last run didn't get to
+    deletions.start()
+    server = WSGIServer(listener, app, handler_class=WebSocketHandler)
+
+    def shutdown():
+        # Stop accepting, then give in-flight requests time to finish
+        server.stop(timeout=SHUTDOWN_GRACE)
+
+    gevent.signal_handler(signal.SIGTERM, shutdown)
+    gevent.signal_handler(signal.SIGINT, shutdown)
+    # Housekeeping jobs, the shared ones on whichever worker leads
+    scheduler.start()
+    server.serve_forever()
+    # Read markers the scheduler hasn't written yet
+    notifications.flush()
+
+
+def spawn_worker(listener):
+    pid = gevent.fork()
+    if pid == 0:
+        try:
+            serve(listener)
+        finally:
+            os._exit(0)
+    return pid
+
+
+def main():
+    # Before forking, rather than in every worker as it starts
+    storage.require_sqlite()
+    # Once, before forking: a single PRAGMA read when the schema is current
+    database_setup.setup()
+    # Once, before forking, so every worker serves the same hashed files
+    assets.build()
+    listener = make_listener()
+    print(f"Serving on http://{HOST}:{PORT} with {WORKERS} worker(s)", file=sys.stderr)
+    if WORKERS <= 1:
+        serve(listener)
+        return
+
+    workers = {spawn_worker(listener) for _ in range(WORKERS)}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # Replace workers that die, until we are told to stop
+    while workers:
+        try:
+            pid, _ = os.waitpid(-1, 0)
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        workers.discard(pid)
+        if not stopping:
+            time.sleep(1)
+            workers.add(spawn_worker(listener))
+
+
+if __name__ == "__main__":
+    main()
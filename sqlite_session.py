@@ -0,0 +1,184 @@
+import datetime
+import secrets
+import sqlite3
+import threading
+import time
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+
+class SQLiteSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, expiry=0):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.expiry = expiry
+        self.modified = False
+        self.accessed = False
+
+    # Mark reads as well as writes, like flask's SecureCookieSession, so
+    # pages that never look at the session don't get "Vary: Cookie"
+    def __getitem__(self, key):
+        self.accessed = True
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super().get(key, default)
+
+    def setdefault(self, key, default=None):
+        self.accessed = True
+        return super().setdefault(key, default)
+
+
+class SQLiteSessionInterface(SessionInterface):
+    """Server side sessions stored in a WAL mode SQLite table.
+
+    Visitors with an empty session never get a row or a cookie, and
+    unchanged sessions are not written back. Expired rows are deleted by
+    expire(), in small batches, which the app schedules as a job
+    (see scheduler.py) rather than running on a request.
+    """
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, database="sessions.db", expire_batch=500):
+        self.database = database
+        self.expire_batch = expire_batch
+        self._db = None
+        self._lock = threading.Lock()
+
+    def execute(self, sql, params=()):
+        # A single autocommit connection shared by every thread/greenlet, opened
+        # on first use so importing the app never touches the disk
+        with self._lock:
+            if self._db is None:
+                db = sqlite3.connect(
+                    self.database, isolation_level=None, check_same_thread=False
+                )
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute("PRAGMA synchronous=NORMAL")
+                db.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS sessions (
+                        sid TEXT PRIMARY KEY,
+                        data BLOB NOT NULL,
+                        expiry INTEGER NOT NULL
+                    ) WITHOUT ROWID
+                """
+                )
+                db.execute(
+                    "CREATE INDEX IF NOT EXISTS sessions_expiry ON sessions (expiry)"
+                )
+                self._db = db
+            cursor = self._db.execute(sql, params)
+            return cursor.fetchone(), cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if not sid:
+            return SQLiteSession()
+
+        row, _ = self.execute("SELECT data, expiry FROM sessions WHERE sid = ?", (sid,))
+        if row is None or row[1] < time.time():
+            return SQLiteSession()
+        return SQLiteSession(self.serializer.loads(row[0]), sid, row[1])
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        now = int(time.time())
+
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        # Emptied session, drop the row and the cookie
+        if not session:
+            if session.sid is not None and session.modified:
+                self.execute("DELETE FROM sessions WHERE sid = ?", (session.sid,))
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        lifetime = int(app.permanent_session_lifetime.total_seconds())
+        new_session = session.sid is None
+        extended = False
+        if session.modified:
+            if new_session:
+                session.sid = secrets.token_urlsafe(32)
+            session.expiry = now + lifetime
+            extended = True
+            self.execute(
+                "INSERT OR REPLACE INTO sessions (sid, data, expiry) VALUES (?, ?, ?)",
+                (session.sid, self.serializer.dumps(dict(session)), session.expiry),
+            )
+        elif session.expiry - now < lifetime // 2:
+            # Only push the expiry forward once half the lifetime has passed
+            session.expiry = now + lifetime
+            extended = True
+            self.execute(
+                "UPDATE sessions SET expiry = ? WHERE sid = ?",
+                (session.expiry, session.sid),
+            )
+
+        # The cookie always carries the row's expiry, so it is only re-sent
+        # when the row was extended and never outlives it
+        if new_session or (extended and session.permanent):
+            expires = None
+            if session.permanent:
+                expires = datetime.datetime.fromtimestamp(
+                    session.expiry, datetime.timezone.utc
+                )
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=expires,
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+    def delete_handle(self, handle):
+        """Log handle out everywhere, e.g. when the account is deleted."""
+        _, deleted = self.execute(
+            "DELETE FROM sessions WHERE json_extract(data, '$.handle') = ?", (handle,)
+        )
+        return deleted
+
+    def expire(self):
+        """Delete every expired row, a batch per statement. Returns how many."""
+        now = int(time.time())
+        deleted = total = self.delete_expired(now)
+        while deleted == self.expire_batch:
+            deleted = self.delete_expired(now)
+            total += deleted
+        return total
+
+    def checkpoint(self):
+        """Copy the WAL back into the database and truncate it."""
+        self.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def delete_expired(self, now=None):
+        if now is None:
+            now = int(time.time())
+        _, deleted = self.execute(
+            """
+            DELETE FROM sessions WHERE sid IN (
+                SELECT sid FROM sessions WHERE expiry < ? LIMIT ?
+            )
+        """,
+            (now, self.expire_batch),
+        )
+        return deleted
@@ -0,0 +1,64 @@
+console.log("dmSocket.js loaded");
+
+// Live DMs over /ws/dm/<handle>. If the socket isn't open (for example under
+// the development server) the form falls back to a normal POST.
+const dmMessages = document.getElementById('dm_messages');
+const dmForm = document.getElementById('dm_form');
+const dmContent = document.getElementById('content');
+let lastDmId = parseInt(dmMessages.dataset.lastId);
+const renderedDmIds = new Set();
+let nextClientId = 0;
+let dmSocket;
+
+function renderDM(message) {
+  // Messages from other workers can arrive out of order, so dedupe by id
+  if (message.id <= parseInt(dmMessages.dataset.lastId) || renderedDmIds.has(message.id)) {
+    return;
+  }
+  renderedDmIds.add(message.id);
+  lastDmId = Math.max(lastDmId, message.id);
+
+  const sender = document.createElement('strong');
+  sender.innerText = message.sender_handle + ':';
+  dmMessages.appendChild(sender);
+  dmMessages.appendChild(document.createTextNode(' ' + message.content));
+  dmMessages.appendChild(document.createElement('br'));
+}
+
+function connectDMs() {
+  const scheme = window.location.protocol == 'https:' ? 'wss' : 'ws';
+  dmSocket = new WebSocket(`${scheme}://${window.location.host}/ws/dm/${encodeURIComponent(dmMessages.dataset.receiver)}`);
+
+  dmSocket.onopen = () => {
+    dmSocket.send(JSON.stringify({type: 'resume', last_id: lastDmId}));
+  };
+
+  dmSocket.onmessage = (event) => {
+    const frame = JSON.parse(event.data);
+    if (frame.type == 'message') {
+      renderDM(frame.message);
+    } else if (frame.type == 'error') {
+      alert(frame.error);
+    }
+  };
+
+  // Reconnect and resume from the last message we rendered
+  dmSocket.onclose = () => {
+    setTimeout(connectDMs, 2000);
+  };
+}
+
+dmForm.addEventListener('submit', (event) => {
+  if (!dmSocket || dmSocket.readyState != WebSocket.OPEN) {
+    return;
+  }
+  event.preventDefault();
+  dmSocket.send(JSON.stringify({
+    type: 'send',
+    client_id: String(nextClientId++),
+    content: dmContent.value,
+  }));
+  dmContent.value = '';
+});
+
+connectDMs();
@@ -20,9 +20,32 @@ function getMonthAbbreviation(date) {
   return months[date.getMonth()];
 }
 
+// One object per flit from a ?format=columnar page (see columnar.py)
+function decodeFlits(page) {
+  const columns = page.columns;
+  const decoded = [];
+  for (let i = 0; i < page.count; i++) {
+    decoded.push({
+      "id": columns.id[i],
+      "content": columns.content[i],
+      "timestamp": columns.timestamp[i],
+      "userHandle": page.strings[columns.userHandle[i]],
+      "username": page.strings[columns.username[i]],
+      "is_reflit": columns.is_reflit[i],
+      "original_flit_id": columns.original_flit_id[i] ?? -1,
+      "meme_link": columns.meme_link[i] ?? ""
+    });
+  }
+  return decoded;
+}
+
 async function renderFlits() {
-  const res = await fetch(`/api/get_flits?skip=${skip}&limit=${limit}`); //////////////////////////////// possible http param inject
-  const json = await res.json();
+  const res = await fetch(`/api/get_flits?skip=${skip}&limit=${limit}&format=columnar`); //////////////////////////////// possible http param inject
+  if (!res.ok) {
+    // Busy (503), skip stays put so the next scroll asks again
+    return;
+  }
+  const json = decodeFlits(await res.json());
   for (let flitJSON of json) {
     let flit = document.createElement("div");
     flit.classList.add("flit");
@@ -151,10 +174,30 @@ async function renderFlitWithFlitJSON(json, flit) {
 
 const flitsList = document.getElementsByClassName('flit');
 
+// Flits the server already rendered (templates/_flit.html) only need their
+// timestamps localized and GIFs hidden if the user turned them off
+function finishRenderedFlits() {
+  const options = { year: 'numeric', month: 'short', day: 'numeric', hour: 'numeric', minute: 'numeric'};
+  for (const span of document.querySelectorAll('.flit [data-timestamp]')) {
+    const timestamp = convertUSTtoEST(new Date(span.dataset.timestamp.replace(/\s/g, 'T') + "Z"));
+    span.innerText = timestamp.toLocaleDateString(undefined, options);
+  }
+  if (localStorage.getItem('renderGifs') == 'false') {
+    for (const image of document.querySelectorAll('.flit img.meme')) {
+      image.remove();
+    }
+  }
+}
+
 async function renderAll() {
+  finishRenderedFlits();
   for (let i = 0; i < flitsList.length; i++) {
+    if (flitsList[i].dataset.rendered) {
+      continue;
+    }
     renderSingleFlit(flitsList[i]);
   }
+  checkGreenDot();
 }
 
 renderAll();
@@ -29,25 +29,33 @@ async function loadLeaderboard() {
   // Constants
   const days = 5;
 
-  const res = await fetch("/api/get_flits?skip=0&limit=1000");
-  const json = await res.json();
+  const res = await fetch("/api/get_flits?skip=0&limit=1000&format=columnar");
+  if (res.status == 503) {
+    // The server is busy, come back when it says to
+    const retryAfter = parseInt(res.headers.get("Retry-After")) || 5;
+    window.setTimeout(loadLeaderboard, retryAfter * 1000);
+    return;
+  }
+  // Read straight from the columns, see columnar.py
+  const page = await res.json();
+  const columns = page.columns;
   let userData = {};
-  for (let i = 0; i < json.length; i++) {
-    const flit = json[i];
-    const handle = flit["userHandle"];
-    if (timeDifferenceStr(flit["timestamp"])>days) {
+  for (let i = 0; i < page.count; i++) {
+    const handle = page.strings[columns.userHandle[i]];
+    const age = timeDifferenceStr(columns.timestamp[i]);
+    if (age>days) {
       break;
     }
     if (handle == 'admin') {
       continue;
     }
-    if (flit['is_reflit'] == 1) {
+    if (columns.is_reflit[i] == 1) {
       continue;
     }
     if (userData[handle] != undefined) {
-      userData[handle] += (days - timeDifferenceStr(flit["timestamp"]))/days*2;
+      userData[handle] += (days - age)/days*2;
     } else {
-      userData[handle] = (days - timeDifferenceStr(flit["timestamp"]))/days*2;
+      userData[handle] = (days - age)/days*2;
     }
   }
   const sortedUserData = Object.entries(userData).sort((a, b) => b[1] - a[1]);
@@ -1,55 +1,92 @@
 ('notifications.js Loaded')
-const equals = (a, b) => JSON.stringify(a) === JSON.stringify(b);
 let prevRecentMessages;
+let sinceId = 0;
 const notificationAudio = document.getElementById("notification");
-console.log(notificationAudio);
+const notificationCount = document.getElementById("notification_count");
 
 
-function findAddedElements(oldArray, newArray) {
-    const addedElements = newArray.filter(newObj => !oldArray.some(oldObj => oldObj["id"] === newObj["id"]));
-    return addedElements;
+function findAddedElements(oldIds, newIds) {
+    const seen = new Set(oldIds);
+    return newIds.filter(id => !seen.has(id));
 }
 
-async function checkNotifications() {
-  const res = await fetch(`/api/get_flits?skip=0&limit=${limit}`);
-  const newElements = findAddedElements(prevRecentMessages, await res.clone().json());
-  console.log(newElements);
-  if (newElements.length != 0) {
-    if (window.location.pathname == '/') {
-      for (let i = 0; i < newElements.length; i++) {
-        console.log((await res.clone().json())[i]);
-        let flit = document.createElement("div");
-        flit.classList.add("flit");
-        flit.dataset.flitId = (await res.clone().json())[i]['id'];
-        flit = await renderSingleFlit(flit);
-        console.log(flit);
-        flits.insertBefore(flit, flits.firstChild);
-      }
-    }
-    prevRecentMessages = await res.json();
+// Ids of the newest flits; only the id column of a columnar page is needed
+async function recentFlitIds() {
+  const res = await fetch(`/api/get_flits?skip=0&limit=${limit}&format=columnar`);
+  if (!res.ok) {
+    return null;
+  }
+  return (await res.json()).columns.id ?? [];
+}
+
+// New flits at the top of the home feed
+async function refreshFeed() {
+  const recent = await recentFlitIds();
+  if (recent === null) {
+    // Busy (503), the next refresh will try again
+    return;
+  }
+  if (!prevRecentMessages) {
+    // The first page failed to load, so everything on this one is already shown
+    prevRecentMessages = recent;
+    return;
+  }
+  const newElements = findAddedElements(prevRecentMessages, recent);
+  for (let i = newElements.length - 1; i >= 0; i--) {
+    let flit = document.createElement("div");
+    flit.classList.add("flit");
+    flit.dataset.flitId = newElements[i];
+    flit = await renderSingleFlit(flit);
+    flits.insertBefore(flit, flits.firstChild);
+  }
+  prevRecentMessages = recent;
+}
+
+function describe(notification) {
+  if (notification.kind == 'dm') {
+    return `New message from @${notification.actor_handle}`;
+  }
+  return `@${notification.actor_handle} mentioned you`;
+}
+
+// Mentions and DMs for the signed in user, from their inbox
+async function checkNotifications(alert) {
+  const res = await fetch(`/api/notifications?since_id=${sinceId}`);
+  if (!res.ok) {
+    return;
+  }
+  const inbox = await res.json();
+  if (notificationCount) {
+    notificationCount.textContent = inbox.unread ? ` (${inbox.unread})` : '';
+  }
+  if (inbox.notifications.length == 0) {
+    return;
+  }
+  sinceId = inbox.notifications[0].id;
+  if (alert && localStorage.getItem('notifications') != 'false') {
+    notificationAudio.play().catch(() => {});
     if (Notification.permission == 'granted') {
-      console.log("Notification");
-      const notification = new Notification(`@${newElements[0].userHandle}`, {
+      new Notification(describe(inbox.notifications[0]), {
         icon: '/static/logo.png',
-        body: newElements[0].content
-      })
+        body: inbox.notifications[0].content
+      });
     }
   }
 }
 
-Notification.requestPermission();
 if (Notification.permission !== 'denied') {
   Notification.requestPermission();
 }
 
 (async () => {
-  let res = await fetch(`/api/get_flits?skip=${skip}&limit=${limit}`);
-  console.log(await res.clone().json());
-  prevRecentMessages = await res.json();
+  if (window.location.pathname == '/') {
+    prevRecentMessages = await recentFlitIds();
+    window.setInterval(refreshFeed, 5000);
+  }
 
-  res = await fetch(`/api/handle`);
-  if (localStorage.getItem('notifications') == 'true' || localStorage.getItem('notifications') == undefined && (await res.text()) != 'Not Logged In') {
-    window.setInterval(checkNotifications, 5000);
+  const res = await fetch(`/api/handle`);
+  if ((await res.text()) != 'Not Logged In') {
+    await checkNotifications(false);
+    window.setInterval(() => checkNotifications(true), 5000);
   }
 })();
-
@@ -0,0 +1,646 @@
+"""Data access for app.py and helpers.py, on SQLite or PostgreSQL.
+
+Routes call the repository functions below (feed_page(), user_flits(),
+conversation(), insert_flit(), ...) instead of running SQL themselves.
+They run on the backend TWEETOR_DATABASE_URL picks:
+
+    unset or sqlite:///tweetor.db   SQLite, through helpers.get_db()
+    postgresql://user@host/tweetor  PostgreSQL, on a pool of
+                                    TWEETOR_PG_POOL (default 10) connections
+
+SQLite stays the default and keeps what it had. Writes go through
+helpers.write_transaction(), so the write queue applies when it is on.
+Flit reads fall through to archive.py's archive. PostgreSQL takes
+writers on several hosts at once and needs neither: one flits table
+holds every flit.
+
+Each query is written once, in SQL both databases accept. It uses ON
+CONFLICT rather than INSERT OR IGNORE, RETURNING rather than lastrowid,
+and ? placeholders, which the PostgreSQL backend rewrites to %s. Inside
+a write transaction both backends hand out a cursor with sqlite3's
+execute and fetch methods. That lets code such as
+hashtags.write_tags() and notifications.write_mentions() join either
+transaction. PostgreSQL folds unquoted names to lower case, so the
+camelCase userHandle column is always selected as "userHandle".
+
+moderation.py, deletions.py, archive.py, dump.py, and the hashtag and
+notification readers still run SQLite SQL of their own, on tweetor.db.
+Until they go through here too, the app on PostgreSQL would keep half
+its data in each database, so require_sqlite() stops create_app() and
+server.py from starting on it. The PostgreSQL backend serves the storage
+tests and benchmarks/bench_storage.py meanwhile.
+
+    python storage.py setup    # create the PostgreSQL tables and indexes
+"""
+import contextlib
+import functools
+import hashlib
+import os
+import sys
+import threading
+
+import archive
+import flit_cache
+import hashtags
+import helpers
+import notifications
+import threads
+
+# The columns /api/get_flits has always returned
+FEED_COLUMNS = (
+    'f.id, f.content, f.timestamp, f.userHandle AS "userHandle", f.username, f.hashtag, f.is_reflit, '
+    "f.original_flit_id, f.meme_link"
+)
+FLIT_COLUMNS = FEED_COLUMNS + ", f.profane_flit, f.reply_to, f.thread_path, f.reply_count"
+
+
+class SQLiteBackend:
+    name = "sqlite"
+    archive = True
+
+    def __init__(self, path=None):
+        if path:
+            helpers.DATABASE = path
+
+    @contextlib.contextmanager
+    def read(self):
+        db = helpers.get_db()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def transaction(self, f, *args):
+        return helpers.write_transaction(f, *args)
+
+
+class PostgresCursor:
+    """A psycopg2 cursor that takes ? placeholders, like sqlite3's."""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, sql, params=()):
+        helpers.run_db(self.cursor.execute, placeholders(sql), params)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        helpers.run_db(self.cursor.executemany, placeholders(sql), list(seq_of_params))
+        return self
+
+    def fetchone(self):
+        return helpers.run_db(self.cursor.fetchone)
+
+    def fetchall(self):
+        return helpers.run_db(self.cursor.fetchall)
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+
+class PostgresConnection:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def cursor(self):
+        from psycopg2.extras import DictCursor
+
+        return PostgresCursor(self.connection.cursor(cursor_factory=DictCursor))
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+
+@functools.lru_cache(maxsize=512)
+def placeholders(sql):
+    return sql.replace("%", "%%").replace("?", "%s")
+
+
+class PostgresBackend:
+    name = "postgresql"
+    archive = False
+
+    def __init__(self, url, size=10):
+        # Only PostgreSQL deployments need psycopg2
+        from psycopg2.pool import ThreadedConnectionPool
+
+        self.pool = ThreadedConnectionPool(1, size, url)
+        # The pool raises rather than waits when every connection is out
+        self.available = threading.BoundedSemaphore(size)
+
+    @contextlib.contextmanager
+    def connection(self, autocommit):
+        with self.available:
+            connection = self.pool.getconn()
+            try:
+                connection.autocommit = autocommit
+                yield connection
+            finally:
+                self.pool.putconn(connection)
+
+    @contextlib.contextmanager
+    def read(self):
+        with self.connection(autocommit=True) as connection:
+            yield PostgresConnection(connection)
+
+    def transaction(self, f, *args):
+        with self.connection(autocommit=False) as connection:
+            try:
+                result = f(PostgresConnection(connection).cursor(), *args)
+                helpers.run_db(connection.commit)
+            except BaseException:
+                helpers.run_db(connection.rollback)
+                raise
+        return result
+
+    def create_schema(self):
+        with self.connection(autocommit=True) as connection:
+            connection.cursor().execute(POSTGRES_SCHEMA)
+
+    def close(self):
+        self.pool.closeall()
+
+
+# database_setup.py's tables and indexes, for PostgreSQL. Timestamps are
+# text in SQLite's format, so both backends return and sort them alike.
+POSTGRES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    username TEXT NOT NULL,
+    turbo INTEGER DEFAULT 0,
+    handle TEXT NOT NULL UNIQUE,
+    password TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS flits (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    content TEXT,
+    timestamp TEXT DEFAULT to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS'),
+    profane_flit TEXT,
+    userHandle TEXT NOT NULL,
+    username TEXT NOT NULL,
+    hashtag TEXT NOT NULL,
+    ip TEXT NOT NULL,
+    is_reflit INTEGER,
+    meme_link VARCHAR(255),
+    original_flit_id BIGINT,
+    reply_to BIGINT,
+    thread_path TEXT COLLATE "C",
+    reply_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS direct_messages (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    sender_handle TEXT NOT NULL,
+    receiver_handle TEXT NOT NULL,
+    content TEXT,
+    profane_dm TEXT NOT NULL,
+    timestamp TEXT DEFAULT to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS')
+);
+CREATE TABLE IF NOT EXISTS reported_flits (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    flit_id BIGINT NOT NULL,
+    reporter_handle TEXT NOT NULL,
+    reason TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blocks (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    blocker_handle TEXT NOT NULL,
+    blocked_handle TEXT NOT NULL,
+    block_time TEXT DEFAULT to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS'),
+    UNIQUE (blocker_handle, blocked_handle)
+);
+CREATE TABLE IF NOT EXISTS user_last_flit (
+    handle TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL,
+    flit_id BIGINT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS deletion_jobs (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    kind TEXT NOT NULL,
+    target TEXT NOT NULL,
+    deleted BIGINT NOT NULL DEFAULT 0,
+    created_at TEXT DEFAULT to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS'),
+    finished_at TEXT
+);
+CREATE TABLE IF NOT EXISTS flit_hashtags (
+    tag TEXT NOT NULL,
+    flit_id BIGINT NOT NULL,
+    PRIMARY KEY (tag, flit_id)
+);
+CREATE TABLE IF NOT EXISTS notifications (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    handle TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    actor_handle TEXT NOT NULL,
+    source_id BIGINT NOT NULL,
+    created_at TEXT DEFAULT to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS')
+);
+CREATE TABLE IF NOT EXISTS notification_reads (
+    handle TEXT PRIMARY KEY,
+    last_read_id BIGINT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS direct_messages_conversation ON direct_messages (sender_handle, receiver_handle, id);
+CREATE INDEX IF NOT EXISTS flits_user_timestamp ON flits (userHandle, timestamp);
+CREATE INDEX IF NOT EXISTS flits_timestamp ON flits (timestamp);
+CREATE INDEX IF NOT EXISTS reported_flits_flit ON reported_flits (flit_id, reporter_handle, reason);
+CREATE INDEX IF NOT EXISTS flits_profane ON flits (id) WHERE profane_flit = 'yes';
+CREATE INDEX IF NOT EXISTS flits_thread ON flits (thread_path) WHERE thread_path IS NOT NULL;
+CREATE INDEX IF NOT EXISTS direct_messages_profane ON direct_messages (id) WHERE profane_dm = 'yes';
+CREATE INDEX IF NOT EXISTS deletion_jobs_pending ON deletion_jobs (kind, target) WHERE finished_at IS NULL;
+CREATE INDEX IF NOT EXISTS flit_hashtags_flit ON flit_hashtags (flit_id);
+CREATE INDEX IF NOT EXISTS notifications_handle ON notifications (handle, id);
+"""
+
+# Made on first use, so each server.py worker opens its own pool
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def connect(url):
+    if url.startswith(("postgres://", "postgresql://")):
+        return PostgresBackend(url, int(os.getenv("TWEETOR_PG_POOL", "10")))
+    if url.startswith("sqlite:///"):
+        return SQLiteBackend(url[len("sqlite:///"):])
+    raise ValueError(f"Unsupported TWEETOR_DATABASE_URL: {url}")
+
+
+def backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                url = os.getenv("TWEETOR_DATABASE_URL")
+                _backend = connect(url) if url else SQLiteBackend()
+    return _backend
+
+
+def require_sqlite():
+    """Raise RuntimeError if the repository runs on PostgreSQL.
+
+    Looks at TWEETOR_DATABASE_URL rather than connecting, so server.py can
+    call it before forking.
+    """
+    if _backend is not None:
+        name = _backend.name
+    else:
+        url = os.getenv("TWEETOR_DATABASE_URL") or ""
+        name = "postgresql" if url.startswith(("postgres://", "postgresql://")) else "sqlite"
+    if name != "sqlite":
+        raise RuntimeError(
+            "The app can't run on PostgreSQL yet: moderation, deletions, archiving, dumps and the "
+            "hashtag and notification readers still use tweetor.db. Unset TWEETOR_DATABASE_URL."
+        )
+
+
+def use(new_backend):
+    """Run the repository on new_backend from now on (tests and benchmarks)."""
+    global _backend
+    _backend = new_backend
+    flit_cache.clear()
+
+
+def fetchall(sql, params=()):
+    with backend().read() as db:
+        cursor = db.cursor()
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def fetchone(sql, params=()):
+    with backend().read() as db:
+        cursor = db.cursor()
+        cursor.execute(sql, params)
+        return cursor.fetchone()
+
+
+def ping():
+    fetchone("SELECT 1")
+
+
+# Flits
+
+
+def feed_page(viewer, limit, skip):
+    """A page of the home feed, newest first, without viewer's blocks."""
+    return fetchall(
+        f"""
+        SELECT {FEED_COLUMNS}
+        FROM flits AS f
+        LEFT JOIN blocks AS b ON f.userHandle = b.blocked_handle AND b.blocker_handle = ?
+        WHERE f.profane_flit = 'no' AND (b.blocked_handle IS NULL) AND f.userHandle NOT IN {helpers.DELETED_HANDLES}
+        ORDER BY f.id DESC
+        LIMIT ? OFFSET ?
+    """,
+        (viewer, limit, skip),
+    )
+
+
+def flit(flit_id):
+    """The flit, archived or not, or None if it doesn't exist or is hidden.
+
+    Read through flit_cache, so what comes back is a flit_cache.Record.
+    """
+    try:
+        flit_id = int(flit_id)
+    except (TypeError, ValueError):
+        return None
+    if flit_cache.max_bytes <= 0:
+        return load_flit(flit_id)
+    if flit_cache.due():
+        with backend().read() as db:
+            flit_cache.poll(db.cursor())
+    cached = flit_cache.get(flit_id)
+    if cached is not flit_cache.NOT_CACHED:
+        return cached
+    generation = flit_cache.generation
+    return flit_cache.put(flit_id, load_flit(flit_id), generation)
+
+
+def load_flit(flit_id):
+    with backend().read() as db:
+        if backend().archive:
+            return archive.find_flit(db, flit_id, FLIT_COLUMNS)
+        cursor = db.cursor()
+        cursor.execute(
+            f"SELECT {FLIT_COLUMNS} FROM flits AS f WHERE f.id = ? AND f.userHandle NOT IN {helpers.DELETED_HANDLES}",
+            (flit_id,),
+        )
+        return cursor.fetchone()
+
+
+def user_flit_stats(handle):
+    """(hot flits, all flits, oldest timestamp) for handle."""
+    with backend().read() as db:
+        if backend().archive:
+            return archive.user_flit_stats(db, handle)
+        cursor = db.cursor()
+        cursor.execute("SELECT count(*), min(timestamp) FROM flits WHERE userHandle = ?", (handle,))
+        count, oldest = cursor.fetchone()
+        return count, count, oldest
+
+
+def user_flits(handle, limit, offset, hot):
+    """A page of handle's flits, newest first; hot is from user_flit_stats()."""
+    with backend().read() as db:
+        if backend().archive:
+            return archive.user_flits(db, handle, limit, offset, hot, FLIT_COLUMNS)
+        cursor = db.cursor()
+        cursor.execute(
+            f"SELECT {FLIT_COLUMNS} FROM flits AS f WHERE f.userHandle = ? ORDER BY f.timestamp DESC LIMIT ? OFFSET ?",
+            (handle, limit, offset),
+        )
+        return cursor.fetchall()
+
+
+def all_flit_ids():
+    return [row[0] for row in fetchall("SELECT id FROM flits")]
+
+
+def insert_flit(username, handle, content, meme_url, original_flit_id, client_ip, reply_to=None):
+    """Store a flit and update the tables derived from it in one transaction.
+
+    Returns the new flit's id, or None if the content repeats the user's last
+    flit. A reflit whose original doesn't exist is stored as a plain flit, and
+    so is a reply to a flit that doesn't.
+    """
+    content_hash = hashlib.sha256(content.encode()).hexdigest()
+    flit_id = backend().transaction(
+        write_flit, username, handle, content, content_hash, meme_url, original_flit_id, client_ip, reply_to
+    )
+    if flit_id is not None:
+        # A lookup of the id before the insert committed may have cached
+        # None, and a parent's reply_count changed
+        flit_cache.discard([flit_id] if reply_to is None else [flit_id, reply_to])
+    return flit_id
+
+
+def write_flit(cursor, username, handle, content, content_hash, meme_url, original_flit_id, client_ip, reply_to=None):
+    cursor.execute("SELECT content_hash FROM user_last_flit WHERE handle = ?", (handle,))
+    last_flit = cursor.fetchone()
+    if last_flit and last_flit["content_hash"] == content_hash:
+        return None
+
+    is_reflit = False
+    if original_flit_id is not None:
+        cursor.execute("SELECT id FROM flits WHERE id = ?", (original_flit_id,))
+        is_reflit = cursor.fetchone() is not None
+
+    cursor.execute(
+        """
+        INSERT INTO flits (username, content, userHandle, hashtag, profane_flit, meme_link, is_reflit, original_flit_id, ip)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        RETURNING id
+    """,
+        (
+            username,
+            content,
+            handle,
+            "",
+            "no",
+            meme_url,
+            int(is_reflit),
+            original_flit_id if is_reflit else -1,
+            client_ip,
+        ),
+    )
+    flit_id = cursor.fetchone()[0]
+    if reply_to is not None:
+        threads.write_reply(cursor, flit_id, reply_to)
+    hashtags.write_tags(cursor, flit_id, content)
+    notifications.write_mentions(cursor, flit_id, handle, content)
+
+    cursor.execute(
+        """
+        INSERT INTO user_last_flit (handle, content_hash, flit_id) VALUES (?, ?, ?)
+        ON CONFLICT(handle) DO UPDATE SET content_hash = excluded.content_hash, flit_id = excluded.flit_id
+    """,
+        (handle, content_hash, flit_id),
+    )
+    return flit_id
+
+
+def thread(flit, after=None, limit=threads.PAGE_SIZE):
+    """flit's ancestors, top first, and a page of the replies under it.
+
+    Replies come in thread order with their depth below flit (0 for its
+    direct replies). after is the id of the last reply on the previous page.
+    Returns (ancestors, replies, after for the next page or None). Flits
+    whose author is being deleted come back with hidden set.
+    """
+    path = threads.path_of(flit)
+    ancestors = threads.ancestor_ids(path)
+    prefix = threads.child_prefix(flit["id"], path)
+    end = prefix + ":"  # just past every path that extends prefix
+    try:
+        after = int(after)
+    except (TypeError, ValueError):
+        after = None
+    columns = f"{FLIT_COLUMNS}, f.userHandle IN {helpers.DELETED_HANDLES} AS hidden"
+    rows = fetchall(
+        f"""
+        SELECT * FROM (SELECT {columns} FROM flits AS f WHERE f.id IN ({",".join("?" * len(ancestors)) or "NULL"})) AS ancestors
+        UNION ALL
+        SELECT * FROM (
+            SELECT {columns} FROM flits AS f
+            WHERE f.thread_path > coalesce(
+                    (SELECT a.thread_path FROM flits AS a WHERE a.id = ? AND a.thread_path > ? AND a.thread_path < ?), ?
+                )
+                AND f.thread_path < ?
+            ORDER BY f.thread_path
+            LIMIT ?
+        ) AS replies
+    """,
+        (*ancestors, after, prefix, end, prefix, end, limit),
+    )
+    position = {flit_id: i for i, flit_id in enumerate(ancestors)}
+    above = sorted((row for row in rows if row["id"] in position), key=lambda row: position[row["id"]])
+    below = [row for row in rows if row["id"] not in position]
+    replies = [(threads.depth(row["thread_path"]) - threads.depth(prefix) - 1, row) for row in below]
+    return above, replies, below[-1]["id"] if len(below) == limit else None
+
+
+def report_flit(flit_id, reporter_handle, reason):
+    backend().transaction(write_report, flit_id, reporter_handle, reason)
+
+
+def write_report(cursor, flit_id, reporter_handle, reason):
+    cursor.execute(
+        "INSERT INTO reported_flits (flit_id, reporter_handle, reason) VALUES (?, ?, ?)",
+        (flit_id, reporter_handle, reason),
+    )
+
+
+# Users
+
+
+def user(handle):
+    return fetchone("SELECT * FROM users WHERE handle = ?", (handle,))
+
+
+def users_named(username):
+    return fetchall("SELECT handle FROM users WHERE username = ?", (username,))
+
+
+def being_deleted(handle):
+    """Whether handle's account is still being deleted in the background."""
+    return fetchone(f"SELECT 1 WHERE ? IN {helpers.DELETED_HANDLES}", (handle,)) is not None
+
+
+def all_user_handles():
+    return [row[0] for row in fetchall("SELECT handle FROM users")]
+
+
+def create_user(username, handle, hashed_password):
+    backend().transaction(write_user, username, handle, hashed_password)
+
+
+def write_user(cursor, username, handle, hashed_password):
+    cursor.execute(
+        "INSERT INTO users (username, password, handle, turbo) VALUES (?, ?, ?, ?)",
+        (username, hashed_password, handle, 0),
+    )
+
+
+def set_password(handle, hashed_password):
+    backend().transaction(write_password, handle, hashed_password)
+
+
+def write_password(cursor, handle, hashed_password):
+    cursor.execute("UPDATE users SET password = ? WHERE handle = ?", (hashed_password, handle))
+
+
+# Blocks
+
+
+def blocked_handles(blocker_handle):
+    return [
+        row[0]
+        for row in fetchall("SELECT DISTINCT blocked_handle FROM blocks WHERE blocker_handle = ?", (blocker_handle,))
+    ]
+
+
+def block(blocker_handle, blocked_handle):
+    backend().transaction(write_block, blocker_handle, blocked_handle)
+
+
+def write_block(cursor, blocker_handle, blocked_handle):
+    cursor.execute(
+        """
+        INSERT INTO blocks (blocker_handle, blocked_handle) VALUES (?, ?)
+        ON CONFLICT(blocker_handle, blocked_handle) DO NOTHING
+    """,
+        (blocker_handle, blocked_handle),
+    )
+
+
+def unblock(blocker_handle, blocked_handle):
+    backend().transaction(write_unblock, blocker_handle, blocked_handle)
+
+
+def write_unblock(cursor, blocker_handle, blocked_handle):
+    cursor.execute(
+        "DELETE FROM blocks WHERE blocker_handle = ? AND blocked_handle = ?", (blocker_handle, blocked_handle)
+    )
+
+
+# Direct messages
+
+
+def conversation(handle, other_handle):
+    """The DMs between two users, newest first, without profane ones."""
+    return fetchall(
+        """
+        SELECT * FROM direct_messages
+        WHERE ((sender_handle = ? AND receiver_handle = ?) OR (sender_handle = ? AND receiver_handle = ?))
+            AND profane_dm = 'no'
+        ORDER BY id DESC
+    """,
+        (handle, other_handle, other_handle, handle),
+    )
+
+
+def engaged_handles(handle):
+    """Everyone handle has sent a DM to or received one from."""
+    return [
+        row[0]
+        for row in fetchall(
+            """
+            SELECT DISTINCT receiver_handle FROM direct_messages WHERE sender_handle = ?
+            UNION
+            SELECT DISTINCT sender_handle FROM direct_messages WHERE receiver_handle = ?
+        """,
+            (handle, handle),
+        )
+    ]
+
+
+def insert_dm(sender_handle, receiver_handle, content, profane_dm):
+    """Store a DM and its notification, returning the new row's (id, timestamp)."""
+    return backend().transaction(write_dm, sender_handle, receiver_handle, content, profane_dm)
+
+
+def write_dm(cursor, sender_handle, receiver_handle, content, profane_dm):
+    cursor.execute(
+        """
+        INSERT INTO direct_messages (sender_handle, receiver_handle, content, profane_dm)
+        VALUES (?, ?, ?, ?)
+        RETURNING id, timestamp
+    """,
+        (sender_handle, receiver_handle, content, profane_dm),
+    )
+    row = cursor.fetchone()
+    notifications.write_dm(cursor, row["id"], sender_handle, receiver_handle)
+    return row
+
+
+def main():
+    if sys.argv[1:] != ["setup"]:
+        sys.exit("usage: python storage.py setup")
+    if not isinstance(backend(), PostgresBackend):
+        sys.exit("Set TWEETOR_DATABASE_URL to a postgresql:// URL; for SQLite run database_setup.py")
+    backend().create_schema()
+    print("PostgreSQL schema created", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+import os
+import runpy
+import shutil
+
+import pytest
+
+import flit_cache
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+@pytest.fixture
+def app_dir(tmp_path, monkeypatch):
+    """A fresh tweetor.db and the files app.py reads, in the working directory."""
+    for name in ("blocklist.txt", "profane_words.json"):
+        shutil.copy(os.path.join(ROOT, name), tmp_path)
+    monkeypatch.chdir(tmp_path)
+    runpy.run_path(os.path.join(ROOT, "database_setup.py"), run_name="__main__")
+    flit_cache.clear()
+    return tmp_path
@@ -0,0 +1,82 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+from flask import g
+
+import admission
+import helpers
+import storage
+
+# Never finishes on its own
+ENDLESS = "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT count(*) FROM c"
+
+
+@pytest.fixture
+def tweetor(app_dir, monkeypatch):
+    import app as tweetor
+
+    tweetor.app.config["WTF_CSRF_ENABLED"] = False
+    tweetor.limiter.enabled = False
+    bulk = admission.CostClass("bulk", 1, queue=1, wait=0.2, deadline=10.0)
+    monkeypatch.setitem(admission.CLASSES, "bulk", bulk)
+    return tweetor
+
+
+def test_full_class_sheds_and_cheap_routes_pass(tweetor):
+    client = tweetor.app.test_client()
+    bulk = admission.CLASSES["bulk"]
+    bulk.admit()
+    bulk.service = 5.0
+
+    # A queue that would take longer than the wait is refused straight away
+    start = time.monotonic()
+    response = client.get("/api/get_flits?skip=0&limit=1000")
+    assert response.status_code == 503 and int(response.headers["Retry-After"]) >= 5
+    assert time.monotonic() - start < bulk.wait
+    assert client.get("/api/get_flits?skip=0&limit=10").status_code == 200
+    assert client.get("/api/handle").status_code == 200
+
+    # With no estimate it waits, but no longer than the class allows
+    bulk.service = 0.0
+    start = time.monotonic()
+    assert client.get("/api/get_flits?skip=0&limit=1000").status_code == 503
+    assert time.monotonic() - start >= bulk.wait
+    assert bulk.shed == 2 and bulk.waiting == 0
+
+    # and gets the slot when it frees up in time
+    threading.Timer(0.05, bulk.release, (0.05,)).start()
+    assert client.get("/api/get_flits?skip=0&limit=1000").status_code == 200
+    assert bulk.active == 0
+    with client.session_transaction() as session:
+        session["handle"] = "admin"
+    assert "tweetor_admission_bulk_shed_total 2" in client.get("/metrics").data.decode()
+
+
+def test_home_shell_skips_admission(tweetor, monkeypatch):
+    # The home page is a static shell now; its feed comes from /api/get_flits
+    render = admission.CostClass("render", 1, queue=0, wait=0.2, deadline=5.0)
+    monkeypatch.setitem(admission.CLASSES, "render", render)
+    render.admit()
+    client = tweetor.app.test_client()
+    assert client.get("/").status_code == 200
+    assert client.get("/api/get_flits?skip=0&limit=10").status_code == 503
+    render.release(0.0)
+
+
+def test_deadline_interrupts_queries(tweetor, monkeypatch):
+    with tweetor.app.test_request_context():
+        g.admission_deadline = time.monotonic() + 0.05
+        with pytest.raises(sqlite3.OperationalError, match="interrupted"):
+            helpers.get_db().execute(ENDLESS).fetchone()
+
+    def endless_feed(*args):
+        return storage.fetchall(ENDLESS)
+
+    monkeypatch.setattr(storage, "feed_page", endless_feed)
+    monkeypatch.setattr(admission.CLASSES["bulk"], "deadline", 0.1)
+    start = time.monotonic()
+    response = tweetor.app.test_client().get("/api/get_flits?skip=0&limit=1000")
+    assert response.status_code == 503 and "Retry-After" in response.headers
+    assert time.monotonic() - start < 2
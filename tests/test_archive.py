@@ -0,0 +1,68 @@
+import sqlite3
+
+import pytest
+
+import archive
+import flit_cache
+import storage
+
+
+@pytest.fixture
+def flits(app_dir):
+    """Ten of alice's flits, the first six old enough to archive."""
+    ids = [storage.insert_flit("alice", "alice", f"flit {i} #tag", "", None, "127.0.0.1") for i in range(10)]
+    db = sqlite3.connect("tweetor.db")
+    db.executemany(
+        "UPDATE flits SET timestamp = ? WHERE id = ?",
+        [(f"{2000 + i}-01-01 00:00:00" if i < 6 else f"2030-01-01 00:00:0{i}", flit_id) for i, flit_id in enumerate(ids)],
+    )
+    db.commit()
+    db.close()
+    return ids
+
+
+def hot_and_archived():
+    db = sqlite3.connect("tweetor.db")
+    db.execute("ATTACH DATABASE 'tweetor_archive.db' AS archive")
+    hot = [row[0] for row in db.execute("SELECT id FROM main.flits ORDER BY id")]
+    archived = [row[0] for row in db.execute("SELECT id FROM archive.flits ORDER BY id")]
+    tagged = [row[0] for row in db.execute("SELECT flit_id FROM flit_hashtags ORDER BY flit_id")]
+    return hot, archived, tagged
+
+
+def test_moves_old_flits_in_batches(flits):
+    logged = []
+    assert archive.archive_before("2010-01-01", batch=2, pause=0, log=logged.append, limit=3) == 3
+    hot, archived, tagged = hot_and_archived()
+    assert archived == flits[:3] and hot == tagged == flits[3:]
+
+    # A batch copied but not yet deleted, as after a crash between the two
+    db = sqlite3.connect("tweetor.db")
+    db.execute("ATTACH DATABASE 'tweetor_archive.db' AS archive")
+    db.execute("INSERT INTO archive.flits SELECT * FROM main.flits WHERE id = ?", (flits[3],))
+    db.commit()
+    db.close()
+
+    assert archive.archive_before("2010-01-01", batch=2, pause=0, log=logged.append) == 3
+    hot, archived, tagged = hot_and_archived()
+    assert archived == flits[:6] and hot == tagged == flits[6:]
+    assert archive.archive_before("2010-01-01", batch=2, pause=0, log=logged.append) == 0
+
+
+def test_lookups_fall_through_to_the_archive(flits):
+    assert archive.archive_before("2010-01-01", batch=4, pause=0, log=lambda *a: None) == 6
+    flit_cache.clear()
+
+    flit = storage.flit(flits[0])
+    assert flit["content"] == "flit 0 #tag"
+    assert "ip" not in flit.keys()
+    assert storage.flit(flits[9])["content"] == "flit 9 #tag"
+
+    hot, total, oldest = storage.user_flit_stats("alice")
+    assert (hot, total, oldest) == (4, 10, "2000-01-01 00:00:00")
+    # Newest first, a page running from the hot table into the archive
+    page = storage.user_flits("alice", 3, 3, hot)
+    assert [row["id"] for row in page] == [flits[6], flits[5], flits[4]]
+    assert "ip" not in page[0].keys() and "ip" not in page[-1].keys()
+    page = storage.user_flits("alice", 3, 6, hot)
+    assert [row["id"] for row in page] == [flits[3], flits[2], flits[1]]
@@ -0,0 +1,67 @@
+import os
+import re
+
+import pytest
+
+import assets
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+YEAR = 365 * 24 * 3600
+
+
+@pytest.fixture
+def tweetor(app_dir):
+    assets.build(os.path.join(ROOT, "static"), str(app_dir / "static_build"))
+    assets.load(str(app_dir / "static_build"))
+    import app as tweetor
+
+    yield tweetor
+    assets.manifest = None
+    assets.build_dir = assets.BUILD_DIR
+
+
+def page_assets(client, path):
+    html = re.sub(r"<!--.*?-->", "", client.get(path).get_data(as_text=True), flags=re.S)
+    return sorted(set(re.findall(r'(?:href|src)="(/static/[^"]+)"', html)))
+
+
+def test_page_view(tweetor):
+    client = tweetor.app.test_client()
+    urls = page_assets(client, "/login")
+    logical = {hashed: name for name, hashed in assets.manifest.items()}
+    assert urls, "the layout links its CSS, JS, logo and sound"
+    assert all(url[len("/static/"):] in assets.hashed_names for url in urls)
+
+    # First view: each asset once, text compressed
+    sent = original = 0
+    for url in urls:
+        response = client.get(url, headers={"Accept-Encoding": "gzip, deflate"})
+        assert response.status_code == 200
+        assert response.cache_control.max_age == YEAR
+        assert response.cache_control.immutable
+        sent += len(response.data)
+        original += os.path.getsize(os.path.join(ROOT, "static", logical[url[len("/static/"):]]))
+        if url.endswith((".css", ".js")) and os.path.exists(os.path.join(assets.build_dir, url[len("/static/"):] + ".gz")):
+            assert response.content_encoding == "gzip"
+            assert "Accept-Encoding" in response.vary
+    assert sent < original
+
+    # Repeat view: nothing left to fetch or revalidate, where unhashed
+    # files were revalidated on every page
+    revalidated = [url for url in urls if not client.get(url).cache_control.immutable]
+    assert revalidated == []
+    assert not client.get("/static/styles.css").cache_control.immutable
+
+
+def test_identity_and_range(tweetor):
+    client = tweetor.app.test_client()
+    css = "/static/" + assets.manifest["styles.css"]
+    response = client.get(css)
+    assert response.content_encoding is None
+    assert len(response.data) == os.path.getsize(os.path.join(ROOT, "static", "styles.css"))
+
+    sound = "/static/" + assets.manifest["notification.mp3"]
+    response = client.get(sound, headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.content_range.start == 100
+    assert len(response.data) == 100
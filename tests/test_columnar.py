@@ -0,0 +1,56 @@
+import pytest
+
+import storage
+
+
+@pytest.fixture
+def client(app_dir):
+    import app as tweetor
+
+    tweetor.app.config["WTF_CSRF_ENABLED"] = False
+    tweetor.limiter.enabled = False
+    first = storage.insert_flit("alice", "Alice", "hello #music", "", None, "127.0.0.1")
+    storage.insert_flit("bob", "Bob", "a gif #music", "https://example.com/cat.gif", None, "127.0.0.1")
+    storage.insert_flit("alice", "Alice", "", "", first, "127.0.0.1")
+    return tweetor.app.test_client()
+
+
+def decode(page):
+    """What flitRenderer.js's decodeFlits() makes of a columnar page."""
+    columns, strings = page["columns"], page["strings"]
+    return [
+        {
+            "id": columns["id"][i],
+            "content": columns["content"][i],
+            "timestamp": columns["timestamp"][i],
+            "userHandle": strings[columns["userHandle"][i]],
+            "username": strings[columns["username"][i]],
+            "is_reflit": columns["is_reflit"][i],
+            "original_flit_id": columns["original_flit_id"].get(str(i), -1),
+            "meme_link": columns["meme_link"].get(str(i), ""),
+        }
+        for i in range(page["count"])
+    ]
+
+
+@pytest.mark.parametrize("path", ["/api/get_flits?skip=0&limit=10", "/api/hashtag/music?limit=10"])
+def test_same_flits_as_the_default_format(client, path):
+    rows = client.get(path).get_json()
+    page = client.get(path + "&format=columnar").get_json()
+    for row in rows:
+        del row["hashtag"]
+    assert decode(page) == rows
+
+    # Handles and names are sent once, empty columns only where set
+    assert sorted(page["strings"]) == ["Alice", "Bob", "alice", "bob"]
+    assert len(page["columns"]["meme_link"]) == 1
+
+
+def test_reflits_and_empty_pages(client):
+    page = client.get("/api/get_flits?skip=0&limit=10&format=columnar").get_json()
+    assert page["columns"]["is_reflit"] == [1, 0, 0]
+    assert page["columns"]["original_flit_id"] == {"0": page["columns"]["id"][2]}
+
+    assert client.get("/api/get_flits?skip=10&limit=10&format=columnar").get_json() == {
+        "count": 0, "strings": [], "columns": {}
+    }
@@ -0,0 +1,89 @@
+import sqlite3
+
+import pytest
+
+import deletions
+
+BUSY_FLITS = 1000
+
+
+@pytest.fixture
+def tweetor(app_dir, monkeypatch):
+    db = sqlite3.connect("tweetor.db")
+    db.executemany(
+        "INSERT INTO users (username, password, handle, turbo) VALUES (?, '', ?, 0)",
+        [(handle, handle) for handle in ("busy", "friend")],
+    )
+    flits = "INSERT INTO flits (content, userHandle, username, hashtag, profane_flit, ip) VALUES (?, ?, ?, '', 'no', '')"
+    db.executemany(flits, ((f"flit {i}", "busy", "busy") for i in range(BUSY_FLITS)))
+    # The feed's newest page is the busy user's until they are hidden
+    db.executemany(flits, ((f"friend {i}", "friend", "friend") for i in range(1000)))
+    db.executemany(flits, ((f"late {i}", "busy", "busy") for i in range(1000)))
+    db.executemany(
+        "INSERT INTO direct_messages (sender_handle, receiver_handle, content, profane_dm) VALUES (?, ?, 'hi', 'no')",
+        [("busy", "friend"), ("friend", "busy"), ("friend", "admin")] * 1000,
+    )
+    db.execute("INSERT INTO blocks (blocker_handle, blocked_handle) VALUES ('friend', 'busy')")
+    db.execute("INSERT INTO reported_flits (flit_id, reporter_handle, reason) VALUES (1, 'friend', 'spam')")
+    db.execute("INSERT INTO reported_flits (flit_id, reporter_handle, reason) VALUES (?, 'busy', 'spam')", (BUSY_FLITS + 1,))
+    db.commit()
+    db.close()
+
+    import app as tweetor
+
+    tweetor.app.config["WTF_CSRF_ENABLED"] = False
+    tweetor.limiter.enabled = False
+    # The test runs the job itself, a batch at a time
+    monkeypatch.setattr(deletions, "start", lambda: None)
+    monkeypatch.setattr(deletions, "BATCH", 100)
+    monkeypatch.setattr(deletions, "PAUSE", 0)
+    return tweetor
+
+
+def count(sql, *params):
+    db = sqlite3.connect("tweetor.db")
+    try:
+        return db.execute(sql, params).fetchone()[0]
+    finally:
+        db.close()
+
+
+def test_delete_busy_user_in_background(tweetor, monkeypatch):
+    client = tweetor.app.test_client()
+    with client.session_transaction() as session:
+        session["handle"] = session["username"] = "admin"
+    response = client.post("/delete_user", data={"user_handle": "busy"})
+    assert response.status_code == 302
+
+    # Hidden straight away, long before the cascade is done
+    feed = client.get("/api/get_flits?skip=0&limit=10").get_json()
+    assert count("SELECT count(*) FROM flits WHERE userHandle = 'busy'") == BUSY_FLITS + 1000
+    assert [flit["userHandle"] for flit in feed] == ["friend"] * 10
+    assert client.get("/flits/1").status_code == 302
+
+    # Each batch is its own transaction of at most BATCH rows, and the busy
+    # user stays hidden between them
+    delete_batch = deletions.delete_batch
+    batches = []
+
+    def checked_batch(db, job_id, table, rowids):
+        assert len(rowids) <= deletions.BATCH
+        feed = client.get("/api/get_flits?skip=0&limit=10").get_json()
+        assert [flit["userHandle"] for flit in feed] == ["friend"] * 10
+        assert client.get(f"/api/flit?flit_id={BUSY_FLITS + 1001}").data == b"profane"
+        batches.append(table)
+        return delete_batch(db, job_id, table, rowids)
+
+    monkeypatch.setattr(deletions, "delete_batch", checked_batch)
+    assert deletions.run_pending(sqlite3.connect("tweetor.db", isolation_level=None)) == 1
+    assert batches.count("flits") == (BUSY_FLITS + 1000) // deletions.BATCH
+    assert batches.count("direct_messages") == 2000 // deletions.BATCH
+
+    assert count("SELECT count(*) FROM flits WHERE userHandle = 'busy'") == 0
+    assert count("SELECT count(*) FROM flits WHERE userHandle = 'friend'") == 1000
+    assert count("SELECT count(*) FROM direct_messages WHERE 'busy' IN (sender_handle, receiver_handle)") == 0
+    assert count("SELECT count(*) FROM direct_messages") == 1000
+    assert count("SELECT count(*) FROM blocks") == 0
+    assert count("SELECT count(*) FROM reported_flits") == 0
+    assert count("SELECT count(*) FROM user_last_flit WHERE handle = 'busy'") == 0
+    assert count("SELECT deleted FROM deletion_jobs WHERE target = 'busy'") == BUSY_FLITS + 1000 + 2000 + 1 + 1
@@ -0,0 +1,106 @@
+import json
+import sqlite3
+
+import pytest
+
+import dm_channel
+
+
+class FakeSocket:
+    """Enough of geventwebsocket's WebSocket: frames in, frames out."""
+
+    def __init__(self, incoming=()):
+        self.incoming = [json.dumps(frame) if not isinstance(frame, str) else frame for frame in incoming]
+        self.sent = []
+        self.closed = False
+
+    def receive(self):
+        return self.incoming.pop(0) if self.incoming else None
+
+    def send(self, raw):
+        self.sent.append(json.loads(raw))
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def dms(app_dir):
+    db = sqlite3.connect("tweetor.db")
+    db.executemany(
+        "INSERT INTO direct_messages (sender_handle, receiver_handle, content, profane_dm) VALUES (?, ?, ?, ?)",
+        [
+            ("bob", "alice", "one", "no"),
+            ("bob", "alice", "rude", "yes"),
+            ("alice", "bob", "two", "no"),
+            ("carol", "alice", "elsewhere", "no"),
+            ("bob", "alice", "three", "no"),
+        ],
+    )
+    db.commit()
+    db.close()
+
+
+def contents(ws):
+    return [frame["message"]["content"] for frame in ws.sent if frame["type"] == "message"]
+
+
+def test_resume_replays_the_conversation_after_last_id(dms):
+    ws = FakeSocket()
+    subscriber = dm_channel.Subscriber(ws, "alice", "bob", [])
+    subscriber.resume(0)
+    assert contents(ws) == ["one", "two", "three"]
+    assert subscriber.last_id == 5
+
+    ws.sent.clear()
+    dm_channel.Subscriber(ws, "alice", "bob", []).resume(1)
+    assert contents(ws) == ["two", "three"]
+
+    # Messages from someone alice blocked are never sent to her
+    ws.sent.clear()
+    dm_channel.Subscriber(ws, "alice", "bob", ["bob"]).resume(0)
+    assert contents(ws) == ["two"]
+
+
+def test_publish_pushes_once_to_the_conversation(dms):
+    alice, bob, carol = FakeSocket(), FakeSocket(), FakeSocket()
+    subscribers = [
+        dm_channel.Subscriber(alice, "alice", "bob", []),
+        dm_channel.Subscriber(bob, "bob", "alice", []),
+        dm_channel.Subscriber(carol, "carol", "alice", []),
+    ]
+    for subscriber in subscribers:
+        dm_channel.subscribers[dm_channel.conversation_key(subscriber.handle, subscriber.partner_handle)].add(subscriber)
+    try:
+        message = {"id": 6, "sender_handle": "bob", "receiver_handle": "alice", "content": "four", "timestamp": ""}
+        dm_channel.publish(dict(message, profane_dm="no"))
+        dm_channel.publish(dict(message, id=7, content="rude again", profane_dm="yes"))
+        assert contents(alice) == contents(bob) == ["four"]
+        assert "profane_dm" not in alice.sent[0]["message"]
+        assert contents(carol) == []
+
+        # Catching up from the database doesn't send it again
+        subscribers[0].resume(5)
+        assert contents(alice) == ["four"]
+    finally:
+        for subscriber in subscribers:
+            dm_channel.unsubscribe(subscriber)
+    assert not dm_channel.subscribers
+
+
+@pytest.mark.parametrize("last_id,expected", [(3, 3), ("3", 3), (None, 0), ("3abc", None), ([3], None), (True, None)])
+def test_last_id_of(last_id, expected):
+    assert dm_channel.last_id_of({"type": "resume", "last_id": last_id}) == expected
+
+
+def test_socket_answers_bad_frames_with_an_error(dms):
+    import app as tweetor
+
+    ws = FakeSocket(["not json", [1, 2], {"type": "resume", "last_id": "abc"}, {"type": "resume", "last_id": 4}])
+    client = tweetor.app.test_client()
+    with client.session_transaction() as session:
+        session["username"] = session["handle"] = "alice"
+    client.get("/ws/dm/bob", base_url="ws://localhost", environ_overrides={"wsgi.websocket": ws})
+
+    assert ws.sent[0] == {"type": "error", "error": "last_id must be a whole number."}
+    assert contents(ws) == ["three"]
@@ -0,0 +1,114 @@
+import sqlite3
+
+import pytest
+
+import dump
+
+FLITS_SCHEMA = """
+    CREATE TABLE flits (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        content TEXT,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        profane_flit TEXT,
+        userHandle TEXT NOT NULL,
+        username TEXT NOT NULL,
+        hashtag TEXT NOT NULL,
+        ip TEXT NOT NULL
+    )
+"""
+
+
+def make_db(path, flits):
+    db = sqlite3.connect(path)
+    db.execute(FLITS_SCHEMA)
+    db.execute("CREATE INDEX flits_user_timestamp ON flits (userHandle, timestamp)")
+    db.execute("CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, handle TEXT UNIQUE NOT NULL)")
+    db.executemany("INSERT INTO users (handle) VALUES (?)", [(f"user{i}",) for i in range(100)])
+    db.executemany(
+        "INSERT INTO flits (content, timestamp, profane_flit, userHandle, username, hashtag, ip) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (
+            (f"flit number {i} with \"quotes\" and ünïcode", f"2024-01-01 00:{i // 60 % 60:02d}:{i % 60:02d}",
+             "no", f"user{i % 100}", f"user{i % 100}", "", "127.0.0.1")
+            for i in range(flits)
+        ),
+    )
+    db.commit()
+    db.close()
+
+
+def rows(path, table):
+    db = sqlite3.connect(path)
+    try:
+        return db.execute(f"SELECT * FROM {table} ORDER BY id").fetchall()
+    finally:
+        db.close()
+
+
+def quiet(*args):
+    pass
+
+
+@pytest.mark.parametrize("format", ["ndjson", "columnar"])
+def test_round_trip(tmp_path, format, monkeypatch):
+    monkeypatch.setattr(dump, "CHUNK", 1000)
+    source, target = str(tmp_path / "source.db"), str(tmp_path / "target.db")
+    make_db(source, 5000)
+
+    dump.export_dump(source, str(tmp_path / "out"), ["users", "flits"], format, log=quiet)
+    assert dump.import_dump(str(tmp_path / "out"), target, ["users", "flits"], log=quiet) == 5100
+
+    assert rows(target, "flits") == rows(source, "flits")
+    assert rows(target, "users") == rows(source, "users")
+    db = sqlite3.connect(target)
+    indexes = {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert "flits_user_timestamp" in indexes
+    assert not db.execute("SELECT 1 FROM sqlite_master WHERE name = 'import_checkpoint'").fetchone()
+    db.close()
+
+
+@pytest.mark.parametrize("format", ["ndjson", "columnar"])
+def test_resume_after_failure(tmp_path, format, monkeypatch):
+    monkeypatch.setattr(dump, "CHUNK", 700)
+    monkeypatch.setattr(dump, "BATCH", 1000)
+    source, target = str(tmp_path / "source.db"), str(tmp_path / "target.db")
+    make_db(source, 5000)
+    dump.export_dump(source, str(tmp_path / "out"), ["flits"], format, log=quiet)
+
+    write_batch = dump.write_batch
+    calls = []
+
+    def failing(db, *args):
+        calls.append(args)
+        if len(calls) == 3:
+            raise KeyboardInterrupt
+        write_batch(db, *args)
+
+    monkeypatch.setattr(dump, "write_batch", failing)
+    with pytest.raises(KeyboardInterrupt):
+        dump.import_dump(str(tmp_path / "out"), target, ["flits"], log=quiet)
+    assert len(rows(target, "flits")) == 2800
+
+    monkeypatch.setattr(dump, "write_batch", write_batch)
+    assert dump.import_dump(str(tmp_path / "out"), target, ["flits"], log=quiet) == 2200
+    assert rows(target, "flits") == rows(source, "flits")
+
+
+
+@pytest.mark.parametrize("format", ["ndjson", "columnar"])
+def test_without_rowid_and_missing_tables(tmp_path, format):
+    source, target = str(tmp_path / "source.db"), str(tmp_path / "target.db")
+    db = sqlite3.connect(source)
+    db.execute("CREATE TABLE flit_hashtags (tag TEXT NOT NULL, flit_id INTEGER NOT NULL, PRIMARY KEY (tag, flit_id)) WITHOUT ROWID")
+    db.executemany("INSERT INTO flit_hashtags VALUES (?, ?)", [("b", 1), ("a", 2), ("a", 1)])
+    db.commit()
+    db.close()
+
+    logged = []
+    dump.export_dump(source, str(tmp_path / "out"), ["flit_hashtags", "notifications"], format, log=logged.append)
+    assert any(line.startswith("notifications: not in") for line in logged)
+    assert dump.import_dump(str(tmp_path / "out"), target, ["flit_hashtags", "notifications"], log=quiet) == 3
+
+    db = sqlite3.connect(target)
+    assert db.execute("SELECT tag, flit_id FROM flit_hashtags").fetchall() == [("a", 1), ("a", 2), ("b", 1)]
+    assert not db.execute("SELECT 1 FROM sqlite_master WHERE name = 'notifications'").fetchone()
+    db.close()
@@ -0,0 +1,123 @@
+import sqlite3
+
+import pytest
+
+import flit_cache
+import storage
+
+
+@pytest.fixture
+def tweetor(app_dir):
+    import app as tweetor
+
+    tweetor.app.config["WTF_CSRF_ENABLED"] = False
+    tweetor.limiter.enabled = False
+    return tweetor
+
+
+def post(content, handle="alice", reply_to=None):
+    return storage.insert_flit(handle, handle, content, "", None, "127.0.0.1", reply_to)
+
+
+def lookups():
+    return flit_cache.hits, flit_cache.misses
+
+
+def test_hits_and_missing_ids(tweetor):
+    gone = post("gone")
+    sqlite3.connect("tweetor.db", isolation_level=None).execute("DELETE FROM flits WHERE id = ?", (gone,))
+    flit_id = post("hello")
+    hits, misses = lookups()
+    flit = storage.flit(flit_id)
+    assert storage.flit(flit_id) is flit
+    assert lookups() == (hits + 1, misses + 1)
+
+    # Still reads like a row, without the poster's ip
+    assert flit["content"] == flit[1] == "hello"
+    assert dict(flit)["userHandle"] == "alice" and "ip" not in dict(flit)
+    assert tweetor.app.test_client().get(f"/api/flit?flit_id={flit_id}").get_json()["flit"]["content"] == "hello"
+
+    assert storage.flit(gone) is None
+    assert storage.flit(gone) is None
+    assert lookups() == (hits + 3, misses + 2)
+
+    # Past the newest flit it knows, a missing id may be about to be posted
+    assert storage.flit(flit_id + 1) is None
+    assert storage.flit(flit_id + 1) is None
+    assert lookups() == (hits + 3, misses + 4)
+
+
+def test_new_flit_replaces_a_cached_miss(tweetor, monkeypatch):
+    first = post("first")
+    assert storage.flit(first)["content"] == "first"
+    # As if the next id had been looked up before its insert committed
+    monkeypatch.setattr(flit_cache, "highest", 10**9)
+    assert storage.flit(first + 1) is None
+    assert flit_cache.get(first + 1) is None
+
+    assert post("second") == first + 1
+    assert storage.flit(first + 1)["content"] == "second"
+
+
+def test_writes_in_this_worker_invalidate(tweetor):
+    import deletions
+    import moderation
+
+    root = post("root")
+    reply = post("reply", reply_to=root)
+    profane = post("profane", handle="bob")
+    sqlite3.connect("tweetor.db", isolation_level=None).execute(
+        "UPDATE flits SET profane_flit = 'yes' WHERE id = ?", (profane,)
+    )
+    assert storage.flit(root)["reply_count"] == 1
+    assert storage.flit(profane)["profane_flit"] == "yes"
+
+    post("another reply", handle="bob", reply_to=root)
+    assert storage.flit(root)["reply_count"] == 2
+    moderation.dismiss_reports([profane])
+    assert storage.flit(profane)["profane_flit"] == "no"
+
+    deletions.delete_flits([reply])
+    assert storage.flit(reply) is None
+    assert storage.flit(root)["reply_count"] == 1
+    deletions.delete_user("bob")
+    assert storage.flit(profane) is None
+
+
+def test_other_workers_deletions_are_polled(tweetor, monkeypatch):
+    flit_id = post("hello")
+    assert storage.flit(flit_id) is not None
+
+    # Another worker deletes it
+    db = sqlite3.connect("tweetor.db", isolation_level=None)
+    db.execute("DELETE FROM flits WHERE id = ?", (flit_id,))
+    db.execute("INSERT INTO deletion_jobs (kind, target, finished_at) VALUES ('flit', ?, CURRENT_TIMESTAMP)", (flit_id,))
+    assert storage.flit(flit_id) is not None
+
+    monkeypatch.setattr(flit_cache, "_last_poll", 0.0)
+    assert storage.flit(flit_id) is None
+
+
+def test_bounded_and_off(tweetor, monkeypatch):
+    ids = [post(f"flit {i}") for i in range(20)]
+    monkeypatch.setattr(flit_cache, "max_bytes", 5 * flit_cache.size_of(storage.flit(ids[0])))
+    flit_cache.clear()
+    for flit_id in ids:
+        storage.flit(flit_id)
+    assert 0 < flit_cache._size <= flit_cache.max_bytes
+    assert list(flit_cache._cache) == ids[-len(flit_cache._cache) :]
+
+    monkeypatch.setattr(flit_cache, "max_bytes", 0)
+    flit_cache.clear()
+    assert storage.flit(ids[0])["content"] == "flit 0"
+    assert not flit_cache._cache
+
+
+def test_metrics(tweetor):
+    storage.flit(post("hello"))
+    client = tweetor.app.test_client()
+    with client.session_transaction() as session:
+        session["handle"] = "admin"
+    body = client.get("/metrics").data.decode()
+    assert f"tweetor_flit_cache_misses_total {flit_cache.misses}" in body
+    assert f"tweetor_flit_cache_bytes {flit_cache._size}" in body
@@ -0,0 +1,69 @@
+import pytest
+
+import fragments
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setattr(fragments, "_cache", fragments.collections.OrderedDict())
+    monkeypatch.setattr(fragments, "_size", 0)
+    return fragments._cache
+
+
+def flit(**fields):
+    row = {
+        "id": 1, "content": "hello", "username": "Alice", "userHandle": "alice", "timestamp": "2024-01-01 00:00:00",
+        "meme_link": "", "is_reflit": 0, "original_flit_id": -1, "profane_flit": "no", "reply_count": 0,
+    }
+    row.update(fields)
+    return row
+
+
+def test_evicts_least_recently_used_by_bytes(cache, monkeypatch):
+    monkeypatch.setattr(fragments, "max_bytes", 30)
+    for i in range(3):
+        fragments.put((i, 0), "x" * 10)
+    assert fragments._size == 30
+
+    # Reading 0 makes 1 the least recently used
+    assert fragments.get((0, 0)) == "x" * 10
+    fragments.put((3, 0), "y" * 10)
+    assert list(cache) == [(2, 0), (0, 0), (3, 0)]
+    assert fragments.get((1, 0)) is None
+
+    # Counted in bytes, not characters, and one big entry evicts several
+    fragments.put((4, 0), "é" * 10)
+    assert list(cache) == [(3, 0), (4, 0)] and fragments._size == 30
+
+    # Too big to cache at all
+    fragments.put((5, 0), "z" * 31)
+    assert fragments.get((5, 0)) is None and list(cache) == [(3, 0), (4, 0)]
+
+
+def test_version_follows_rendered_fields(cache):
+    base = fragments.version(flit())
+    for field, value in [
+        ("content", "edited"), ("username", "Alicia"), ("timestamp", "2024-01-02 00:00:00"),
+        ("meme_link", "https://example.com/cat.gif"), ("is_reflit", 1), ("original_flit_id", 7),
+    ]:
+        assert fragments.version(flit(**{field: value})) != base, field
+    # Fields the fragment doesn't show don't invalidate it
+    assert fragments.version(flit(reply_count=3)) == base
+    # A reflit's version covers its original too
+    original = flit(id=7, content="original")
+    reflit = flit(id=8, is_reflit=1, original_flit_id=7)
+    assert fragments.version(reflit, original) != fragments.version(reflit, flit(id=7, content="moderated"))
+
+
+def test_rerenders_after_an_edit(cache):
+    import app as tweetor
+
+    with tweetor.app.test_request_context():
+        assert "hello" in fragments.render_flit(flit())
+        assert "hello" in fragments.render_flit(flit())
+        assert len(cache) == 1
+        assert "edited" in fragments.render_flit(flit(content="edited"))
+        assert len(cache) == 2
+
+        fragments.discard([1])
+        assert not cache and fragments._size == 0
@@ -0,0 +1,99 @@
+import sqlite3
+
+import pytest
+
+import hashtags
+import helpers
+import storage
+
+
+@pytest.fixture
+def tweetor(app_dir, monkeypatch):
+    monkeypatch.setattr(hashtags, "window", hashtags.Window())
+    monkeypatch.setattr(hashtags, "last_flit_id", None)
+    import app as tweetor
+
+    return tweetor
+
+
+def post(tweetor, handle, content):
+    return storage.insert_flit(handle, handle, content, "", None, "127.0.0.1")
+
+
+def test_extract():
+    assert hashtags.extract("#Tweetor and #tweetor, #gaming! no#tag #ünïcode") == ["tweetor", "gaming", "tag", "ünïcode"]
+    assert hashtags.extract("no tags") == []
+    assert len(hashtags.extract(" ".join(f"#t{i}" for i in range(20)))) == hashtags.MAX_TAGS
+
+
+def test_timeline_and_trending(tweetor):
+    ids = [post(tweetor, "alice", f"post {i} #Music") for i in range(25)]
+    post(tweetor, "bob", "#gaming #music")
+    post(tweetor, "bob", "#gaming again")
+    client = tweetor.app.test_client()
+
+    first = client.get("/api/hashtag/music?limit=10").get_json()
+    assert len(first) == 10 and first[0]["userHandle"] == "bob"
+    second = client.get(f"/api/hashtag/MUSIC?limit=10&before={first[-1]['id']}").get_json()
+    assert [flit["id"] for flit in second] == ids[::-1][9:19]
+
+    assert client.get("/api/trending?limit=2").get_json() == [
+        {"tag": "music", "count": 26},
+        {"tag": "gaming", "count": 2},
+    ]
+
+    # New posts are picked up by the next poll
+    post(tweetor, "carol", "#gaming #gaming #new")
+    hashtags.last_poll = 0
+    assert hashtags.trending(3) == [("music", 26), ("gaming", 3), ("new", 1)]
+
+    # Deleted flits leave their tags' timelines
+    tweetor.deletions.delete_flits(ids[-5:])
+    assert len(client.get("/api/hashtag/music?limit=100").get_json()) == 21
+
+
+def test_window_expiry():
+    window = hashtags.Window(minutes=60)
+    window.add("old", 1000, 1000)
+    window.add("new", 1030, 1030)
+    window.add("new", 1040, 1040)
+    assert window.top(5) == [("new", 2), ("old", 1)]
+    window.expire(1061)
+    assert window.top(5) == [("new", 2)]
+    window.expire(1100)
+    assert window.top(5) == []
+
+
+def test_backfill(app_dir, monkeypatch):
+    db = sqlite3.connect(helpers.DATABASE)
+    db.executemany(
+        "INSERT INTO flits (username, content, userHandle, hashtag, profane_flit, is_reflit, original_flit_id, ip) VALUES ('a', ?, 'a', '', 'no', 0, -1, '')",
+        [(f"flit {i} #even" if i % 2 == 0 else f"flit {i} #odd #Odd",) for i in range(1000)],
+    )
+    db.commit()
+    db.close()
+    # Stopped partway through, during its third batch
+    executemany = sqlite3.Connection.executemany
+    batches = []
+
+    class Stopping(sqlite3.Connection):
+        def executemany(self, *args):
+            batches.append(args)
+            if len(batches) == 3:
+                raise KeyboardInterrupt
+            return executemany(self, *args)
+
+    connect = sqlite3.connect
+    with monkeypatch.context() as patch, pytest.raises(KeyboardInterrupt):
+        patch.setattr(sqlite3, "connect", lambda *args, **kwargs: connect(*args, factory=Stopping, **kwargs))
+        hashtags.backfill(batch=300, pause=0, log=lambda _: None)
+
+    # The rerun starts after the last batch that committed
+    assert hashtags.backfill(batch=300, pause=0, log=lambda _: None) == 400
+    assert hashtags.backfill(batch=300, pause=0, log=lambda _: None) == 0
+    db = sqlite3.connect(helpers.DATABASE)
+    assert db.execute("SELECT tag, count(*) FROM flit_hashtags GROUP BY tag").fetchall() == [("even", 500), ("odd", 500)]
+
+    # --after 0 parses every flit again; their rows are already there
+    assert hashtags.backfill(batch=300, pause=0, log=lambda _: None, after=0) == 1000
+    assert db.execute("SELECT count(*) FROM flit_hashtags").fetchone()[0] == 1000
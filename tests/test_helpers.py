@@ -0,0 +1,41 @@
+import sqlite3
+
+import pytest
+
+import helpers
+
+
+class TrackedConnection(sqlite3.Connection):
+    closed = False
+
+    def close(self):
+        self.closed = True
+        super().close()
+
+
+def test_write_transaction_closes_db_when_begin_fails(app_dir, monkeypatch):
+    opened = []
+
+    def get_db():
+        db = sqlite3.connect("tweetor.db", factory=TrackedConnection, timeout=0)
+        opened.append(db)
+        return db
+
+    monkeypatch.setattr(helpers, "get_db", get_db)
+    # Another writer holds the lock, so BEGIN IMMEDIATE fails straight away
+    other = sqlite3.connect("tweetor.db", isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    with pytest.raises(sqlite3.OperationalError, match="locked"):
+        helpers.write_transaction(lambda cursor: None)
+    assert opened[0].closed
+    other.execute("ROLLBACK")
+
+    # A failing f rolls back its own writes and closes db too
+    def fail(cursor):
+        cursor.execute("INSERT INTO blocks (blocker_handle, blocked_handle) VALUES ('a', 'b')")
+        raise ValueError
+
+    with pytest.raises(ValueError):
+        helpers.write_transaction(fail)
+    assert opened[1].closed
+    assert other.execute("SELECT count(*) FROM blocks").fetchone()[0] == 0
@@ -0,0 +1,91 @@
+import pytest
+from flask import Flask, render_template_string
+
+import helpers
+import metrics
+
+
+@pytest.fixture
+def histograms(monkeypatch):
+    """Fresh, empty copies of the histograms and collected values."""
+    for name in ("request_seconds", "sql_queries", "sql_seconds", "template_seconds"):
+        old = getattr(metrics, name)
+        monkeypatch.setattr(metrics, name, metrics.Histogram(old.name, old.help, old.label, old.buckets))
+    monkeypatch.setattr(metrics, "COLLECTED", [])
+
+
+def sampled_app():
+    app = Flask(__name__)
+
+    @app.route("/query")
+    def query():
+        db = helpers.get_db()
+        db.execute("SELECT 1").fetchone()
+        db.execute("SELECT 2").fetchone()
+        db.close()
+        return render_template_string("{{ 1 + 1 }}")
+
+    metrics.init_app(app)
+    return app
+
+
+def test_sampled_requests_are_timed(app_dir, histograms, monkeypatch):
+    monkeypatch.setattr(metrics, "sample_rate", 1.0)
+    client = sampled_app().test_client()
+    assert client.get("/query").data == b"2"
+    assert client.get("/query").data == b"2"
+
+    assert metrics.request_seconds.series["query"][-1] == 2
+    assert metrics.sql_queries.series["query"][-2] == 4
+    assert metrics.sql_seconds.series["query"][-2] > 0
+    assert metrics.template_seconds.series["inline"][-1] == 2
+
+
+def test_unsampled_requests_cost_nothing(app_dir, histograms, monkeypatch):
+    monkeypatch.setattr(metrics, "sample_rate", 0.0)
+    app = sampled_app()
+    assert app.test_client().get("/query").data == b"2"
+    # Off means the hooks aren't even installed
+    assert metrics.start_request not in app.before_request_funcs.get(None, [])
+    assert not metrics.request_seconds.series
+
+    monkeypatch.setattr(metrics, "sample_rate", 0.5)
+    monkeypatch.setattr(metrics.random, "random", lambda: 0.7)
+    assert sampled_app().test_client().get("/query").data == b"2"
+    assert not metrics.request_seconds.series
+
+
+def test_render(histograms):
+    histogram = metrics.Histogram("t_seconds", "Test.", "endpoint", (0.1, 1))
+    for value in (0.05, 0.5, 0.5, 5):
+        histogram.observe(value, 'a"b')
+    assert histogram.render() == [
+        "# HELP t_seconds Test.",
+        "# TYPE t_seconds histogram",
+        't_seconds_bucket{endpoint="a\\"b",le="0.1"} 1',
+        't_seconds_bucket{endpoint="a\\"b",le="1"} 3',
+        't_seconds_bucket{endpoint="a\\"b",le="+Inf"} 4',
+        't_seconds_sum{endpoint="a\\"b"} 6.05',
+        't_seconds_count{endpoint="a\\"b"} 4',
+    ]
+
+    value = [3]
+    metrics.collect("t_total", "Things.", "counter", lambda: value[0])
+    value[0] = 4
+    assert metrics.render().endswith("# HELP t_total Things.\n# TYPE t_total counter\nt_total 4\n")
+
+
+def test_endpoint_needs_the_admin_or_the_token(app_dir, monkeypatch):
+    import app as tweetor
+
+    client = tweetor.app.test_client()
+    assert client.get("/metrics").status_code == 403
+
+    monkeypatch.setattr(metrics, "token", "s3cret")
+    assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 403
+    response = client.get("/metrics", headers={"Authorization": "Bearer s3cret"})
+    assert response.status_code == 200 and b"tweetor_flit_cache_hits_total" in response.data
+
+    with client.session_transaction() as session:
+        session["handle"] = "admin"
+    assert client.get("/metrics").status_code == 200
@@ -0,0 +1,113 @@
+import sqlite3
+
+import pytest
+
+import helpers
+import storage
+import notifications
+
+
+@pytest.fixture
+def tweetor(app_dir, monkeypatch):
+    db = sqlite3.connect("tweetor.db")
+    db.executemany(
+        "INSERT INTO users (username, password, handle, turbo) VALUES (?, '', ?, 0)",
+        [(handle, handle) for handle in ("alice", "bob", "carol")],
+    )
+    db.execute("INSERT INTO blocks (blocker_handle, blocked_handle) VALUES ('carol', 'bob')")
+    db.commit()
+    db.close()
+    monkeypatch.setattr(notifications, "pending_reads", {})
+    import app as tweetor
+
+    return tweetor
+
+
+def post(tweetor, handle, content):
+    return storage.insert_flit(handle, handle, content, "", None, "127.0.0.1")
+
+
+def dm(tweetor, sender, receiver, content, profane="no"):
+    return storage.insert_dm(sender, receiver, content, profane)["id"]
+
+
+def signed_in(tweetor, handle):
+    client = tweetor.app.test_client()
+    with client.session_transaction() as session:
+        session["handle"] = session["username"] = handle
+    return client
+
+
+def test_fan_out(tweetor):
+    post(tweetor, "bob", "hi @alice @carol @nobody @bob @alice")
+    dm(tweetor, "bob", "alice", "psst")
+    dm(tweetor, "carol", "alice", "rude", profane="yes")
+
+    db = sqlite3.connect("tweetor.db")
+    rows = db.execute("SELECT handle, kind, actor_handle FROM notifications ORDER BY id").fetchall()
+    # Not the author, nobody who doesn't exist, and not carol, who blocks bob
+    assert rows == [("alice", "mention", "bob"), ("alice", "dm", "bob"), ("alice", "dm", "carol")]
+
+    client = signed_in(tweetor, "alice")
+    inbox = client.get("/api/notifications").get_json()
+    # The profane DM stays out until it is approved
+    assert inbox["unread"] == 2
+    assert [(n["kind"], n["content"]) for n in inbox["notifications"]] == [("dm", "psst"), ("mention", "hi @alice @carol @nobody @bob @alice")]
+    assert signed_in(tweetor, "bob").get("/api/notifications").get_json()["unread"] == 0
+    assert tweetor.app.test_client().get("/api/notifications").status_code == 401
+
+
+def test_blocked_senders(tweetor):
+    # carol blocks bob: his DM is stored but doesn't reach her inbox
+    dm(tweetor, "bob", "carol", "let me in")
+    db = sqlite3.connect("tweetor.db")
+    assert db.execute("SELECT count(*) FROM notifications WHERE handle = 'carol'").fetchone() == (0,)
+
+    # alice blocks bob after he wrote to her, and his rows drop out
+    dm(tweetor, "bob", "alice", "hello")
+    post(tweetor, "bob", "hi @alice")
+    client = signed_in(tweetor, "alice")
+    assert client.get("/api/notifications").get_json()["unread"] == 2
+    db.execute("INSERT INTO blocks (blocker_handle, blocked_handle) VALUES ('alice', 'bob')")
+    db.commit()
+    db.close()
+    inbox = client.get("/api/notifications").get_json()
+    assert inbox["unread"] == 0 and inbox["notifications"] == []
+    assert signed_in(tweetor, "carol").get("/api/notifications").get_json()["notifications"] == []
+
+
+def test_since_id_and_read_markers(tweetor):
+    client = signed_in(tweetor, "alice")
+    first = [dm(tweetor, "bob", "alice", f"dm {i}") for i in range(3)]
+    inbox = client.get("/api/notifications").get_json()
+    newest = inbox["notifications"][0]["id"]
+    assert inbox["unread"] == 3
+
+    # Polling with since_id returns only what is new, and the unread total
+    dm(tweetor, "bob", "alice", "one more")
+    inbox = client.get(f"/api/notifications?since_id={newest}").get_json()
+    assert [n["content"] for n in inbox["notifications"]] == ["one more"]
+    assert inbox["unread"] == 4
+
+    # Opening the inbox marks it read; the marker waits in memory for the
+    # scheduler's next flush, but counts as read here
+    assert b"one more" in client.get("/notifications").data
+    assert client.get("/api/notifications").get_json()["unread"] == 0
+    assert list(notifications.pending_reads) == ["alice"]
+    notifications.flush()
+    assert notifications.pending_reads == {}
+
+    dm(tweetor, "bob", "alice", "again")
+    client.get("/notifications")
+    assert client.get("/api/notifications").get_json()["unread"] == 0
+    notifications.flush()
+    db = sqlite3.connect("tweetor.db")
+    assert db.execute("SELECT last_read_id FROM notification_reads WHERE handle = 'alice'").fetchone()[0] > first[-1]
+    assert notifications.pending_reads == {}
+
+
+def test_inbox_is_an_index_range_read(tweetor):
+    db = sqlite3.connect("tweetor.db")
+    plan = " ".join(row[-1] for row in db.execute("EXPLAIN QUERY PLAN " + notifications.INBOX, ("alice", 0, 50)))
+    assert "SEARCH n USING INDEX notifications_handle (handle=? AND id>?)" in plan
+    assert "TEMP B-TREE" not in plan
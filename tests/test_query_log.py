@@ -0,0 +1,63 @@
+import pytest
+
+import helpers
+import query_log
+
+
+@pytest.mark.parametrize(
+    "sql,expected",
+    [
+        ("SELECT * FROM flits WHERE id = 42", "SELECT * FROM flits WHERE id = ?"),
+        ("SELECT * FROM flits WHERE id = ?", "SELECT * FROM flits WHERE id = ?"),
+        ("SELECT * FROM users WHERE handle = 'it''s me'", "SELECT * FROM users WHERE handle = ?"),
+        ("SELECT * FROM flits WHERE id IN (1, 2, 3)", "SELECT * FROM flits WHERE id IN (?...)"),
+        ("SELECT * FROM flits WHERE id IN (?,?,?,?)", "SELECT * FROM flits WHERE id IN (?...)"),
+        ("SELECT  x\n  FROM t1\tWHERE y > -1.5 ;", "SELECT x FROM t1 WHERE y > ?"),
+    ],
+)
+def test_fingerprint_normalizes_literals_and_lists(sql, expected):
+    assert query_log.fingerprint(sql) == expected
+
+
+@pytest.fixture
+def profiling(app_dir, monkeypatch):
+    monkeypatch.setattr(query_log, "enabled", True)
+    monkeypatch.setattr(query_log, "stats", {})
+    monkeypatch.setattr(query_log, "_last_save", float("inf"))
+    explained = []
+    explain = query_log.explain
+
+    def counting_explain(db, sql, params):
+        explained.append(sql)
+        return explain(db, sql, params)
+
+    monkeypatch.setattr(query_log, "explain", counting_explain)
+    return explained
+
+
+def test_plan_is_captured_once_per_fingerprint(profiling, monkeypatch):
+    # Every statement counts as slow
+    monkeypatch.setattr(query_log, "threshold_ms", 0.0)
+    db = helpers.get_db()
+    for flit_id in (1, 2, 3):
+        db.execute(f"SELECT content FROM flits WHERE id = {flit_id}").fetchall()
+    db.execute("SELECT content FROM flits WHERE id IN (?, ?)", (1, 2)).fetchall()
+    db.execute("SELECT content FROM flits WHERE id IN (?, ?, ?)", (1, 2, 3)).fetchall()
+    db.close()
+
+    assert profiling == ["SELECT content FROM flits WHERE id = 1", "SELECT content FROM flits WHERE id IN (?, ?)"]
+    entry = query_log.stats["SELECT content FROM flits WHERE id = ?"]
+    assert entry["count"] == 3 and entry["slow"] >= 3
+    assert any("flits" in step for step in entry["plan"])
+    assert query_log.stats["SELECT content FROM flits WHERE id IN (?...)"]["count"] == 2
+
+
+def test_fast_statements_are_counted_but_not_explained(profiling, monkeypatch):
+    monkeypatch.setattr(query_log, "threshold_ms", 10_000.0)
+    db = helpers.get_db()
+    db.execute("SELECT count(*) FROM flits").fetchone()
+    db.close()
+    assert profiling == []
+    entry = query_log.stats["SELECT count(*) FROM flits"]
+    assert entry["count"] == 1 and entry["slow"] == 0 and entry["plan"] is None
+    assert "SELECT count(*) FROM flits" in query_log.report()
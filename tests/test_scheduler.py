@@ -0,0 +1,94 @@
+import sqlite3
+import time
+
+import pytest
+
+import scheduler
+from sqlite_session import SQLiteSessionInterface
+
+
+@pytest.fixture
+def jobs(app_dir, monkeypatch):
+    monkeypatch.setattr(scheduler, "JOBS", {})
+    monkeypatch.setattr(scheduler, "leader_until", 0.0)
+    monkeypatch.setattr(scheduler, "next_renewal", 0.0)
+    return scheduler.JOBS
+
+
+def test_one_leader_until_its_lease_expires(jobs, monkeypatch):
+    now = time.time()
+    assert scheduler.acquire(now)
+    assert scheduler.acquire(now + 1)
+
+    # Another worker can't take it while it is renewed...
+    me = scheduler.holder
+    monkeypatch.setattr(scheduler, "holder", "other:1:abcd")
+    assert not scheduler.acquire(now + 2)
+    assert not scheduler.is_leader(now + 2)
+
+    # ...but can once it has expired
+    assert scheduler.acquire(now + 1 + scheduler.LEASE_SECONDS + 1)
+    monkeypatch.setattr(scheduler, "holder", me)
+    assert not scheduler.acquire(now + scheduler.LEASE_SECONDS + 3)
+
+
+def test_jobs_run_when_due_and_leader_runs_are_recorded(jobs, monkeypatch):
+    runs = []
+    scheduler.job(60, name="everywhere")(lambda: runs.append("everywhere"))
+    scheduler.job(60, leader_only=True, name="shared")(lambda: runs.append("shared"))
+
+    @scheduler.job(60, leader_only=True)
+    def broken():
+        raise ValueError("boom")
+
+    monkeypatch.setattr(scheduler, "JITTER", 0)
+    scheduler.tick()
+    assert runs == ["everywhere", "shared"]
+    scheduler.tick()
+    assert runs == ["everywhere", "shared"]
+
+    db = sqlite3.connect("tweetor.db")
+    rows = dict((row[0], row[1:]) for row in db.execute("SELECT name, runs, last_error FROM scheduled_jobs"))
+    assert rows == {"shared": (1, None), "broken": (1, "ValueError('boom')")}
+    assert jobs["broken"].next_run > time.time() + 50
+
+    # A worker that isn't the leader only runs its own jobs
+    monkeypatch.setattr(scheduler, "leader_until", 0.0)
+    monkeypatch.setattr(scheduler, "holder", "other:1:abcd")
+    for job in jobs.values():
+        job.next_run = 0
+    scheduler.tick()
+    assert runs == ["everywhere", "shared", "everywhere"]
+
+
+def test_new_leader_carries_on_the_schedule(jobs, monkeypatch):
+    monkeypatch.setattr(scheduler, "JITTER", 0)
+    scheduler.job(3600, leader_only=True, name="hourly")(lambda: None)
+    db = sqlite3.connect("tweetor.db")
+    db.execute("INSERT INTO scheduled_jobs (name, last_started, last_seconds, runs) VALUES ('hourly', ?, 0.1, 1)", (time.time() - 600,))
+    db.commit()
+
+    assert scheduler.acquire(time.time())
+    assert jobs["hourly"].next_run == pytest.approx(time.time() + 3000, abs=5)
+
+
+def test_app_housekeeping(app_dir, monkeypatch):
+    import app as tweetor
+
+    tweetor.create_app()
+    monkeypatch.setattr(tweetor, "online_users", {"alice": time.time_ns(), "bob": 0})
+    monkeypatch.setattr(tweetor, "used_captchas", {"fresh": time.time(), "stale": 0})
+    scheduler.JOBS["sweep_presence"].f()
+    scheduler.JOBS["forget_captchas"].f()
+    assert list(tweetor.online_users) == ["alice"]
+    assert list(tweetor.used_captchas) == ["fresh"]
+
+    # The leader expires sessions.db's rows, a batch per statement
+    assert scheduler.JOBS["expire_sessions"].f == tweetor.app.session_interface.expire
+    interface = SQLiteSessionInterface(expire_batch=2)
+    for i in range(6):
+        interface.execute(
+            "INSERT INTO sessions (sid, data, expiry) VALUES (?, '', ?)", (f"sid{i}", 1 if i < 5 else 2**40)
+        )
+    assert interface.expire() == 5
+    assert interface.execute("SELECT group_concat(sid) FROM sessions")[0] == ("sid5",)
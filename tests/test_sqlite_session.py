@@ -0,0 +1,123 @@
+import time
+
+import pytest
+from flask import Flask, session
+
+from sqlite_session import SQLiteSessionInterface
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.secret_key = "test"
+    app.session_interface = SQLiteSessionInterface(str(tmp_path / "sessions.db"))
+
+    @app.route("/plain")
+    def plain():
+        return "plain"
+
+    @app.route("/read")
+    def read():
+        return session.get("handle", "none")
+
+    @app.route("/login/<handle>")
+    def login(handle):
+        session["handle"] = handle
+        return "ok"
+
+    @app.route("/clear")
+    def clear():
+        session.clear()
+        return "cleared"
+
+    yield app
+    app.session_interface.close()
+
+
+def count_rows(app):
+    row, _ = app.session_interface.execute("SELECT COUNT(*) FROM sessions")
+    return row[0]
+
+
+def test_anonymous_request_has_no_cookie_or_vary(app):
+    client = app.test_client()
+    response = client.get("/plain")
+    assert "Set-Cookie" not in response.headers
+    assert "Cookie" not in response.vary
+    assert count_rows(app) == 0
+
+
+def test_login_stores_row_and_reads_back(app):
+    client = app.test_client()
+    response = client.get("/login/bob")
+    assert "session=" in response.headers["Set-Cookie"]
+    assert count_rows(app) == 1
+    assert client.get("/read").data == b"bob"
+
+
+def test_unmodified_session_skips_write(app):
+    client = app.test_client()
+    client.get("/login/bob")
+    statements = []
+    execute = app.session_interface.execute
+
+    def recording_execute(sql, params=()):
+        statements.append(sql.split()[0])
+        return execute(sql, params)
+
+    app.session_interface.execute = recording_execute
+    response = client.get("/read")
+    assert response.data == b"bob"
+    assert "Set-Cookie" not in response.headers
+    assert statements == ["SELECT"]
+
+
+def test_expired_row_with_cookie_present_starts_fresh(app):
+    client = app.test_client()
+    client.get("/login/bob")
+    app.session_interface.execute("UPDATE sessions SET expiry = ?", (int(time.time()) - 1,))
+    assert client.get("/read").data == b"none"
+
+
+def test_clear_deletes_row_and_cookie(app):
+    client = app.test_client()
+    client.get("/login/bob")
+    response = client.get("/clear")
+    assert "session=;" in response.headers["Set-Cookie"]
+    assert count_rows(app) == 0
+
+
+def test_delete_expired_is_batched(app):
+    interface = app.session_interface
+    interface.expire_batch = 2
+    now = int(time.time())
+    for i in range(5):
+        interface.execute(
+            "INSERT INTO sessions (sid, data, expiry) VALUES (?, ?, ?)",
+            (f"old{i}", "{}", now - 10),
+        )
+    interface.execute(
+        "INSERT INTO sessions (sid, data, expiry) VALUES (?, ?, ?)",
+        ("live", "{}", now + 100),
+    )
+    assert interface.delete_expired(now) == 2
+    assert interface.delete_expired(now) == 2
+    assert interface.delete_expired(now) == 1
+    assert interface.delete_expired(now) == 0
+    assert count_rows(app) == 1
+
+
+def test_permanent_cookie_matches_row_expiry(app):
+    @app.route("/remember")
+    def remember():
+        session.permanent = True
+        session["handle"] = "bob"
+        return "ok"
+
+    client = app.test_client()
+    client.get("/remember")
+    row, _ = app.session_interface.execute("SELECT expiry FROM sessions")
+    cookie = client.get_cookie("session")
+    assert int(cookie.expires.timestamp()) == row[0]
+    # A later request within the first half of the lifetime leaves both alone
+    assert "Set-Cookie" not in client.get("/read").headers
@@ -0,0 +1,64 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+import database_setup
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Seconds to import app.py in a fresh interpreter, best of three. It takes
+# about 0.3s on a laptop; nearly all of that is importing Flask and friends.
+IMPORT_BUDGET = 1.0
+
+MEASURE = """
+import sys, time
+sys.path.insert(0, sys.argv[1])
+start = time.perf_counter()
+import app
+print(time.perf_counter() - start)
+"""
+
+
+def test_import_time_budget(tmp_path):
+    # No tweetor.db at all: importing must not read or create it
+    for name in ("blocklist.txt", "profane_words.json"):
+        os.symlink(os.path.join(ROOT, name), tmp_path / name)
+    timings = []
+    for _ in range(3):
+        result = subprocess.run(
+            [sys.executable, "-c", MEASURE, ROOT], cwd=tmp_path, capture_output=True, text=True, check=True
+        )
+        # Nothing but the timing on stdout
+        timings.append(float(result.stdout))
+    assert not (tmp_path / "tweetor.db").exists()
+    assert min(timings) < IMPORT_BUDGET, f"importing app took {min(timings):.2f}s"
+
+
+def test_setup_is_one_read_when_current(app_dir):
+    db = sqlite3.connect("tweetor.db")
+    assert db.execute("PRAGMA user_version").fetchone()[0] == database_setup.SCHEMA_VERSION
+    # A current database is left alone, so a missing index stays missing
+    db.execute("DROP INDEX flits_timestamp")
+    db.commit()
+    database_setup.setup()
+    assert not db.execute("SELECT 1 FROM sqlite_master WHERE name = 'flits_timestamp'").fetchone()
+
+    # An older one gets everything again, without tripping over what it has
+    db.execute("PRAGMA user_version = 0")
+    database_setup.setup()
+    assert db.execute("SELECT 1 FROM sqlite_master WHERE name = 'flits_timestamp'").fetchone()
+    assert db.execute("SELECT count(*) FROM users WHERE username = 'admin'").fetchone()[0] == 1
+
+
+def test_setup_migrates_old_flits_table(tmp_path):
+    database = str(tmp_path / "tweetor.db")
+    db = sqlite3.connect(database)
+    db.execute(
+        "CREATE TABLE flits (id INTEGER PRIMARY KEY AUTOINCREMENT, content TEXT, timestamp TIMESTAMP, "
+        "profane_flit TEXT, userHandle TEXT NOT NULL, username TEXT NOT NULL, hashtag TEXT NOT NULL, ip TEXT NOT NULL)"
+    )
+    db.commit()
+    database_setup.setup(database)
+    columns = [row[1] for row in db.execute("PRAGMA table_info(flits)")]
+    assert columns[-len(database_setup.FLIT_COLUMNS):] == list(database_setup.FLIT_COLUMNS)
@@ -0,0 +1,229 @@
+"""The repository contract, run against SQLite and PostgreSQL alike.
+
+The PostgreSQL runs use TWEETOR_TEST_POSTGRES (a postgresql:// URL to a
+server the tests may create databases on) if it is set. Otherwise they
+start a throwaway cluster with initdb and pg_ctl from PATH or
+TWEETOR_PG_BIN, and are skipped if there are none or when running as
+root, which PostgreSQL refuses.
+"""
+import os
+import re
+import shutil
+import socket
+import subprocess
+import uuid
+
+import pytest
+
+import flit_cache
+import storage
+
+
+def pg_bin(name):
+    directory = os.getenv("TWEETOR_PG_BIN")
+    return os.path.join(directory, name) if directory else shutil.which(name)
+
+
+@pytest.fixture(scope="session")
+def postgres_server(tmp_path_factory):
+    url = os.getenv("TWEETOR_TEST_POSTGRES")
+    if url:
+        yield url
+        return
+    if not pg_bin("initdb") or not os.path.exists(pg_bin("initdb")):
+        pytest.skip("no PostgreSQL: set TWEETOR_TEST_POSTGRES or put initdb on PATH")
+    if os.geteuid() == 0:
+        pytest.skip("PostgreSQL won't run as root: set TWEETOR_TEST_POSTGRES")
+
+    data = tmp_path_factory.mktemp("postgres")
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    subprocess.run([pg_bin("initdb"), "-D", str(data / "data"), "-U", "postgres", "-A", "trust"], check=True, capture_output=True)
+    options = f"-p {port} -k {data} -c listen_addresses=127.0.0.1 -c fsync=off"
+    subprocess.run(
+        [pg_bin("pg_ctl"), "-D", str(data / "data"), "-o", options, "-l", str(data / "log"), "-w", "start"],
+        check=True,
+        capture_output=True,
+    )
+    try:
+        yield f"postgresql://postgres@127.0.0.1:{port}/postgres"
+    finally:
+        subprocess.run([pg_bin("pg_ctl"), "-D", str(data / "data"), "-m", "immediate", "stop"], capture_output=True)
+
+
+def postgres_database(server_url):
+    """A new, empty database on the server, and a function that drops it."""
+    import psycopg2
+
+    name = f"tweetor_test_{uuid.uuid4().hex[:12]}"
+    admin = psycopg2.connect(server_url)
+    admin.autocommit = True
+    admin.cursor().execute(f"CREATE DATABASE {name}")
+
+    def drop():
+        admin.cursor().execute(f"DROP DATABASE IF EXISTS {name} WITH (FORCE)")
+        admin.close()
+
+    return re.sub(r"/[^/]*$", f"/{name}", server_url), drop
+
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+def store(request, monkeypatch, tmp_path):
+    if request.param == "sqlite":
+        request.getfixturevalue("app_dir")
+        backend = storage.SQLiteBackend()
+        drop = None
+    else:
+        url, drop = postgres_database(request.getfixturevalue("postgres_server"))
+        backend = storage.PostgresBackend(url, size=4)
+        backend.create_schema()
+    monkeypatch.setattr(storage, "_backend", backend)
+    flit_cache.clear()
+    yield storage
+    if drop:
+        backend.close()
+        drop()
+
+
+def execute(sql, params=()):
+    storage.backend().transaction(lambda cursor: cursor.execute(sql, params))
+
+
+def signup(store, *handles):
+    for handle in handles:
+        store.create_user(handle, handle, "hash")
+
+
+def test_insert_flit(store):
+    signup(store, "alice", "bob")
+    first = store.insert_flit("alice", "alice", "hello #World @bob", "", None, "1.2.3.4")
+    assert store.insert_flit("alice", "alice", "hello #World @bob", "", None, "1.2.3.4") is None
+    reflit = store.insert_flit("bob", "bob", "look", "", first, "1.2.3.4")
+    orphan = store.insert_flit("bob", "bob", "lost", "", 10**9, "1.2.3.4")
+
+    flit = store.flit(first)
+    assert (flit["userHandle"], flit["content"], flit["profane_flit"], flit["is_reflit"]) == ("alice", "hello #World @bob", "no", 0)
+    assert re.fullmatch(r"\d{4}-\d\d-\d\d \d\d:\d\d:\d\d", flit["timestamp"])
+    assert (store.flit(reflit)["is_reflit"], store.flit(reflit)["original_flit_id"]) == (1, first)
+    assert (store.flit(orphan)["is_reflit"], store.flit(orphan)["original_flit_id"]) == (0, -1)
+    assert store.flit(10**9) is None and store.flit("nope") is None
+
+    # Derived rows went in with the flit
+    assert [tuple(row) for row in store.fetchall("SELECT tag, flit_id FROM flit_hashtags")] == [("world", first)]
+    assert [tuple(row) for row in store.fetchall("SELECT handle, kind, source_id FROM notifications")] == [("bob", "mention", first)]
+    assert tuple(store.fetchone("SELECT flit_id FROM user_last_flit WHERE handle = 'bob'")) == (orphan,)
+    assert sorted(store.all_flit_ids()) == [first, reflit, orphan]
+
+
+def test_failed_transaction_leaves_nothing(store):
+    def fail(cursor):
+        cursor.execute("INSERT INTO users (username, password, handle, turbo) VALUES ('x', '', 'x', 0)")
+        raise RuntimeError
+
+    with pytest.raises(RuntimeError):
+        store.backend().transaction(fail)
+    assert store.user("x") is None
+
+
+def test_feed_page(store):
+    signup(store, "alice", "bob", "carol", "gone")
+    ids = [store.insert_flit(h, h, f"{h} {i}", "", None, "") for i in range(3) for h in ("alice", "bob", "carol", "gone")]
+    execute("UPDATE flits SET profane_flit = 'yes' WHERE id = ?", (ids[0],))
+    execute("INSERT INTO deletion_jobs (kind, target) VALUES ('user', 'gone')")
+    store.block("alice", "bob")
+
+    everyone = [flit["id"] for flit in store.feed_page("Not Logged In", 100, 0)]
+    assert everyone == [i for i in reversed(ids) if i != ids[0] and i not in ids[3::4]]
+    assert [flit["userHandle"] for flit in store.feed_page("alice", 100, 0)] == ["carol", "alice", "carol", "alice", "carol"]
+    assert [flit["id"] for flit in store.feed_page("Not Logged In", 2, 2)] == everyone[2:4]
+    assert set(dict(store.feed_page("alice", 1, 0)[0])) == {
+        "id", "content", "timestamp", "userHandle", "username", "hashtag", "is_reflit", "original_flit_id", "meme_link",
+    }
+
+
+def test_profile(store):
+    signup(store, "alice")
+    for i in range(7):
+        execute(
+            "INSERT INTO flits (content, timestamp, profane_flit, userHandle, username, hashtag, ip, is_reflit, original_flit_id) "
+            "VALUES (?, ?, 'no', 'alice', 'alice', '', '', 0, -1)",
+            (f"flit {i}", f"2024-01-0{i + 1} 12:00:00"),
+        )
+    hot, total, oldest = store.user_flit_stats("alice")
+    assert (hot, total, oldest) == (7, 7, "2024-01-01 12:00:00")
+    page = store.user_flits("alice", 3, 3, hot)
+    assert [flit["content"] for flit in page] == ["flit 3", "flit 2", "flit 1"]
+    assert store.user_flit_stats("nobody") == (0, 0, None)
+
+
+def test_users(store):
+    signup(store, "alice")
+    assert store.user("alice")["username"] == "alice"
+    assert store.user("nobody") is None
+    assert len(store.users_named("alice")) == 1
+    store.set_password("alice", "new")
+    assert store.user("alice")["password"] == "new"
+    assert "alice" in store.all_user_handles()
+    assert not store.being_deleted("alice")
+    execute("INSERT INTO deletion_jobs (kind, target) VALUES ('user', 'alice')")
+    assert store.being_deleted("alice")
+
+
+def test_blocks(store):
+    store.block("alice", "bob")
+    store.block("alice", "bob")
+    store.block("alice", "carol")
+    assert sorted(store.blocked_handles("alice")) == ["bob", "carol"]
+    store.unblock("alice", "bob")
+    assert store.blocked_handles("alice") == ["carol"]
+    assert store.blocked_handles("bob") == []
+
+
+def test_direct_messages(store):
+    first = store.insert_dm("alice", "bob", "hi", "no")
+    store.insert_dm("bob", "alice", "hey", "no")
+    store.insert_dm("alice", "bob", "rude", "yes")
+    store.insert_dm("carol", "alice", "other", "no")
+    assert re.fullmatch(r"\d{4}-\d\d-\d\d \d\d:\d\d:\d\d", first["timestamp"])
+
+    assert [dm["content"] for dm in store.conversation("alice", "bob")] == ["hey", "hi"]
+    assert [dm["content"] for dm in store.conversation("bob", "alice")] == ["hey", "hi"]
+    assert sorted(store.engaged_handles("alice")) == ["bob", "carol"]
+    assert tuple(store.fetchone("SELECT handle, kind, source_id FROM notifications WHERE source_id = ?", (first["id"],))) == ("bob", "dm", first["id"])
+
+
+def test_report_flit(store):
+    store.report_flit(5, "alice", "spam")
+    assert tuple(store.fetchone("SELECT flit_id, reporter_handle, reason FROM reported_flits")) == (5, "alice", "spam")
+
+
+def test_thread(store):
+    root = store.insert_flit("alice", "alice", "root", "", None, "")
+    a = store.insert_flit("bob", "bob", "a", "", None, "", root)
+    b = store.insert_flit("alice", "alice", "b", "", None, "", root)
+    a1 = store.insert_flit("alice", "alice", "a1", "", None, "", a)
+    execute("INSERT INTO deletion_jobs (kind, target) VALUES ('user', 'bob')")
+
+    ancestors, replies, after = store.thread(store.flit(a1))
+    assert [(flit["content"], bool(flit["hidden"])) for flit in ancestors] == [("root", False), ("a", True)]
+    assert (replies, after) == ([], None)
+    _, replies, after = store.thread(store.flit(root), limit=2)
+    assert [(depth, reply["id"]) for depth, reply in replies] == [(0, a), (1, a1)]
+    _, replies, after = store.thread(store.flit(root), after, limit=2)
+    assert ([reply["id"] for _, reply in replies], after) == ([b], None)
+    assert store.flit(root)["reply_count"] == 2
+
+
+def test_app_refuses_postgresql(app_dir, monkeypatch):
+    import app as tweetor
+
+    monkeypatch.setattr(storage, "_backend", None)
+    monkeypatch.setenv("TWEETOR_DATABASE_URL", "postgresql://tweetor@db.example/tweetor")
+    with pytest.raises(RuntimeError, match="PostgreSQL"):
+        tweetor.create_app()
+    # Decided without connecting
+    assert storage._backend is None
+
+    monkeypatch.setenv("TWEETOR_DATABASE_URL", "sqlite:///tweetor.db")
+    assert tweetor.create_app() is tweetor.app
@@ -0,0 +1,133 @@
+import re
+import sqlite3
+
+import pytest
+
+import storage
+import threads
+
+
+@pytest.fixture
+def tweetor(app_dir, monkeypatch):
+    import app as tweetor
+
+    tweetor.app.config["WTF_CSRF_ENABLED"] = False
+    tweetor.limiter.enabled = False
+    monkeypatch.setattr(tweetor, "is_profanity", lambda text: {"status": "success", "profanity": {"matches": []}})
+    monkeypatch.setattr(tweetor, "track", lambda *args: None)
+    return tweetor
+
+
+def post(content, reply_to=None, handle="alice"):
+    return storage.insert_flit(handle, handle, content, "", None, "127.0.0.1", reply_to)
+
+
+def shape(replies):
+    return [(depth, reply["content"]) for depth, reply in replies]
+
+
+def test_thread_order_and_counts(tweetor):
+    root = post("root")
+    a = post("a", root)
+    b = post("b", root)
+    a1 = post("a1", a)
+    a1x = post("a1x", a1)
+    post("b1", b)
+    post("a2", a)
+
+    ancestors, replies, after = storage.thread(storage.flit(root))
+    assert ancestors == [] and after is None
+    # Depth first, each reply under its parent
+    assert shape(replies) == [(0, "a"), (1, "a1"), (2, "a1x"), (1, "a2"), (0, "b"), (1, "b1")]
+    assert [storage.flit(i)["reply_count"] for i in (root, a, b, a1, a1x)] == [2, 2, 1, 1, 0]
+
+    ancestors, replies, _ = storage.thread(storage.flit(a1))
+    assert [flit["content"] for flit in ancestors] == ["root", "a"]
+    assert shape(replies) == [(0, "a1x")]
+
+    # A reply to nothing is a plain flit
+    orphan = post("orphan", 10**9)
+    assert (storage.flit(orphan)["reply_to"], storage.flit(orphan)["thread_path"]) == (None, None)
+
+
+def test_paging(tweetor):
+    root = post("root")
+    ids = [post(f"reply {i}", root) for i in range(7)]
+    seen, after = [], None
+    while True:
+        _, replies, after = storage.thread(storage.flit(root), after, limit=3)
+        seen += [reply["id"] for _, reply in replies]
+        if after is None:
+            break
+    assert seen == ids
+
+
+def test_depth_cap(tweetor, monkeypatch):
+    monkeypatch.setattr(threads, "MAX_DEPTH", 3)
+    chain = [post("0")]
+    for i in range(1, 8):
+        chain.append(post(str(i), chain[-1]))
+    paths = [storage.flit(i)["thread_path"] for i in chain]
+    assert max(threads.depth(path) for path in paths[1:]) == 3
+
+    # The top of the thread goes as deep as the cap, then hands over
+    _, replies, _ = storage.thread(storage.flit(chain[0]))
+    assert shape(replies) == [(0, "1"), (1, "2")]
+    assert threads.continues(replies[-1][1])
+    _, replies, _ = storage.thread(storage.flit(chain[2]))
+    assert shape(replies) == [(0, "3"), (1, "4")]
+
+    # Below the hand-over, ancestors reach back to it and no further
+    ancestors, _, _ = storage.thread(storage.flit(chain[4]))
+    assert [flit["content"] for flit in ancestors] == ["2", "3"]
+    assert ancestors[0]["reply_to"] == chain[1]
+
+
+def test_reply_page_and_deletion(tweetor):
+    root = post("root", handle="bob")
+    client = tweetor.app.test_client()
+    with client.session_transaction() as session:
+        session["handle"] = session["username"] = "alice"
+    response = client.post(
+        "/submit_flit", data={"content": "hi bob", "meme_link": "", "reply_to": root}, headers={"User-Agent": "Mozilla"}
+    )
+    assert response.headers["Location"] == f"/flits/{root}"
+    page = client.get(f"/flits/{root}").data
+    assert b"hi bob" in page and b"1 reply" in page
+
+    (reply,) = [reply["id"] for _, reply in storage.thread(storage.flit(root))[1]]
+    tweetor.deletions.delete_flits([reply])
+    assert storage.flit(root)["reply_count"] == 0
+
+
+def test_reply_page_indents_shown_replies(tweetor):
+    root = post("root")
+    a = post("a", root)
+    rude = post("rude", a)
+    post("under rude", rude)
+    post("b", root)
+    db = sqlite3.connect("tweetor.db")
+    db.execute("UPDATE flits SET profane_flit = 'yes' WHERE id = ?", (rude,))
+    db.commit()
+    db.close()
+    storage.flit_cache.clear()
+
+    page = tweetor.app.test_client().get(f"/flits/{root}").data.decode()
+    indents = re.findall(r'margin-left: (\d+)em">.*?class="flit-content"[^>]*>([^<]*)</a>', page, re.S)
+    # The profane reply is left out, and what is under it keeps its depth
+    assert indents == [("0", "a"), ("4", "under rude"), ("0", "b")]
+
+
+def test_replies_are_an_index_range_read(tweetor):
+    root = post("root")
+    db = sqlite3.connect("tweetor.db")
+    prefix = threads.segment(root)
+    plan = " ".join(
+        row[-1]
+        for row in db.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM flits WHERE thread_path > ? AND thread_path < ? ORDER BY thread_path LIMIT 50",
+            (prefix, prefix + ":"),
+        )
+    )
+    assert "USING INDEX flits_thread (thread_path>? AND thread_path<?)" in plan
+    assert "TEMP B-TREE" not in plan
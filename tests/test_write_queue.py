@@ -0,0 +1,109 @@
+import sqlite3
+import threading
+
+import pytest
+
+import helpers
+from write_queue import WriteQueue, WriteQueueFull
+
+
+def insert(cursor, blocker, fail=False):
+    cursor.execute("INSERT INTO blocks (blocker_handle, blocked_handle) VALUES (?, 'x')", (blocker,))
+    if fail:
+        raise ValueError(blocker)
+    return cursor.lastrowid
+
+
+def submit_all(queue, calls):
+    """Submit every (args) at once from its own thread; results or exceptions in order."""
+    results = [None] * len(calls)
+
+    def submit(i, args):
+        try:
+            results[i] = queue.submit(insert, *args)
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=submit, args=(i, args)) for i, args in enumerate(calls)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+        assert not thread.is_alive()
+    return results
+
+
+def blockers():
+    db = sqlite3.connect("tweetor.db")
+    return sorted(row[0] for row in db.execute("SELECT blocker_handle FROM blocks"))
+
+
+def test_a_failing_write_rolls_back_only_itself(app_dir):
+    # A delay long enough that only max_batch can end the batch
+    queue = WriteQueue("tweetor.db", max_batch=3, max_delay=30)
+    a, b, c = submit_all(queue, [("a",), ("b", True), ("c",)])
+    assert isinstance(a, int) and isinstance(c, int)
+    assert isinstance(b, ValueError) and b.args == ("b",)
+    assert blockers() == ["a", "c"]
+    assert (queue.batches, queue.writes) == (1, 3)
+
+
+def test_batches_end_after_max_delay(app_dir):
+    queue = WriteQueue("tweetor.db", max_batch=100, max_delay=0.01)
+    assert queue.submit(insert, "a")
+    assert queue.submit(insert, "b")
+    assert blockers() == ["a", "b"]
+    assert (queue.batches, queue.writes) == (2, 2)
+
+
+def test_a_failed_commit_fails_the_whole_batch(app_dir, monkeypatch):
+    queue = WriteQueue("tweetor.db", max_batch=2, max_delay=30)
+    # Another connection holds the write lock, and the writer's BEGIN
+    # IMMEDIATE gives up straight away
+    connect = sqlite3.connect
+    monkeypatch.setattr(sqlite3, "connect", lambda *args, **kwargs: connect(*args, **dict(kwargs, timeout=0)))
+    other = sqlite3.connect("tweetor.db", isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    results = submit_all(queue, [("a",), ("b",)])
+    other.execute("ROLLBACK")
+    assert all(isinstance(result, sqlite3.OperationalError) for result in results)
+    assert blockers() == []
+
+
+def test_full_queue_is_a_503(app_dir, monkeypatch):
+    queue = WriteQueue("tweetor.db", max_batch=1, max_delay=0, max_pending=1, put_timeout=0.01)
+    release = threading.Event()
+    started = threading.Event()
+
+    def held(cursor):
+        started.set()
+        release.wait(10)
+
+    # One write holds the writer, one more fills the queue
+    first = threading.Thread(target=queue.submit, args=(held,))
+    first.start()
+    started.wait(10)
+    second = threading.Thread(target=queue.submit, args=(insert, "b"))
+    second.start()
+    while queue.pending.empty():
+        pass
+    with pytest.raises(WriteQueueFull):
+        queue.submit(insert, "c")
+
+    import app as tweetor
+
+    tweetor.app.config["WTF_CSRF_ENABLED"] = False
+    tweetor.limiter.enabled = False
+    monkeypatch.setattr(tweetor, "is_profanity", lambda text: {"status": "success", "profanity": {"matches": []}})
+    monkeypatch.setattr(tweetor, "track", lambda *args: None)
+    monkeypatch.setattr(helpers, "write_queue", queue)
+    client = tweetor.app.test_client()
+    with client.session_transaction() as session:
+        session["handle"] = session["username"] = "alice"
+    response = client.post("/submit_flit", data={"content": "hi", "meme_link": ""}, headers={"User-Agent": "Mozilla"})
+    assert response.status_code == 503
+
+    release.set()
+    first.join(10)
+    second.join(10)
+    assert blockers() == ["b"]
@@ -0,0 +1,94 @@
+"""Reply threads, stored as a materialized path on flits.
+
+A reply has reply_to (its parent's id) and thread_path: the ids from the
+top of its thread down to itself, each zero-padded to SEGMENT digits, so
+sorting by thread_path lists a thread depth first, every reply under its
+parent. A flit's replies, and theirs, are the paths that start with the
+flit's own (a flit that isn't a reply counts as the one-segment path of
+its id). flits_thread indexes thread_path, so the flit page loads a page
+of them with one range scan, and its ancestors by id from the same
+query (storage.thread()). reply_count is each flit's number of direct
+replies, kept up to date on write by write_reply() and discard().
+
+Paths stop growing at MAX_DEPTH segments. A reply to a flit that deep
+starts a new path under its parent's id alone. Its parent's page shows
+"continue this thread" rather than going deeper, and the reply's own
+page links back up. Without the cap, a chain of n replies would store
+n**2 / 2 segments.
+
+Like hashtag timelines, threads only look at the hot table: replies
+archive.py has moved out drop out of them.
+"""
+SEGMENT = 10
+MAX_DEPTH = 32
+PAGE_SIZE = 50
+
+
+def segment(flit_id):
+    return f"{int(flit_id):0{SEGMENT}d}"
+
+
+def path_of(flit):
+    """flit's thread_path, None if it isn't a reply or is an archived row from before threads."""
+    return flit["thread_path"] if "thread_path" in flit.keys() else None
+
+
+def depth(path):
+    return len(path) // SEGMENT
+
+
+def child_prefix(flit_id, path):
+    """The path flit_id's replies start with."""
+    if path is None or depth(path) >= MAX_DEPTH:
+        return segment(flit_id)
+    return path
+
+
+def ancestor_ids(path):
+    """The ids in path above its last, top first."""
+    if path is None:
+        return []
+    return [int(path[i : i + SEGMENT]) for i in range(0, len(path) - SEGMENT, SEGMENT)]
+
+
+def continues(reply):
+    """Whether reply has replies that only its own page shows."""
+    return depth(reply["thread_path"]) >= MAX_DEPTH and reply["reply_count"] > 0
+
+
+def write_reply(cursor, flit_id, reply_to):
+    """Make the new flit flit_id a reply to reply_to, if that exists."""
+    cursor.execute("SELECT thread_path FROM flits WHERE id = ?", (reply_to,))
+    parent = cursor.fetchone()
+    if parent is None:
+        return
+    cursor.execute(
+        "UPDATE flits SET reply_to = ?, thread_path = ? WHERE id = ?",
+        (reply_to, child_prefix(reply_to, parent["thread_path"]) + segment(flit_id), flit_id),
+    )
+    cursor.execute("UPDATE flits SET reply_count = reply_count + 1 WHERE id = ?", (reply_to,))
+
+
+def discard(cursor, flit_ids):
+    """Take flits about to be deleted off their parents' reply counts.
+
+    Returns the parents' ids.
+    """
+    marks = ",".join("?" * len(flit_ids))
+    parents = [
+        row[0]
+        for row in cursor.execute(
+            f"SELECT DISTINCT reply_to FROM flits WHERE id IN ({marks}) AND reply_to IS NOT NULL", flit_ids
+        ).fetchall()
+    ]
+    if parents:
+        cursor.execute(
+            f"""
+            UPDATE flits SET reply_count = reply_count - (
+                SELECT count(*) FROM flits AS reply WHERE reply.id IN ({marks}) AND reply.reply_to = flits.id
+            )
+            WHERE id IN ({",".join("?" * len(parents))})
+        """,
+            (*flit_ids, *parents),
+        )
+    return parents
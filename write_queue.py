@@ -0,0 +1,107 @@
+"""Group commit for flit and DM inserts.
+
+With the queue enabled (TWEETOR_WRITE_QUEUE=1) a write is handed to a single
+writer thread instead of opening its own transaction. The writer takes up to
+max_batch queued writes, or whatever arrived within max_delay seconds of the
+first one, and runs them all in one BEGIN IMMEDIATE ... COMMIT, so a burst of
+posts costs one lock acquisition and one fsync instead of one each. Each
+write runs under its own SAVEPOINT, so one failing write doesn't take the rest
+of its batch down with it. Callers block until the batch has committed and get
+their own write's return value (or exception) back.
+"""
+import queue
+import sqlite3
+import threading
+import time
+
+import helpers
+
+
+class WriteQueueFull(Exception):
+    pass
+
+
+class Write:
+    def __init__(self, f, args):
+        self.f = f
+        self.args = args
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class WriteQueue:
+    def __init__(self, database, max_batch=64, max_delay=0.005, max_pending=1024, put_timeout=5):
+        self.database = database
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.put_timeout = put_timeout
+        self.pending = queue.Queue(max_pending)
+        self.writer = None
+        self.start_lock = threading.Lock()
+        self.batches = 0
+        self.writes = 0
+
+    def submit(self, f, *args):
+        """Run f(cursor, *args) in the next batch and return its result."""
+        if self.writer is None:
+            self.start()
+        write = Write(f, args)
+        try:
+            self.pending.put(write, timeout=self.put_timeout)
+        except queue.Full:
+            raise WriteQueueFull("Too many writes waiting, try again later") from None
+        write.done.wait()
+        if write.error is not None:
+            raise write.error
+        return write.result
+
+    def start(self):
+        # Started on first use so a forked worker gets its own writer
+        with self.start_lock:
+            if self.writer is None:
+                self.writer = threading.Thread(target=self.run, name="write-queue", daemon=True)
+                self.writer.start()
+
+    def run(self):
+        db = sqlite3.connect(self.database, isolation_level=None, check_same_thread=False)
+        db.row_factory = sqlite3.Row
+        while True:
+            batch = [self.pending.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.pending.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            # The commit itself goes through the db threadpool under gevent
+            helpers.run_db(self.commit, db, batch)
+            for write in batch:
+                write.done.set()
+
+    def commit(self, db, batch):
+        cursor = db.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            for write in batch:
+                cursor.execute("SAVEPOINT write")
+                try:
+                    write.result = write.f(cursor, *write.args)
+                    cursor.execute("RELEASE write")
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO write")
+                    cursor.execute("RELEASE write")
+                    write.error = e
+            cursor.execute("COMMIT")
+        except Exception as e:
+            # Nothing in the batch is durable, fail every write in it
+            if db.in_transaction:
+                cursor.execute("ROLLBACK")
+            for write in batch:
+                write.result = None
+                write.error = e
+        self.batches += 1
+        self.writes += len(batch)